@@ -0,0 +1,201 @@
+# 📊 Нагрузочный прогон бота без сети.
+#
+#   python -m bench --users 400 --concurrency 200 --out bench/baseline.json
+#   python -m bench --compare bench/baseline.json
+#   python -m bench --no-metrics --compare bench/baseline.json   # накладные расходы метрик
+#
+# Синтетические апдейты подаются прямо в dp из bot.py; Bot API заменён заглушкой,
+# база — временный файл. Для каждой фазы (/reg, /match, confirm, /match2,
+# team_confirm, /rating) считаются пропускная способность, p50/p95/p99 задержки
+# обработчика и число SQL-запросов.
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from bench.stub import StubSession
+from bench.updates import callback_update, message_update
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Bench:
+    def __init__(self, app_bot, db, concurrency):
+        self.app_bot = app_bot
+        self.db = db
+        self.concurrency = concurrency
+        self.statements = 0
+        self.results = {}
+
+    def _count_statement(self, _):
+        self.statements += 1
+
+    async def trace(self):
+        # Запросы считаются на соединении потока, в котором работает AsyncRatingStore
+        db = self.db
+        await self.app_bot.store._run(lambda: db.connect().set_trace_callback(self._count_statement))
+
+    async def query(self, sql, *args):
+        db = self.db
+        return await self.app_bot.store._run(lambda: db.connect().execute(sql, args).fetchall())
+
+    async def phase(self, name, payloads):
+        dp, bot = self.app_bot.dp, self.app_bot.bot
+        latencies = []
+        queue = asyncio.Queue()
+        for payload in payloads:
+            queue.put_nowait(payload)
+
+        async def worker():
+            while not queue.empty():
+                payload = queue.get_nowait()
+                started = time.perf_counter()
+                await dp.feed_raw_update(bot, payload)
+                latencies.append(time.perf_counter() - started)
+
+        statements = self.statements
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+        statements = self.statements - statements
+
+        self.results[name] = {
+            "updates": len(payloads),
+            "seconds": round(elapsed, 4),
+            "throughput": round(len(payloads) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "statements": statements,
+            "statements_per_update": round(statements / len(payloads), 2),
+        }
+        r = self.results[name]
+        print(f"{name:>13}: {r['updates']:6d} апд, {r['throughput']:8.1f}/с, "
+              f"p50 {r['p50_ms']:7.2f} мс, p95 {r['p95_ms']:7.2f} мс, p99 {r['p99_ms']:7.2f} мс, "
+              f"SQL/апд {r['statements_per_update']:.2f}")
+
+
+def callback_data(keyboard):
+    # Данные кнопки «Подтвердить» — берутся из клавиатуры бота, как их получит игрок
+    return keyboard.inline_keyboard[0][0].callback_data
+
+
+async def run(args):
+    os.environ.setdefault("API_TOKEN", "42:BENCH")
+    from src import db, metrics
+    metrics.enabled = not args.no_metrics
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    import bot as app_bot
+    from src.notify import Notifier
+
+    app_bot.bot.session = StubSession()
+    # Уведомления уходят в заглушку без лимитов, чтобы не мерить ожидание флуд-контроля
+    app_bot.notifier = Notifier(app_bot.bot, global_rate=1e9, chat_interval=0)
+    app_bot.notifier.start()
+
+    bench = Bench(app_bot, db, args.concurrency)
+    await bench.trace()
+    users = range(1, args.users + 1)
+
+    await bench.phase("reg", [message_update(u, "/reg") for u in users])
+
+    pairs = [(u, u + 1) for u in users if u % 2 and u + 1 in users]
+    await bench.phase("match", [message_update(a, f"/match @user{b} 3:1") for a, b in pairs])
+
+    rows = await bench.query("""
+    SELECT m.id, p.telegram_id FROM matches m JOIN players p ON p.id = m.player2_id
+    WHERE m.confirmed = 0
+    """)
+    await bench.phase("confirm", [
+        callback_update(telegram_id, callback_data(app_bot.confirm_keyboard(match_id, 0, telegram_id)))
+        for match_id, telegram_id in rows
+    ])
+
+    quads = [tuple(range(u, u + 4)) for u in users if u % 4 == 1 and u + 3 in users]
+    await bench.phase("match2", [
+        message_update(a, f"/match2 @user{b} @user{c} @user{d} 3:1") for a, b, c, d in quads
+    ])
+
+    rows = await bench.query("""
+    SELECT tm.id, p2.telegram_id, p3.telegram_id, p4.telegram_id FROM team_matches tm
+    JOIN players p2 ON p2.id = tm.team1_player2_id
+    JOIN players p3 ON p3.id = tm.team2_player1_id
+    JOIN players p4 ON p4.id = tm.team2_player2_id
+    """)
+    await bench.phase("team_confirm", [
+        callback_update(telegram_id, callback_data(app_bot.team_confirm_keyboard(match_id, 0, telegram_id)))
+        for match_id, *telegram_ids in rows
+        for telegram_id in telegram_ids
+    ])
+
+    if args.players:
+        # Дополнительные игроки без матчей — для замера /rating на большой таблице
+        db_name = db.DB_NAME
+
+        def seed():
+            conn = db.connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO players (telegram_id, username, rating) VALUES (?, ?, ?)",
+                    [(10_000_000 + i, f"extra{i}", 1000 + i % 1000) for i in range(args.players)],
+                )
+            return db_name
+
+        await app_bot.store._run(seed)
+        app_bot.store.leaderboard.invalidate()
+
+    commands = ["/rating", "/rating me", "/rating 2", "/whoami"]
+    await bench.phase("rating", [
+        message_update(u, commands[i % len(commands)]) for i, u in enumerate(list(users) * args.repeat)
+    ])
+
+    await app_bot.notifier.stop()
+    app_bot.store.close()
+    if args.metrics_out:
+        with open(args.metrics_out, "w") as f:
+            f.write(metrics.registry.render())
+    return bench.results
+
+
+def compare(results, baseline):
+    print("\nСравнение с базовой линией (текущее / базовое):")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        print(f"{name:>13}: пропускная способность x{current['throughput'] / base['throughput']:.2f}, "
+              f"p99 x{current['p99_ms'] / max(base['p99_ms'], 1e-6):.2f}, "
+              f"SQL/апд {base['statements_per_update']} → {current['statements_per_update']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота")
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3, help="сколько раз каждый игрок запрашивает /rating")
+    parser.add_argument("--players", type=int, default=0, help="добавить игроков без матчей перед /rating")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённым JSON")
+    parser.add_argument("--no-metrics", action="store_true", help="выключить сбор метрик")
+    parser.add_argument("--metrics-out", help="сохранить метрики Prometheus в файл")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# 🚀 Замер холодного старта бота.
+#
+#   python -m bench.startup --runs 5 --players 5000
+#
+# Каждый запуск — новый процесс Python на уже заполненной базе: импорт bot.py,
+# dp.startup и первый апдейт (/whoami) через заглушку Bot API. Печатает время
+# до готовности к приёму апдейтов и до первого обработанного апдейта.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+async def child(db_name):
+    from time import perf_counter
+    started = perf_counter()
+    os.environ.setdefault("API_TOKEN", "42:BENCH")
+    from src import db
+    db.DB_NAME = db_name
+    import bot as app_bot
+    from bench.stub import StubSession
+    from bench.updates import message_update
+
+    imported = perf_counter() - started
+    app_bot.bot.session = StubSession()
+    await app_bot.dp.emit_startup(bot=app_bot.bot)
+    ready = perf_counter() - started
+    await app_bot.dp.feed_raw_update(app_bot.bot, message_update(1, "/whoami"))
+    first_update = perf_counter() - started
+    await app_bot.dp.emit_shutdown(bot=app_bot.bot)
+    print(json.dumps({"import": imported, "startup": ready, "first_update": first_update}))
+
+
+def seed(db_name, players):
+    from src import db
+    db.DB_NAME = db_name
+    db.init_db()
+    conn = db.connect()
+    with conn:
+        conn.executemany(
+            "INSERT INTO players (telegram_id, username, rating) VALUES (?, ?, ?)",
+            [(i, f"user{i}", 1000 + i % 1000) for i in range(1, players + 1)],
+        )
+    db.close_connections()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--players", type=int, default=5000)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        asyncio.run(child(args.child))
+        return
+
+    directory = tempfile.mkdtemp()
+    db_name = os.path.join(directory, "bench.sqlite3")
+    seed(db_name, args.players)
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.startup", "--child", db_name],
+            check=True, capture_output=True, text=True, cwd=directory,
+            env=dict(os.environ, PYTHONPATH=os.getcwd()),
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for name in ("import", "startup", "first_update"):
+        values = [r[name] for r in results]
+        print(f"{name:>13}: медиана {statistics.median(values) * 1000:8.1f} мс, "
+              f"мин {min(values) * 1000:8.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# 📦 Замер импорта и экспорта истории: строк в секунду.
+#
+#   python -m bench.transfer --matches 200000 --players 2000
+#
+# Генерирует файлы JSONL и CSV со случайными матчами (20% — 2x2), импортирует каждый
+# во временную базу (с индексами и с --defer-indexes, суффикс -d) и выгружает обратно. Пиковая память
+# процесса печатается, чтобы было видно, что она не растёт вместе с размером файла.
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from src import db, transfer
+
+
+def write_files(directory, matches, players, seed=0):
+    # matches.jsonl (все таблицы, с полем table) и matches.csv, team_matches.csv
+    rnd = random.Random(seed)
+    names = [f"user{i}" for i in range(1, players + 1)]
+    jsonl = os.path.join(directory, "history.jsonl")
+    singles_csv = os.path.join(directory, "matches.csv")
+    teams_csv = os.path.join(directory, "team_matches.csv")
+    with open(jsonl, "w") as out, open(singles_csv, "w") as singles, open(teams_csv, "w") as teams:
+        singles.write(",".join(transfer.COLUMNS["matches"]) + "\n")
+        teams.write(",".join(transfer.COLUMNS["team_matches"]) + "\n")
+        for i, name in enumerate(names, start=1):
+            out.write(json.dumps({"table": "players", "telegram_id": i, "username": name}) + "\n")
+        for _ in range(matches):
+            score = (3, rnd.randint(0, 2)) if rnd.random() < 0.5 else (rnd.randint(0, 2), 3)
+            if rnd.random() < 0.2:
+                a, b, c, d = rnd.sample(names, 4)
+                record = {"table": "team_matches", "team1_player1": a, "team1_player2": b,
+                          "team2_player1": c, "team2_player2": d, "score1": score[0], "score2": score[1]}
+                teams.write(f"{a},{b},{c},{d},{score[0]},{score[1]},,\n")
+            else:
+                a, b = rnd.sample(names, 2)
+                record = {"table": "matches", "player1": a, "player2": b, "score1": score[0], "score2": score[1]}
+                singles.write(f"{a},{b},{score[0]},{score[1]},,\n")
+            out.write(json.dumps(record) + "\n")
+    return jsonl, singles_csv, teams_csv
+
+
+def fresh_database(directory, name):
+    db.close_connections()
+    db.DB_NAME = os.path.join(directory, name)
+    db.init_db()
+    return db.connect()
+
+
+def indexes(conn, deferred):
+    return transfer.deferred_indexes(conn) if deferred else contextlib.nullcontext()
+
+
+def report(action, fmt, counts, elapsed):
+    total = sum(counts.values())
+    print(f"{action:>8} {fmt:>6}: {total:8d} строк за {elapsed:6.2f} с — {total / elapsed:9.0f} строк/с")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер импорта и экспорта истории")
+    parser.add_argument("--matches", type=int, default=200_000)
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--chunk", type=int, default=transfer.CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    jsonl, singles_csv, teams_csv = write_files(directory, args.matches, args.players)
+
+    for deferred in (False, True):
+        label = "jsonl-d" if deferred else "jsonl"
+        conn = fresh_database(directory, f"{label}.sqlite3")
+        started = time.perf_counter()
+        with open(jsonl) as source, indexes(conn, deferred):
+            skipped = []
+            counts, skipped = transfer.import_records(conn, transfer.read_jsonl(source, skipped),
+                                                      skipped=skipped, chunk_size=args.chunk)
+        report("импорт", label, counts, time.perf_counter() - started)
+
+    for deferred in (False, True):
+        label = "csv-d" if deferred else "csv"
+        conn = fresh_database(directory, f"{label}.sqlite3")
+        transfer.import_records(conn, ((i, {"telegram_id": i, "username": f"user{i}"})
+                                       for i in range(1, args.players + 1)), "players")
+        started = time.perf_counter()
+        counts = {}
+        with indexes(conn, deferred):
+            for table, path in (("matches", singles_csv), ("team_matches", teams_csv)):
+                with open(path, newline="") as source:
+                    skipped = []
+                    counts.update(transfer.import_records(conn, transfer.read_csv(source, skipped), table,
+                                                          skipped, args.chunk)[0])
+        report("импорт", label, counts, time.perf_counter() - started)
+
+    for fmt in ("jsonl", "csv"):
+        tables = [None] if fmt == "jsonl" else ["matches", "team_matches"]
+        started = time.perf_counter()
+        counts = {}
+        for table in tables:
+            with open(os.path.join(directory, f"export-{table}.{fmt}"), "w", newline="") as out:
+                counts.update(transfer.export(conn, out, fmt, table))
+        report("экспорт", fmt, counts, time.perf_counter() - started)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Пиковая память процесса: {peak:.0f} МБ")
+    db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import itertools
+import time
+
+# Поддельные апдейты Telegram в виде JSON, как их присылает Bot API
+
+_ids = itertools.count(1)
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "bench", "username": f"user{user_id}"}
+
+
+def message_update(user_id, text, update_id=None):
+    update_id = update_id or next(_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user(user_id),
+            "text": text,
+        },
+    }
+
+
+def callback_update(user_id, data, update_id=None):
+    update_id = update_id or next(_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user(user_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "bench",
+            },
+        },
+    }
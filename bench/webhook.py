@@ -0,0 +1,79 @@
+# 🌐 Замер пропускной способности вебхука на одном процессе.
+#
+#   python -m bench.webhook --updates 2000 --concurrency 50
+#
+# Поднимает aiohttp-приложение из src.webhook на локальном порту с заглушкой
+# вместо Bot API и временной базой, шлёт POST-запросы с поддельными Update
+# и считает, сколько апдейтов в секунду обработано до конца.
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+from bench.stub import StubSession
+from bench.updates import message_update
+
+SECRET = "bench-secret"
+
+
+async def run(updates, concurrency, users):
+    os.environ.setdefault("API_TOKEN", "42:BENCH")
+    from src import db
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    import bot as app_bot
+    from src.webhook import create_app
+
+    app_bot.bot.session = StubSession()
+    app = create_app(app_bot.dp, app_bot.bot, "/webhook", SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f"http://{host}:{port}/webhook"
+
+    commands = ["/whoami", "/rating", "/rating me"]
+    payloads = [message_update(i, "/reg") for i in range(1, users + 1)]
+    payloads += [message_update(i % users + 1, commands[i % len(commands)]) for i in range(updates)]
+
+    async with ClientSession() as http:
+        async with http.post(url, json=payloads[0], headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+            print(f"Неверный секрет: HTTP {response.status}")
+
+        queue = asyncio.Queue()
+        for payload in payloads:
+            queue.put_nowait(payload)
+
+        async def client():
+            while not queue.empty():
+                payload = queue.get_nowait()
+                async with http.post(url, json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+                    response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        accepted = time.perf_counter() - started
+        await app_bot.in_flight.wait()
+        finished = time.perf_counter() - started
+
+    await runner.cleanup()
+    total = len(payloads)
+    print(f"Апдейтов: {total}, параллельных клиентов: {concurrency}")
+    print(f"Приняты за {accepted:.2f} с ({total / accepted:.0f}/с)")
+    print(f"Обработаны за {finished:.2f} с ({total / finished:.0f}/с)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон вебхука")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.updates, args.concurrency, args.users))
+
+
+if __name__ == "__main__":
+    main()
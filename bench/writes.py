@@ -0,0 +1,68 @@
+# ✍️ Замер групповой записи: операции в секунду и коммиты в секунду.
+#
+#   python -m bench.writes --ops 2000 --writers 1 10 100
+#   python -m bench.writes --max-delay-ms 2      # ждать пополнения пачки до 2 мс
+#
+# Каждый «писатель» — корутина, которая создаёт матчи один за другим, как обработчик
+# /match. Сравниваются запись через BatchWriter и отдельная транзакция на операцию.
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from src import db
+from src.store import AsyncRatingStore
+
+
+async def measure(store, writers, ops, batched):
+    per_writer = max(1, ops // writers)
+
+    async def write(func, *args):
+        if batched:
+            return await store.writer.submit(func, *args)
+        return await store._run(func, *args)
+
+    async def writer(n):
+        for i in range(per_writer):
+            await write(db.record_match, 1, 2, 3, 1, 1)
+
+    batches = store.writer.batches
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    elapsed = time.perf_counter() - started
+    total = per_writer * writers
+    commits = store.writer.batches - batches if batched else total
+    return total / elapsed, commits / elapsed, total / commits
+
+
+async def run(args):
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    store = AsyncRatingStore()
+    store.writer.max_ops = args.max_ops
+    store.writer.max_delay = args.max_delay_ms / 1000
+    await store.init_db()
+    await store.register_player(1, "a")
+    await store.register_player(2, "b")
+
+    print(f"{'писателей':>10} {'режим':>10} {'операций/с':>12} {'коммитов/с':>12} {'операций/коммит':>16}")
+    for writers in args.writers:
+        for batched in (False, True):
+            ops_rate, commit_rate, per_commit = await measure(store, writers, args.ops, batched)
+            mode = "пачками" if batched else "по одной"
+            print(f"{writers:>10} {mode:>10} {ops_rate:>12.0f} {commit_rate:>12.0f} {per_commit:>16.1f}")
+    store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер групповой записи")
+    parser.add_argument("--ops", type=int, default=2000, help="операций на каждый прогон")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--max-ops", type=int, default=100, help="размер пачки")
+    parser.add_argument("--max-delay-ms", type=float, default=0, help="сколько ждать пополнения пачки")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
-from asyncio import run
-from aiogram import Bot, Dispatcher, types, F
+# ⏱ Отсчёт времени запуска — до тяжёлых импортов (aiogram и pydantic)
+from time import perf_counter
+PROCESS_STARTED = perf_counter()
+
+import logging
+from asyncio import create_task, run, sleep
+from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
@@ -8,40 +13,123 @@ from aiogram.types import (
 from dotenv import load_dotenv
 from os import environ
 
-from src.db import *
+from src import db, metrics
+from src.callbacks import CallbackCodec, Payload, secret_from_token
+from src.db import TEAM_EXPIRED, TEAM_FINALIZED, TEAM_PARTIAL, TEAM_PENDING, player_cache
+from src.matchmaking import balance_teams, team_rating
+from src.middlewares import (
+    CallbackDataMiddleware, ClubMiddleware, DeduplicationMiddleware, FirstUpdateMiddleware, HandlerTimingMiddleware,
+    InFlightMiddleware, ThrottlingMiddleware, UpdateMetricsMiddleware
+)
+from src.notify import Notifier
+from src.ratings import expected_score
+from src.shards import ShardResolver
+from src.store import AsyncRatingStore
+from src.throttle import RateLimiter
 
-# Инициализация
-init_db()
+# Инициализация. Схема базы проверяется при первом обращении к ней (src.shards), а не здесь
 load_dotenv()
 API_TOKEN = environ.get("API_TOKEN")
+# Если задан WEBHOOK_URL, апдейты принимаются вебхуком, иначе — long polling
+WEBHOOK_URL = environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = environ.get("WEBHOOK_SECRET")
+WEBAPP_HOST = environ.get("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(environ.get("WEBAPP_PORT", 8080))
+SHUTDOWN_TIMEOUT = float(environ.get("SHUTDOWN_TIMEOUT", 30))
+# Если задан METRICS_PORT, метрики Prometheus отдаются на http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = environ.get("METRICS_PORT")
+# Базы клубов (групповых чатов); личные чаты пишут в общую db.sqlite3
+CLUBS_DIR = environ.get("CLUBS_DIR", "clubs")
+CLUBS_OPEN_LIMIT = int(environ.get("CLUBS_OPEN_LIMIT", 64))
+# Длина периода Glicko-2 для клубов с этой системой рейтинга
+RATING_PERIOD_HOURS = float(environ.get("RATING_PERIOD_HOURS", 24))
+
+# Неподтверждённый матч истекает через MATCH_TTL_HOURS (0 — никогда)
+MATCH_TTL_HOURS = float(environ.get("MATCH_TTL_HOURS", 48))
+MATCH_SWEEP_SECONDS = float(environ.get("MATCH_SWEEP_SECONDS", 300))
+MATCH_SWEEP_BATCH = 500
+db.MATCH_TTL_HOURS = MATCH_TTL_HOURS or None
+# Как часто снимать таблицу текущего сезона для /rating season=<n> (0 — не снимать)
+SNAPSHOT_SECONDS = float(environ.get("SNAPSHOT_SECONDS", 3600))
+# Ключ подписи данных кнопок; без CALLBACK_SECRET выводится из API_TOKEN
+CALLBACK_SECRET = environ.get("CALLBACK_SECRET")
+# Лимит команд и нажатий кнопок на игрока: THROTTLE_BURST подряд, дальше THROTTLE_RATE в секунду (0 — без лимита)
+THROTTLE_RATE = float(environ.get("THROTTLE_RATE", 0.5))
+THROTTLE_BURST = int(environ.get("THROTTLE_BURST", 5))
+
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
+shards = ShardResolver(CLUBS_DIR, CLUBS_OPEN_LIMIT)
+store = shards.default
+notifier = Notifier(bot)
+in_flight = InFlightMiddleware()
+first_update = FirstUpdateMiddleware(PROCESS_STARTED)
+startup_seconds = None
+dp.update.outer_middleware(first_update)
+dp.update.outer_middleware(DeduplicationMiddleware())
+dp.update.outer_middleware(in_flight)
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+callback_codec = CallbackCodec(CALLBACK_SECRET.encode() if CALLBACK_SECRET else secret_from_token(API_TOKEN))
+callback_data_middleware = CallbackDataMiddleware(callback_codec)
+dp.callback_query.outer_middleware(callback_data_middleware)
+if THROTTLE_RATE > 0:
+    throttling = ThrottlingMiddleware(RateLimiter(THROTTLE_RATE, THROTTLE_BURST))
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+club_middleware = ClubMiddleware(shards)
+dp.message.middleware(club_middleware)
+dp.callback_query.middleware(club_middleware)
+
+# 📈 Состояние очередей и кэшей считывается в момент запроса метрик;
+# значения, которые только растут, отдаются как counter с суффиксом _total
+metrics.registry.gauge("bot_updates_in_flight", "Апдейтов в обработке", lambda: in_flight.count)
+metrics.registry.gauge("notifier_queue_depth", "Уведомлений в очереди", lambda: notifier.pending)
+metrics.registry.counter_function("notifier_sent_total", "Отправлено уведомлений", lambda: notifier.sent)
+metrics.registry.counter_function("notifier_retried_total", "Повторных попыток отправки", lambda: notifier.retried)
+metrics.registry.counter_function("player_cache_hits_total", "Попаданий в кэш игроков", lambda: player_cache().hits)
+metrics.registry.counter_function("player_cache_misses_total", "Промахов кэша игроков", lambda: player_cache().misses)
+metrics.registry.gauge("clubs_open", "Клубов с открытой базой", lambda: len(shards))
+metrics.registry.counter_function("callbacks_rejected_total", "Отклонённых данных кнопок",
+                                  lambda: callback_data_middleware.rejected)
+metrics.registry.gauge("bot_startup_seconds", "Время от запуска процесса до готовности к приёму апдейтов",
+                       lambda: float("nan") if startup_seconds is None else startup_seconds)
+metrics.registry.gauge("bot_first_update_seconds", "Время от запуска процесса до первого обработанного апдейта",
+                       lambda: float("nan") if first_update.seconds is None else first_update.seconds)
+metrics_runner = None
+background_tasks = []
 
 
 # 🔧 Вспомогательные функции
-def confirm_keyboard(match_id):
+# Кнопки матча подписаны и адресованы игроку telegram_id: нажать их может только он
+def confirm_keyboard(match_id, club_id, telegram_id):
+    pack = callback_codec.pack
     return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm:{match_id}"),
-            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject:{match_id}")
+            InlineKeyboardButton(text="✅ Подтвердить", callback_data=pack("confirm", club_id, match_id, telegram_id)),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=pack("reject", club_id, match_id, telegram_id))
         ]
     ])
 
-def team_confirm_keyboard(match_id):
+def team_confirm_keyboard(match_id, club_id, telegram_id):
+    pack = callback_codec.pack
     return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"team_confirm:{match_id}"),
-            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"team_reject:{match_id}")
+            InlineKeyboardButton(text="✅ Подтвердить",
+                                 callback_data=pack("team_confirm", club_id, match_id, telegram_id)),
+            InlineKeyboardButton(text="❌ Отклонить",
+                                 callback_data=pack("team_reject", club_id, match_id, telegram_id))
         ]
     ])
 
-# 🔁 Обновление username
-def update_username(telegram_id, username):
-    if username:
-        with connect() as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE players SET username = ? WHERE telegram_id = ?", (username, telegram_id))
-            conn.commit()
+def remember_message(store, match_type, match_id):
+    # Запоминает отправленное сообщение с кнопками, чтобы снять их, когда матч истечёт
+    async def on_sent(message):
+        await store.remember_message(match_type, match_id, message.chat.id, message.message_id)
+    return on_sent
 
 # 📩 /start — приветствие
 @dp.message(CommandStart())
@@ -53,16 +141,21 @@ async def start_cmd(message: Message):
 @dp.message(Command("help"))
 async def start_cmd(message: Message):
     await message.answer("/reg - регистрация в рейтинге. Необходима при каждой смене ника\n"
-                         "/rating - текущий рейтинг игроков\n"
+                         "/rating - текущий рейтинг игроков, /rating 2 - вторая страница\n"
+                         "/rating me - ваше место в рейтинге и соседи\n"
+                         "/rating season=2 - таблица второго сезона\n"
                          "/match @<username> 3:1 - результаты матча 3:1 в вашу пользу\n"
                          "/match2 @<союзник> @<оппонент_1> @<оппонент_2> 3:1 - результаты матча 2x2 3:1 в пользу вашей команды\n"
+                         "/suggest - соперники с близким рейтингом\n"
+                         "/teams @a @b @c @d - самые равные пары для матча 2x2\n"
                          "/whoami - ваши личные данные и статистика\n"
+                         "В групповом чате рейтинг ведётся отдельно для этой группы\n"
                         )
 
 
 # 🆕 /reg — регистрация
 @dp.message(Command("reg"))
-async def cmd_reg(message: Message):
+async def cmd_reg(message: Message, store: AsyncRatingStore):
     user_id = message.from_user.id
     username = message.from_user.username
 
@@ -70,40 +163,53 @@ async def cmd_reg(message: Message):
         await message.answer("❗ У тебя не установлен username в Telegram. Он обязателен для участия.")
         return
 
-    existing = get_player_by_telegram_id(user_id)
+    existing = await store.get_player_by_telegram_id(user_id)
     if existing:
         await message.answer(f"✅ Ты уже зарегистрирован как @{username}.")
-        update_username(user_id, username)
+        await store.update_username(user_id, username)
         return
 
-    register_player(user_id, username)
+    await store.register_player(user_id, username)
     await message.answer(f"Добро пожаловать, @{username}! Ты теперь участник рейтинга 🏆")
 
 # 👤 /whoami — личная инфа
 @dp.message(Command("whoami"))
-async def cmd_whoami(message: Message):
+async def cmd_whoami(message: Message, store: AsyncRatingStore):
     user_id = message.from_user.id
     username = message.from_user.username
-    update_username(user_id, username)
+    await store.update_username(user_id, username)
 
-    player = get_player_by_telegram_id(user_id)
+    player = await store.get_player_by_telegram_id(user_id)
     if not player:
         await message.answer("Ты ещё не зарегистрирован. Используй /reg")
         return
 
     player_id = player[0]
     rating = player[3]
-    games = get_games_played(player_id)
+    stats = await store.get_player_stats(player_id)
+    if not stats:
+        await message.answer(
+            f"👤 @{username}\n"
+            f"🏓 Рейтинг: {rating}\n"
+            f"🎮 Матчей сыграно: 0"
+        )
+        return
+
+    _, games, wins, losses, singles, singles_wins, doubles, doubles_wins, points_for, points_against, streak, peak = stats
+    streak_text = f"{streak} побед подряд" if streak > 0 else f"{-streak} поражений подряд"
 
     await message.answer(
         f"👤 @{username}\n"
-        f"🏓 Рейтинг: {rating}\n"
-        f"🎮 Матчей сыграно: {games}"
+        f"🏓 Рейтинг: {rating} (пик: {peak})\n"
+        f"🎮 Матчей сыграно: {games} — {wins} побед, {losses} поражений\n"
+        f"1x1: {singles_wins}/{singles}, 2x2: {doubles_wins}/{doubles}\n"
+        f"Партии: {points_for}:{points_against}\n"
+        f"🔥 Серия: {streak_text}"
     )
 
 # 🎮 /match @user 3:1 — создать матч
 @dp.message(Command("match"))
-async def cmd_match(message: Message):
+async def cmd_match(message: Message, store: AsyncRatingStore, club_id: int):
     args = message.text.split()
     if len(args) != 3:
         await message.answer("Формат: /match @opponent 3:1")
@@ -112,7 +218,7 @@ async def cmd_match(message: Message):
     author = message.from_user
     author_id = author.id
     username = author.username
-    update_username(author_id, username)
+    await store.update_username(author_id, username)
 
     opponent_tag = args[1].lstrip("@")
     score = args[2]
@@ -123,8 +229,12 @@ async def cmd_match(message: Message):
         await message.answer("Счёт должен быть в формате 3:1")
         return
 
-    player1 = get_player_by_telegram_id(author_id)
-    player2 = get_player_by_username(opponent_tag)
+    player1 = await store.get_player_by_telegram_id(author_id)
+    player2 = await store.get_player_by_username(opponent_tag)
+
+    if not player1:
+        await message.answer("Ты ещё не зарегистрирован. Используй /reg")
+        return
 
     if not player2:
         await message.answer(f"Игрок @{opponent_tag} не найден.")
@@ -135,22 +245,23 @@ async def cmd_match(message: Message):
         return
 
     winner_id = player1[0] if s1 > s2 else player2[0]
-    match_id = record_match(player1[0], player2[0], s1, s2, winner_id)
+    match_id = await store.record_match(player1[0], player2[0], s1, s2, winner_id)
 
     await message.answer(f"Матч отправлен на подтверждение @{opponent_tag}.")
 
-    await bot.send_message(
+    notifier.send(
         chat_id=player2[1],
         text=(
             f"🏓 Подтверждение матча от @{username}:\n"
             f"Результат: @{username} {s1}:{s2} Вы\n"
             f"Если всё верно — нажми кнопку ниже."
         ),
-        reply_markup=confirm_keyboard(match_id)
+        reply_markup=confirm_keyboard(match_id, club_id, player2[1]),
+        on_sent=remember_message(store, "single", match_id)
     )
 
 @dp.message(Command("match2"))
-async def cmd_match2(message: Message):
+async def cmd_match2(message: Message, store: AsyncRatingStore, club_id: int):
     args = message.text.split()
     if len(args) != 5:
         await message.answer("Формат: /match2 @ally @enemy1 @enemy2 3:1")
@@ -159,7 +270,7 @@ async def cmd_match2(message: Message):
     user = message.from_user
     user_id = user.id
     username = user.username
-    update_username(user_id, username)
+    await store.update_username(user_id, username)
 
     ally_tag = args[1].lstrip("@")
     e1_tag = args[2].lstrip("@")
@@ -172,10 +283,10 @@ async def cmd_match2(message: Message):
         await message.answer("Счёт должен быть в формате 3:1")
         return
 
-    p1 = get_player_by_telegram_id(user_id)
-    p2 = get_player_by_username(ally_tag)
-    p3 = get_player_by_username(e1_tag)
-    p4 = get_player_by_username(e2_tag)
+    p1 = await store.get_player_by_telegram_id(user_id)
+    p2 = await store.get_player_by_username(ally_tag)
+    p3 = await store.get_player_by_username(e1_tag)
+    p4 = await store.get_player_by_username(e2_tag)
 
     if not all([p1, p2, p3, p4]):
         await message.answer("Один или несколько игроков не зарегистрированы.")
@@ -185,160 +296,366 @@ async def cmd_match2(message: Message):
         await message.answer("Все 4 игрока должны быть разными.")
         return
 
-    match_id = record_team_match(p1[0], p2[0], p3[0], p4[0], s1, s2)
+    match_id = await store.record_team_match(p1[0], p2[0], p3[0], p4[0], s1, s2)
 
     await message.answer(f"Матч записан и отправлен на подтверждение участникам.")
 
     for p in [p2, p3, p4]:
-        await bot.send_message(
+        notifier.send(
             chat_id=p[1],
             text=f"🏓 Матч 2x2 от @{username}:\nРезультат: {s1}:{s2}\n"
                  f"Пожалуйста, подтвердите участие.",
-            reply_markup=team_confirm_keyboard(match_id)
+            reply_markup=team_confirm_keyboard(match_id, club_id, p[1]),
+            on_sent=remember_message(store, "team", match_id)
         )
 
-@dp.callback_query(F.data.startswith("confirm:"))
-async def on_confirm_match(callback: CallbackQuery):
-    match_id = int(callback.data.split(":")[1])
+# 🔘 Все кнопки — один обработчик: данные уже разобраны и проверены в
+# CallbackDataMiddleware, действие выбирается по таблице callback_handlers
+callback_handlers = {}
 
-    # Получаем матч
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT player1_id, player2_id FROM matches WHERE id = ?", (match_id,))
-        match = cur.fetchone()
+def callback_action(action):
+    def register(handler):
+        callback_handlers[action] = handler
+        return handler
+    return register
 
-    if not match:
-        await callback.message.edit_text("❌ Матч не найден.")
-        await callback.answer("Ошибка.")
-        return
+@dp.callback_query()
+async def on_callback(callback: CallbackQuery, payload: Payload, store: AsyncRatingStore, club_id: int):
+    await callback_handlers[payload.action](callback, payload, store, club_id)
 
-    player1_id, player2_id = match
+@callback_action("confirm")
+async def on_confirm_match(callback: CallbackQuery, payload: Payload, store: AsyncRatingStore, club_id: int):
+    match_id = payload.match_id
     confirmer_id = callback.from_user.id
 
-    success = confirm_match(match_id)
+    # Подтверждение сразу возвращает игроков матча — отдельный запрос не нужен
+    players = await store.confirm_match(match_id)
 
-    if success:
+    if players:
+        player1, player2 = players
         await callback.message.edit_text("✅ Матч подтверждён! Рейтинг обновлён.")
         await callback.answer("Матч записан.")
 
         # Уведомим инициатора (не тот, кто подтвердил)
-        author_id = player1_id if get_player_by_id(player2_id)[1] == confirmer_id else player2_id
-        author = get_player_by_id(author_id)
+        author = player1 if player2[1] == confirmer_id else player2
 
         if author:
-            await bot.send_message(
+            notifier.send(
                 chat_id=author[1],
                 text=f"✅ Матч с @{callback.from_user.username} подтверждён и засчитан!"
             )
     else:
-        await callback.message.edit_text("❌ Не удалось подтвердить матч (возможно, он уже подтверждён).")
+        await callback.message.edit_text("❌ Не удалось подтвердить матч (возможно, он уже подтверждён, отклонён или истёк).")
         await callback.answer("Ошибка.")
 
 
 # ❌ Отклонение матча
-@dp.callback_query(F.data.startswith("reject:"))
-async def on_reject_match(callback: CallbackQuery):
-    match_id = int(callback.data.split(":")[1])
+@callback_action("reject")
+async def on_reject_match(callback: CallbackQuery, payload: Payload, store: AsyncRatingStore, club_id: int):
+    match_id = payload.match_id
 
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT player1_id, player2_id FROM matches WHERE id = ?", (match_id,))
-        match = cur.fetchone()
+    players = await store.get_match_players(match_id)
 
-    if not match:
+    if not players:
         await callback.message.edit_text("⚠️ Матч не найден или уже удалён.")
         await callback.answer("Ошибка.")
         return
 
-    player1_id, player2_id = match
+    player1, player2 = players
     rejector_id = callback.from_user.id
 
-    # Удаляем матч
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM matches WHERE id = ?", (match_id,))
-        conn.commit()
+    # Удаляем матч, если его ещё не подтвердили
+    if not await store.delete_match(match_id):
+        await callback.message.edit_text("⚠️ Матч уже подтверждён, отклонить его нельзя.")
+        await callback.answer("Матч уже подтверждён.")
+        return
 
     await callback.message.edit_text("❌ Матч отклонён.")
     await callback.answer("Матч удалён.")
 
     # Уведомление автору
-    player1 = get_player_by_id(player1_id)
     if player1:
-        await bot.send_message(
+        notifier.send(
             chat_id=player1[1],
             text=f"⚠️ Матч с @{callback.from_user.username} был отклонён и не засчитан."
         )
 
-@dp.callback_query(F.data.startswith("team_confirm:"))
-async def on_team_confirm(callback: CallbackQuery):
-    match_id = int(callback.data.split(":")[1])
+@callback_action("team_confirm")
+async def on_team_confirm(callback: CallbackQuery, payload: Payload, store: AsyncRatingStore, club_id: int):
+    match_id = payload.match_id
     telegram_id = callback.from_user.id
 
-    ok = confirm_team_participant(match_id, telegram_id)
-
-    if not ok:
-        await callback.answer("Ошибка: ты не участвуешь в этом матче.")
+    # Подтверждение, проверка «все ли подтвердили» и начисление рейтинга — одна транзакция
+    confirmed, status = await store.confirm_team_participant(match_id, telegram_id)
+
+    if not confirmed:
+        if status is None:
+            await callback.answer("Ошибка: ты не участвуешь в этом матче.")
+        elif status in (TEAM_PENDING, TEAM_PARTIAL):
+            await callback.answer("Ты уже подтвердил участие.")
+        elif status == TEAM_EXPIRED:
+            await callback.answer("⌛ Время на подтверждение истекло.")
+        else:
+            await callback.answer("Матч уже закрыт.")
         return
 
     await callback.answer("✅ Подтверждено!")
 
-    if is_team_match_fully_confirmed(match_id):
-        finalize_team_match(match_id)
+    if status == TEAM_FINALIZED:
         await callback.message.edit_text("✅ Матч подтверждён всеми. Рейтинг обновлён.")
     else:
         await callback.message.edit_text("✅ Ты подтвердил участие. Ожидаем остальных.")
 
 
-@dp.callback_query(F.data.startswith("team_reject:"))
-async def on_team_reject(callback: CallbackQuery):
-    match_id = int(callback.data.split(":")[1])
+@callback_action("team_reject")
+async def on_team_reject(callback: CallbackQuery, payload: Payload, store: AsyncRatingStore, club_id: int):
+    match_id = payload.match_id
     telegram_id = callback.from_user.id
 
-    match = get_team_match(match_id)
-    if not match:
-        await callback.answer("Матч не найден или уже удалён.")
-        return
-
-    # Получаем всех участников
-    _, t1p1, t1p2, t2p1, t2p2, *_ = match
-    all_players = [t1p1, t1p2, t2p1, t2p2]
-    telegram_ids = [get_player_by_id(pid)[1] for pid in all_players]
+    # Матч не удаляется, а переходит в статус rejected
+    rejected, status, telegram_ids = await store.reject_team_match(match_id, telegram_id)
 
-    if telegram_id not in telegram_ids:
-        await callback.answer("Ты не участвуешь в этом матче.")
+    if not rejected:
+        if status is None:
+            await callback.answer("Ты не участвуешь в этом матче.")
+        elif status == TEAM_EXPIRED:
+            await callback.answer("⌛ Время на подтверждение истекло.")
+        else:
+            await callback.answer("Матч уже закрыт.")
         return
 
-    # Удаляем матч
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM team_matches WHERE id = ?", (match_id,))
-        conn.commit()
-
     await callback.message.edit_text("❌ Матч отклонён. Он не будет засчитан.")
     await callback.answer("Матч отменён.")
 
     # Уведомляем всех остальных
     for tg_id in telegram_ids:
         if tg_id != telegram_id:
-            await bot.send_message(
+            notifier.send(
                 chat_id=tg_id,
-                text=f"❌ Матч 2x2 был отклонён игроком @{callback.from_user.username} и удалён."
+                text=f"❌ Матч 2x2 был отклонён игроком @{callback.from_user.username}."
             )
 
 
 # 📊 /rating — список лучших игроков
+def rating_keyboard(club_id, page, pages):
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton(text="⬅️", callback_data=callback_codec.pack("rating", club_id, page - 1)))
+    if page < pages:
+        buttons.append(InlineKeyboardButton(text="➡️", callback_data=callback_codec.pack("rating", club_id, page + 1)))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+def rating_text(title, rows):
+    lines = [f"{place}. @{username} — {score}" for place, username, score in rows]
+    return f"<b>{title}</b>\n\n" + "\n".join(lines)
+
+async def rating_page(store, club_id, number):
+    leaderboard = await store.get_leaderboard()
+    number, rows = leaderboard.page(number)
+    title = f"🏆 Рейтинг игроков ({number}/{leaderboard.pages}):"
+    return rating_text(title, rows), rating_keyboard(club_id, number, leaderboard.pages)
+
+async def season_page(store, season, number):
+    # Таблица сезона — из снимка (src.seasons), без обращения к players
+    number = max(number, 1)
+    season, snapshot_at, ended_at, size, rows = await store.get_season_table(season, number)
+    if season is None:
+        return "Такого сезона нет."
+    if not size:
+        return f"Снимка таблицы сезона {season} ещё нет."
+    pages = max(1, -(-size // store.leaderboard.page_size))
+    state = f"итог, {ended_at}" if ended_at else f"идёт, снимок {snapshot_at}"
+    if not rows:
+        return f"В сезоне {season} всего {pages} стр."
+    return rating_text(f"🗓 Сезон {season} ({state}), стр. {number}/{pages}:", rows)
+
 @dp.message(Command("rating"))
-async def cmd_rating(message: Message):
-    rating = get_rating_table()
-    text = "<b>🏆 Рейтинг игроков:</b>\n\n"
-    for i, (username, score) in enumerate(rating, start=1):
-        text += f"{i}. @{username} — {score}\n"
-    await message.answer(text, parse_mode=ParseMode.HTML)
+async def cmd_rating(message: Message, store: AsyncRatingStore, club_id: int):
+    args = message.text.split()
+    arg = args[1] if len(args) > 1 else "1"
+
+    if arg == "me":
+        player = await store.get_player_by_telegram_id(message.from_user.id)
+        if not player:
+            await message.answer("Ты ещё не зарегистрирован. Используй /reg")
+            return
+        leaderboard = await store.get_leaderboard()
+        position = leaderboard.position(player[2])
+        if position is None:
+            await message.answer("Не удалось найти тебя в рейтинге.")
+            return
+        title = f"🏆 Твоё место: {position} из {len(leaderboard)}"
+        await message.answer(rating_text(title, leaderboard.around(position)), parse_mode=ParseMode.HTML)
+        return
+
+    if arg.startswith("season="):
+        page = args[2] if len(args) > 2 else "1"
+        if not arg[len("season="):].isdigit() or not page.isdigit():
+            await message.answer("Формат: /rating season=2 или /rating season=2 3 (страница)")
+            return
+        await message.answer(await season_page(store, int(arg[len("season="):]), int(page)),
+                             parse_mode=ParseMode.HTML)
+        return
+
+    if not arg.isdigit():
+        await message.answer("Формат: /rating, /rating 2, /rating me или /rating season=2")
+        return
+
+    text, keyboard = await rating_page(store, club_id, int(arg))
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+@callback_action("rating")
+async def on_rating_page(callback: CallbackQuery, payload: Payload, store: AsyncRatingStore, club_id: int):
+    # Номер страницы передаётся в поле match_id
+    text, keyboard = await rating_page(store, club_id, payload.match_id)
+    await callback.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+    await callback.answer()
+
+# 🎯 /suggest — соперники с близким рейтингом (src.matchmaking.RatingIndex)
+SUGGEST_LIMIT = 20
+
+@dp.message(Command("suggest"))
+async def cmd_suggest(message: Message, store: AsyncRatingStore):
+    args = message.text.split()
+    if len(args) > 1 and not args[1].isdigit():
+        await message.answer("Формат: /suggest или /suggest 10")
+        return
+    count = min(int(args[1]), SUGGEST_LIMIT) if len(args) > 1 else 5
+
+    player = await store.get_player_by_telegram_id(message.from_user.id)
+    if not player:
+        await message.answer("Ты ещё не зарегистрирован. Используй /reg")
+        return
+
+    rating = player[3]
+    opponents = await store.suggest_opponents(player[0], rating, count)
+    if not opponents:
+        await message.answer("Пока не с кем играть: в рейтинге больше никого нет.")
+        return
+
+    lines = [f"@{username} — {score}, шанс победы {expected_score(rating, score):.0%}"
+             for _, username, score in opponents]
+    await message.answer(f"🎯 Соперники твоего уровня (твой рейтинг {rating}):\n" + "\n".join(lines) +
+                         "\n\nВызвать на матч: /match @<username> 3:1")
+
+# ⚖️ /teams @a @b @c @d — самое равное разбиение четырёх игроков на пары
+@dp.message(Command("teams"))
+async def cmd_teams(message: Message, store: AsyncRatingStore):
+    args = message.text.split()
+    if len(args) != 5:
+        await message.answer("Формат: /teams @a @b @c @d")
+        return
+
+    players = [await store.get_player_by_username(tag.lstrip("@")) for tag in args[1:]]
+    if not all(players):
+        await message.answer("Один или несколько игроков не зарегистрированы.")
+        return
+    if len({p[0] for p in players}) != 4:
+        await message.answer("Все 4 игрока должны быть разными.")
+        return
+
+    (team1, team2), chance = balance_teams([(p[0], p[2], p[3]) for p in players])
+    def team_text(team):
+        return " + ".join(f"@{username}" for _, username, _ in team) + f" ({team_rating(team):.0f})"
+    await message.answer(f"⚖️ Самые равные команды:\n{team_text(team1)}\nпротив\n{team_text(team2)}\n"
+                         f"Шансы: {chance:.0%} : {1 - chance:.0%}")
+
+# 🧮 Закрытие периодов Glicko-2 во всех клубах. Граница периода хранится в базе клуба:
+# после перезапуска просроченный период закрывается сразу, а следующий ждётся до своей границы
+async def rating_periods():
+    period = RATING_PERIOD_HOURS * 3600
+    while True:
+        wait = period
+        for club_id in [0] + shards.club_ids():
+            try:
+                async with shards.borrow(club_id) as club_store:
+                    left = await club_store.rating_period_wait(period)
+                    if left <= 0:
+                        await club_store.close_rating_period()
+                        left = period
+                    wait = min(wait, left)
+            except Exception:
+                logging.exception("Rating period failed for club %s", club_id)
+        await sleep(wait)
+
+# ⌛ Истечение неподтверждённых матчей во всех клубах: первая проверка — сразу при запуске
+async def expire_matches():
+    while True:
+        for club_id in [0] + shards.club_ids():
+            try:
+                async with shards.borrow(club_id) as club_store:
+                    while True:
+                        expired, messages = await club_store.expire_matches(MATCH_SWEEP_BATCH)
+                        for chat_id, message_id in messages:
+                            notifier.edit(chat_id, message_id, "⌛ Матч не подтверждён вовремя и не засчитан.")
+                        if expired < MATCH_SWEEP_BATCH:
+                            break
+            except Exception:
+                logging.exception("Match expiry failed for club %s", club_id)
+        await sleep(MATCH_SWEEP_SECONDS)
+
+# 🗓 Снимки таблицы текущего сезона во всех клубах; срок следующего снимка — от времени
+# прошлого (seasons.snapshot_at), поэтому перезапуск бота его не откладывает
+async def snapshot_leaderboards():
+    while True:
+        wait = SNAPSHOT_SECONDS
+        for club_id in [0] + shards.club_ids():
+            try:
+                async with shards.borrow(club_id) as club_store:
+                    left = await club_store.snapshot_wait(SNAPSHOT_SECONDS)
+                    if left <= 0:
+                        await club_store.snapshot_leaderboard()
+                        left = SNAPSHOT_SECONDS
+                    wait = min(wait, left)
+            except Exception:
+                logging.exception("Leaderboard snapshot failed for club %s", club_id)
+        await sleep(wait)
+
+# 🔥 Прогрев кэшей основной базы, пока бот уже принимает апдейты
+async def warm_up():
+    try:
+        started = perf_counter()
+        await store.warm_up()
+        logging.info("Caches warmed up in %.3f s", perf_counter() - started)
+    except Exception:
+        logging.exception("Cache warm-up failed")
 
 # 🚀 Запуск
+@dp.startup()
+async def on_startup():
+    global metrics_runner, startup_seconds
+    notifier.start()
+    background_tasks.append(create_task(warm_up()))
+    background_tasks.append(create_task(rating_periods()))
+    if db.MATCH_TTL_HOURS:
+        background_tasks.append(create_task(expire_matches()))
+    if SNAPSHOT_SECONDS:
+        background_tasks.append(create_task(snapshot_leaderboards()))
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_server(METRICS_HOST, int(METRICS_PORT))
+    startup_seconds = perf_counter() - PROCESS_STARTED
+    logging.info("Started in %.3f s", startup_seconds)
+
+@dp.shutdown()
+async def on_shutdown():
+    # Дожидаемся начатых обработчиков, затем досылаем уведомления
+    try:
+        await in_flight.wait(SHUTDOWN_TIMEOUT)
+    except TimeoutError:
+        pass
+    for task in background_tasks:
+        task.cancel()
+    await notifier.stop()
+    shards.close()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
 async def main():
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    run(main())
+    if WEBHOOK_URL:
+        from src.webhook import run_webhook
+        run_webhook(dp, bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT)
+    else:
+        run(main())
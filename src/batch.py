@@ -0,0 +1,67 @@
+import asyncio
+
+from src import db
+from src.tracing import update_statements
+
+
+# ✍️ Групповая запись: операции из обработчиков копятся в очереди, а одна задача
+# выполняет их пачкой в одной транзакции (db.run_batch) — один fsync на пачку.
+# Пачка уходит, когда набралось max_ops операций или прошло max_delay секунд
+# с первой из них; пока пачка пишется, следующая собирается из новых операций.
+# По умолчанию max_delay = 0: одиночная запись не ждёт, а под нагрузкой пачки
+# набираются сами из операций, пришедших за время предыдущего коммита.
+# Обработчик получает результат своей операции через future уже после коммита.
+class BatchWriter:
+    def __init__(self, run, max_ops=100, max_delay=0):
+        self._run = run
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self._queue = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._task = None
+
+    async def submit(self, func, *args):
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((func, args, future))
+        if self._queue.qsize() >= self.max_ops:
+            self._full.set()
+        return await future
+
+    async def _writer(self):
+        # Задача живёт дольше апдейта, который её создал: запросы не относятся к нему
+        update_statements.set(None)
+        while True:
+            batch = [await self._queue.get()]
+            if self.max_delay and self._queue.qsize() < self.max_ops - 1:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except TimeoutError:
+                    pass
+            while len(batch) < self.max_ops and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            results = await self._run(db.run_batch, [(func, args) for func, args, _ in batch])
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
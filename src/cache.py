@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+
+# 👤 LRU-кэш строк players.
+# Основной ключ — telegram_id; username и id хранятся как вторичные индексы
+# и проверяются по самой строке, поэтому устаревшая ссылка просто даёт промах.
+class PlayerCache:
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        self._by_username = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _lookup(self, telegram_id, field, value):
+        # Строка по telegram_id, если её поле field совпадает с value
+        row = self._rows.get(telegram_id)
+        if row is None or row[field] != value:
+            self.misses += 1
+            return None
+        self._rows.move_to_end(telegram_id)
+        self.hits += 1
+        return row
+
+    def get_by_telegram_id(self, telegram_id):
+        with self._lock:
+            return self._lookup(telegram_id, 1, telegram_id)
+
+    def get_by_username(self, username):
+        with self._lock:
+            return self._lookup(self._by_username.get(username), 2, username)
+
+    def get_by_id(self, pid):
+        with self._lock:
+            return self._lookup(self._by_id.get(pid), 0, pid)
+
+    def put(self, row):
+        if row is None:
+            return
+        with self._lock:
+            pid, telegram_id, username = row[:3]
+            self._rows[telegram_id] = row
+            self._rows.move_to_end(telegram_id)
+            self._by_username[username] = telegram_id
+            self._by_id[pid] = telegram_id
+            while len(self._rows) > self.capacity:
+                _, old = self._rows.popitem(last=False)
+                if self._by_username.get(old[2]) == old[1]:
+                    del self._by_username[old[2]]
+                self._by_id.pop(old[0], None)
+
+    def set_username(self, telegram_id, username):
+        with self._lock:
+            row = self._rows.get(telegram_id)
+        if row is not None:
+            self.put(row[:2] + (username,) + row[3:])
+
+    def set_ratings(self, changes):
+        # changes: [(player_id, рейтинг до, рейтинг после)]
+        with self._lock:
+            rows = [self._rows.get(self._by_id.get(pid)) for pid, _, _ in changes]
+        for row, (pid, _, after) in zip(rows, changes):
+            if row is not None and row[0] == pid:
+                self.put(row[:3] + (after,) + row[4:])
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._by_username.clear()
+            self._by_id.clear()
@@ -0,0 +1,58 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+from typing import NamedTuple
+
+
+# 🔘 Данные inline-кнопок в двоичном виде: действие, клуб, матч (или страница рейтинга)
+# и telegram_id того, кто должен нажать кнопку (0 — любой), плюс обрезанный HMAC.
+# 21 байт данных + 8 байт подписи = 39 символов base64url при лимите Telegram в 64 байта.
+# Подделать кнопку чужого матча без секрета нельзя, а разбор — одна проверка длины,
+# base64 и struct.unpack, без строковых сравнений и без обращений к базе.
+ACTIONS = ("confirm", "reject", "team_confirm", "team_reject", "rating")
+
+_FORMAT = struct.Struct(">BqIQ")
+MAC_SIZE = 8
+PACKED_SIZE = len(base64.urlsafe_b64encode(bytes(_FORMAT.size + MAC_SIZE)).rstrip(b"="))
+
+
+class Payload(NamedTuple):
+    action: str
+    club_id: int
+    match_id: int
+    target: int = 0
+
+
+def secret_from_token(token):
+    # Секрет по умолчанию — производный от токена бота, чтобы не хранить ещё один
+    return hashlib.sha256(b"callback-data:" + token.encode()).digest()
+
+
+class CallbackCodec:
+    def __init__(self, secret):
+        self.secret = secret
+
+    def _mac(self, body):
+        return hmac.new(self.secret, body, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def pack(self, action, club_id, match_id, target=0):
+        body = _FORMAT.pack(ACTIONS.index(action) + 1, club_id, match_id, target)
+        return base64.urlsafe_b64encode(body + self._mac(body)).rstrip(b"=").decode()
+
+    def unpack(self, data):
+        # Payload или None, если данные повреждены, подделаны или в старом текстовом формате
+        if not data or len(data) != PACKED_SIZE:
+            return None
+        try:
+            raw = base64.b64decode(data + "=" * (-len(data) % 4), altchars=b"-_", validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        body, mac = raw[:_FORMAT.size], raw[_FORMAT.size:]
+        if not hmac.compare_digest(mac, self._mac(body)):
+            return None
+        action, club_id, match_id, target = _FORMAT.unpack(body)
+        if not 1 <= action <= len(ACTIONS):
+            return None
+        return Payload(ACTIONS[action - 1], club_id, match_id, target)
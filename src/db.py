@@ -1,14 +1,206 @@
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+from src.cache import PlayerCache
+from src.matchmaking import RatingIndex
+from src import ratings
+from src.migrations import is_current, migrate
+# ELO_K и calculate_elo остаются доступны как db.ELO_K и db.calculate_elo
+from src.ratings import ELO_K, Elo, calculate_elo, create_engine
+from src.stats import UPSERT_SQL as STATS_UPSERT_SQL, match_stats_rows
+from src.tracing import TracingConnection
 
 
 DB_NAME = "db.sqlite3"
+BUSY_TIMEOUT_MS = 5000
+CACHED_STATEMENTS = 256
+# Сколько часов неподтверждённый матч ждёт подтверждения; None — без ограничения
+MATCH_TTL_HOURS = None
+
+# Состояния матча 2x2: pending → partial → finalized, либо rejected или expired
+TEAM_PENDING = "pending"
+TEAM_PARTIAL = "partial"
+TEAM_FINALIZED = "finalized"
+TEAM_REJECTED = "rejected"
+TEAM_EXPIRED = "expired"
+
+class Connection(TracingConnection):
+    # Во время пакетной записи (run_batch) функции этого модуля не завершают общую
+    # транзакцию: commit ничего не делает, а rollback откатывает только текущую операцию
+    batching = False
+    # Изменения рейтинга операций пакета: попадают в кэши только после общего COMMIT
+    batch_changes = None
+    # PRAGMA data_version на момент последней проверки внешних записей и время проверки
+    data_version = None
+    data_version_checked = float("-inf")
+
+    def commit(self):
+        if not self.batching:
+            super().commit()
+
+    def rollback(self):
+        if self.batching:
+            self.execute("ROLLBACK TO batch_op")
+        else:
+            super().rollback()
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.batching:
+            return super().__exit__(exc_type, exc, tb)
+        if exc_type is not None:
+            self.rollback()
+        return False
+
+# Соединения живут всё время работы потока: по одному на файл базы в каждом потоке
+_local = threading.local()
+
+def _open(path):
+    # IMMEDIATE: транзакция сразу берёт блокировку на запись, чтение и обновление
+    # рейтингов внутри неё не могут перемешаться с другим подтверждением
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS,
+                           isolation_level="IMMEDIATE", factory=Connection)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+def use_database(path):
+    # Файл базы для текущего потока (у каждого клуба свой поток, см. src.shards);
+    # без вызова поток работает с DB_NAME
+    _local.db_name = path
+
+def current_database():
+    return getattr(_local, "db_name", None) or DB_NAME
 
 def connect():
-    return sqlite3.connect(DB_NAME)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    name = current_database()
+    conn = connections.get(name)
+    if conn is None:
+        conn = connections[name] = _open(name)
+    return conn
+
+# Кэш игроков — один на файл базы, общий для всех потоков
+_player_caches = {}
+
+def player_cache(name=None):
+    name = name or current_database()
+    cache = _player_caches.get(name)
+    if cache is None:
+        cache = _player_caches.setdefault(name, PlayerCache())
+    return cache
+
+# Индекс рейтингов для подбора соперников — тоже один на файл базы, загружается при первом /suggest
+_rating_indexes = {}
+
+def rating_index(name=None):
+    name = name or current_database()
+    index = _rating_indexes.get(name)
+    if index is None:
+        index = _rating_indexes.setdefault(name, RatingIndex())
+    return index
+
+# Система рейтинга клуба — тоже одна на файл базы: settings читается при первом подтверждении,
+# а не в каждой транзакции; set_rating_engine и записи извне сбрасывают её
+_rating_engines = {}
+
+# Сколько раз в базе замечены записи другого процесса (src.recompute, src.seasons, импорт...):
+# по этому счётчику AsyncRatingStore сбрасывает свою таблицу рейтинга
+_external_generations = {}
+# Как часто (в секундах) соединение проверяет PRAGMA data_version перед ответом из кэша
+EXTERNAL_CHECK_SECONDS = 1.0
+
+def external_generation(name=None):
+    return _external_generations.get(name or current_database(), 0)
+
+def sync_external_writes():
+    # PRAGMA data_version меняется, только когда коммитит другое соединение. У бота на базу
+    # одно соединение, поэтому смена значит запись извне: кэш игроков и индекс рейтингов
+    # сбрасываются. Проверка — не чаще раза в EXTERNAL_CHECK_SECONDS. Возвращает счётчик
+    # замеченных внешних записей базы
+    conn = connect()
+    now = monotonic()
+    if now - conn.data_version_checked >= EXTERNAL_CHECK_SECONDS:
+        conn.data_version_checked = now
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        previous, conn.data_version = conn.data_version, version
+        if previous is not None and previous != version:
+            forget_cached_ratings()
+            name = current_database()
+            _external_generations[name] = _external_generations.get(name, 0) + 1
+    return external_generation()
+
+def ratings_changed(changes):
+    # Новые рейтинги [(id, до, после)] — в кэш игроков и индекс рейтингов текущей базы.
+    # Внутри run_batch транзакция ещё не закоммичена: изменения откладываются до COMMIT
+    conn = connect()
+    if conn.batching:
+        conn.batch_changes.extend(changes)
+        return
+    player_cache().set_ratings(changes)
+    rating_index().set_ratings(changes)
+
+def close_connections():
+    connections = getattr(_local, "connections", {})
+    while connections:
+        _, conn = connections.popitem()
+        conn.close()
+
+def release_database():
+    # Закрывает соединения потока и освобождает кэш игроков и индекс рейтингов его базы
+    close_connections()
+    _player_caches.pop(current_database(), None)
+    _rating_indexes.pop(current_database(), None)
+    _rating_engines.pop(current_database(), None)
+
+def run_batch(operations):
+    # Выполняет [(функция, аргументы)] одной транзакцией: одна запись на диск вместо
+    # одной на операцию. Каждая операция — в своей точке сохранения, ошибка откатывает
+    # только её. Возвращает [(True, результат) или (False, исключение)]
+    if len(operations) == 1:
+        # Одиночной операции точки сохранения не нужны: она сама завершает свою транзакцию
+        func, args = operations[0]
+        try:
+            return [(True, func(*args))]
+        except Exception as e:
+            return [(False, e)]
+    conn = connect()
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    conn.batching = True
+    conn.batch_changes = changes = []
+    try:
+        for func, args in operations:
+            conn.execute("SAVEPOINT batch_op")
+            applied = len(changes)
+            try:
+                results.append((True, func(*args)))
+            except Exception as e:
+                conn.execute("ROLLBACK TO batch_op")
+                del changes[applied:]
+                results.append((False, e))
+            conn.execute("RELEASE batch_op")
+        conn.batching = False
+        conn.commit()
+    except BaseException:
+        conn.batching = False
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.batch_changes = None
+    ratings_changed(changes)
+    return results
 
 def init_db():
-    with connect() as conn:
+    conn = connect()
+    if is_current(conn):
+        return
+    with conn:
         cur = conn.cursor()
         cur.execute("""
         CREATE TABLE IF NOT EXISTS players (
@@ -53,6 +245,7 @@ def init_db():
         );
         """)
         conn.commit()
+    migrate(conn)
 
 def register_player(telegram_id, username):
     with connect() as conn:
@@ -62,24 +255,66 @@ def register_player(telegram_id, username):
         VALUES (?, ?)
         """, (telegram_id, username))
         conn.commit()
+        if cur.rowcount:
+            cur.execute("SELECT * FROM players WHERE telegram_id = ?", (telegram_id,))
+            player = cur.fetchone()
+            player_cache().put(player)
+            rating_index().put(player[0], player[2], player[3])
 
 def get_player_by_username(username):
+    sync_external_writes()
+    player = player_cache().get_by_username(username)
+    if player:
+        return player
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM players WHERE username = ?", (username,))
-        return cur.fetchone()
+        player = cur.fetchone()
+    player_cache().put(player)
+    return player
 
 def get_player_by_telegram_id(telegram_id):
+    sync_external_writes()
+    player = player_cache().get_by_telegram_id(telegram_id)
+    if player:
+        return player
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM players WHERE telegram_id = ?", (telegram_id,))
-        return cur.fetchone()
+        player = cur.fetchone()
+    player_cache().put(player)
+    return player
 
 def get_player_by_id(pid):
+    sync_external_writes()
+    player = player_cache().get_by_id(pid)
+    if player:
+        return player
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM players WHERE id = ?", (pid,))
-        return cur.fetchone()
+        player = cur.fetchone()
+    player_cache().put(player)
+    return player
+
+def update_username(telegram_id, username):
+    # True, если username действительно изменился
+    if not username:
+        return False
+    cached = player_cache().get_by_telegram_id(telegram_id)
+    if cached and cached[2] == username:
+        return False
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE players SET username = ? WHERE telegram_id = ? AND username IS NOT ?",
+                    (username, telegram_id, username))
+        conn.commit()
+    player_cache().set_username(telegram_id, username)
+    if cur.rowcount and rating_index().loaded:
+        player = get_player_by_telegram_id(telegram_id)
+        if player:
+            rating_index().set_username(player[0], username)
+    return cur.rowcount > 0
 
 def record_match(player1_id, player2_id, score1, score2, winner_id):
     with connect() as conn:
@@ -91,37 +326,172 @@ def record_match(player1_id, player2_id, score1, score2, winner_id):
         conn.commit()
         return cur.lastrowid
 
-def confirm_match(match_id):
+def get_match(match_id):
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM matches WHERE id = ?", (match_id,))
-        match = cur.fetchone()
-        if not match:
+        return cur.fetchone()
+
+def delete_match(match_id):
+    with connect() as conn:
+        cur = conn.cursor()
+        # Подтверждённый матч уже учтён в рейтинге — отклонить можно только ожидающий
+        cur.execute("DELETE FROM matches WHERE id = ? AND confirmed = 0", (match_id,))
+        if cur.rowcount == 0:
+            conn.rollback()
             return False
+        _forget_messages(cur, "single", match_id)
+        conn.commit()
+        return True
 
-        player1 = get_player_by_id(match[1])
-        player2 = get_player_by_id(match[2])
-        winner_id = match[5]
-        loser_id = match[1] if match[2] == winner_id else match[2]
+def _match_players(cur, match_id):
+    cur.execute("""
+    SELECT p.* FROM matches m
+    JOIN players p ON p.id IN (m.player1_id, m.player2_id)
+    WHERE m.id = ?
+    ORDER BY p.id = m.player2_id
+    """, (match_id,))
+    return cur.fetchall()
 
-        winner = get_player_by_id(winner_id)
-        loser = get_player_by_id(loser_id)
+def get_match_players(match_id):
+    with connect() as conn:
+        return _match_players(conn.cursor(), match_id)
 
-        new_winner_rating, new_loser_rating = calculate_elo(winner[3], loser[3])
+def confirm_match(match_id):
+    # Возвращает [(id, telegram_id)] игроков матча (player1, player2) или None, если матч
+    # не найден, уже подтверждён или истёк: обработчику не нужен отдельный запрос игроков
+    with connect() as conn:
+        cur = conn.cursor()
+        # Сначала помечаем матч подтверждённым: это открывает транзакцию BEGIN IMMEDIATE,
+        # а повторное нажатие кнопки не найдёт неподтверждённой строки. Истёкший матч
+        # не подтверждается, даже если его ещё не убрала фоновая очистка
+        cur.execute("UPDATE matches SET confirmed = 1 WHERE id = ? AND confirmed = 0 AND timestamp > ?",
+                    (match_id, _expiry_cutoff()))
+        if cur.rowcount == 0:
+            conn.rollback()
+            return None
+        _forget_messages(cur, "single", match_id)
 
-        cur.execute("UPDATE players SET rating = ? WHERE id = ?",
-                    (new_winner_rating, winner_id))
-        cur.execute("UPDATE players SET rating = ? WHERE id = ?",
-                    (new_loser_rating, loser_id))
-        cur.execute("UPDATE matches SET confirmed = 1 WHERE id = ?", (match_id,))
+        cur.execute("""
+        SELECT m.winner_id, m.score1, m.score2,
+               p1.id, p1.rating, p1.rd, p1.volatility,
+               p2.id, p2.rating, p2.rd, p2.volatility,
+               p1.telegram_id, p2.telegram_id
+        FROM matches m
+        JOIN players p1 ON p1.id = m.player1_id
+        JOIN players p2 ON p2.id = m.player2_id
+        WHERE m.id = ?
+        """, (match_id,))
+        match = cur.fetchone()
+        if not match:
+            conn.rollback()
+            return None
+
+        winner_id, score1, score2 = match[:3]
+        # Строки в форме players: (id, telegram_id, username, rating, rd, volatility)
+        player1 = (match[3], None, None) + match[4:7]
+        player2 = (match[7], None, None) + match[8:11]
+        if winner_id == player1[0]:
+            winner, loser, winner_score, loser_score = player1, player2, score1, score2
+        else:
+            winner, loser, winner_score, loser_score = player2, player1, score2, score1
+
+        changes = _apply_rated(cur, "single", match_id, _rate(_rating_engine(cur), [winner], [loser]))
+        (_, _, new_winner_rating), (_, _, new_loser_rating) = changes
+        cur.executemany(STATS_UPSERT_SQL, match_stats_rows(
+            0, [(winner[0], new_winner_rating)], [(loser[0], new_loser_rating)], winner_score, loser_score
+        ))
         conn.commit()
-        return True
+    ratings_changed(changes)
+    return [(player1[0], match[11]), (player2[0], match[12])]
+
+def _rating_engine(cur):
+    name = current_database()
+    engine = _rating_engines.get(name)
+    if engine is None:
+        cur.execute("SELECT value FROM settings WHERE key = 'rating_engine'")
+        row = cur.fetchone()
+        engine = _rating_engines.setdefault(name, create_engine(row[0] if row else Elo.name))
+    return engine
+
+def _rate(engine, winners, losers):
+    # winners/losers — строки players. Возвращает [(player_id, рейтинг до, рейтинг после,
+    # rd, волатильность)], сначала победителей
+    before = {p[0]: p[3] for p in winners + losers}
+    rated = engine.rate([(p[0], p[3], p[4], p[5]) for p in winners],
+                        [(p[0], p[3], p[4], p[5]) for p in losers])
+    if not engine.uses_deviation:
+        return [(pid, before[pid], round(rating), None, None) for pid, rating, _, _ in rated]
+    return [(pid, before[pid], round(rating), rd, volatility) for pid, rating, rd, volatility in rated]
+
+def _apply_rated(cur, match_type, match_id, rated):
+    # Рейтинги — через журнал (_apply_rating_changes), отклонение и волатильность — как есть
+    changes = _apply_rating_changes(cur, match_type, match_id,
+                                    [(pid, before, after) for pid, before, after, _, _ in rated])
+    if rated and rated[0][3] is not None:
+        cur.executemany("UPDATE players SET rd = ?, volatility = ? WHERE id = ?",
+                        [(rd, volatility, pid) for pid, _, _, rd, volatility in rated])
+    return changes
+
+def _apply_rating_changes(cur, match_type, match_id, changes):
+    # changes: [(player_id, рейтинг до, рейтинг после)]. Каждое изменение пишется в журнал,
+    # а players.rating только сдвигается на ту же дельту — в той же транзакции
+    cur.executemany("""
+    INSERT INTO rating_events (player_id, match_id, match_type, rating_before, rating_after, delta)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, [(pid, match_id, match_type, before, after, after - before) for pid, before, after in changes])
+    cur.executemany("UPDATE players SET rating = rating + ? WHERE id = ?",
+                    [(after - before, pid) for pid, before, after in changes])
+    return changes
+
+def _format_timestamp(moment):
+    # В таблицах время хранится как CURRENT_TIMESTAMP (UTC, "YYYY-MM-DD HH:MM:SS")
+    if isinstance(moment, datetime):
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+    return moment
+
+def _expiry_cutoff():
+    # Неподтверждённые матчи, созданные не позже этого момента, истекли;
+    # "" — срок не ограничен (любой timestamp больше пустой строки)
+    if not MATCH_TTL_HOURS:
+        return ""
+    return _format_timestamp(datetime.now(timezone.utc) - timedelta(hours=MATCH_TTL_HOURS))
+
+def get_rating_history(player_id, since=None):
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+        SELECT match_id, match_type, rating_before, rating_after, delta, timestamp
+        FROM rating_events
+        WHERE player_id = ? AND timestamp >= ?
+        ORDER BY timestamp, id
+        """, (player_id, _format_timestamp(since) or ""))
+        return cur.fetchall()
 
-def calculate_elo(r_winner, r_loser, k=32):
-    expected = 1 / (1 + 10 ** ((r_loser - r_winner) / 400))
-    r_winner_new = r_winner + k * (1 - expected)
-    r_loser_new = r_loser + k * (0 - (1 - expected))
-    return round(r_winner_new), round(r_loser_new)
+def get_rating_at(player_id, moment):
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+        SELECT rating_after FROM rating_events
+        WHERE player_id = ? AND timestamp <= ?
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+        """, (player_id, _format_timestamp(moment)))
+        row = cur.fetchone()
+        return row[0] if row else 1500
+
+def warm_player_cache(before_id=None, limit=500):
+    # Страница игроков (по убыванию id) в кэш игроков, чтобы первые апдейты не шли в базу.
+    # Возвращает id, с которого читать следующую страницу, или None, если игроки кончились
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM players WHERE id < ? ORDER BY id DESC LIMIT ?",
+                    (before_id if before_id is not None else 2 ** 63 - 1, limit))
+        rows = cur.fetchall()
+    cache = player_cache()
+    for row in rows:
+        cache.put(row)
+    return rows[-1][0] if len(rows) == limit else None
 
 def get_rating_table():
     with connect() as conn:
@@ -129,12 +499,29 @@ def get_rating_table():
         cur.execute("SELECT username, rating FROM players ORDER BY rating DESC")
         return cur.fetchall()
 
+def suggest_opponents(player_id, rating, count=5):
+    # Ближайшие по рейтингу соперники: [(id, username, рейтинг)]
+    sync_external_writes()
+    index = rating_index()
+    if not index.loaded:
+        with connect() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id, username, rating FROM players")
+            index.load(cur.fetchall())
+    return index.nearest(player_id, rating, count)
+
+def get_player_stats(player_id):
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM player_stats WHERE player_id = ?", (player_id,))
+        return cur.fetchone()
+
 def get_games_played(player_id):
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("""
-        SELECT COUNT(*) FROM matches 
-        WHERE confirmed = 1 AND (player1_id = ? OR player2_id = ?)
+        SELECT (SELECT COUNT(*) FROM matches WHERE player1_id = ? AND confirmed = 1)
+             + (SELECT COUNT(*) FROM matches WHERE player2_id = ? AND confirmed = 1)
         """, (player_id, player_id))
         return cur.fetchone()[0]
 
@@ -145,142 +532,443 @@ def record_team_match(t1p1, t1p2, t2p1, t2p2, score1, score2):
         INSERT INTO team_matches (
             team1_player1_id, team1_player2_id,
             team2_player1_id, team2_player2_id,
-            score1, score2, confirmed
-        ) VALUES (?, ?, ?, ?, ?, ?, 0)
+            score1, score2
+        ) VALUES (?, ?, ?, ?, ?, ?)
         """, (t1p1, t1p2, t2p1, t2p2, score1, score2))
+        match_id = cur.lastrowid
+        # Автор матча подтверждает его самим созданием
+        cur.execute("INSERT INTO team_confirmations (match_id, player_id) VALUES (?, ?)", (match_id, t1p1))
         conn.commit()
-        return cur.lastrowid
+        return match_id
+
+def _team_match_players(cur, match_id):
+    # Счёт матча и игроки в порядке team1_player1, team1_player2, team2_player1, team2_player2
+    cur.execute("""
+    SELECT tm.score1, tm.score2, p.* FROM team_matches tm
+    JOIN players p ON p.id IN (tm.team1_player1_id, tm.team1_player2_id,
+                               tm.team2_player1_id, tm.team2_player2_id)
+    WHERE tm.id = ?
+    ORDER BY CASE p.id
+        WHEN tm.team1_player1_id THEN 1
+        WHEN tm.team1_player2_id THEN 2
+        WHEN tm.team2_player1_id THEN 3
+        ELSE 4
+    END
+    """, (match_id,))
+    rows = cur.fetchall()
+    if len(rows) != 4:
+        return None, []
+    return rows[0][:2], [row[2:] for row in rows]
+
+def _team_rating_changes(players, score1, score2, k):
+    # Эло для строк players в порядке команда 1, команда 2: [(id, до, после)], сначала победители
+    team1, team2 = players[:2], players[2:]
+    winners, losers = (team1, team2) if score1 > score2 else (team2, team1)
+    return [(pid, before, after) for pid, before, after, _, _ in _rate(Elo(k), winners, losers)]
+
+def _apply_team_match(cur, match_id):
+    # Применённые изменения рейтинга; пустой список, если матч не найден
+    score, players = _team_match_players(cur, match_id)
+    if not players:
+        return []
+
+    score1, score2 = score
+    team1, team2 = players[:2], players[2:]
+    winners, losers = (team1, team2) if score1 > score2 else (team2, team1)
+    changes = _apply_rated(cur, "team", match_id, _rate(_rating_engine(cur), winners, losers))
+    # _rate возвращает сначала двух победителей, затем проигравших
+    winners = [(pid, after) for pid, _, after in changes[:2]]
+    losers = [(pid, after) for pid, _, after in changes[2:]]
+    winner_score, loser_score = (score1, score2) if score1 > score2 else (score2, score1)
+    cur.executemany(STATS_UPSERT_SQL, match_stats_rows(1, winners, losers, winner_score, loser_score))
+    return changes
+
+def _finalize_team_match(cur, match_id):
+    # Рейтинги и статистика по матчу, затем статус finalized — в текущей транзакции
+    changes = _apply_team_match(cur, match_id)
+    if changes:
+        cur.execute("UPDATE team_matches SET status = ? WHERE id = ?", (TEAM_FINALIZED, match_id))
+        _forget_messages(cur, "team", match_id)
+    return changes
 
-def confirm_team_match(match_id, k=32):
+def get_team_match(match_id):
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM team_matches WHERE id = ?", (match_id,))
-        match = cur.fetchone()
-
-        if not match or match[7]:  # already confirmed
-            return False
-
-        # unpack players and scores
-        _, t1p1, t1p2, t2p1, t2p2, score1, score2, *_ = match
-
-        winner_team = 1 if score1 > score2 else 2
-
-        team1 = [get_player_by_id(t1p1), get_player_by_id(t1p2)]
-        team2 = [get_player_by_id(t2p1), get_player_by_id(t2p2)]
+        return cur.fetchone()
 
-        team1_avg = sum(p[3] for p in team1) / 2
-        team2_avg = sum(p[3] for p in team2) / 2
+def _team_match_status(cur, match_id, telegram_id):
+    # Статус матча, если игрок в нём участвует, иначе None. Ожидающий матч
+    # с истёкшим сроком считается expired ещё до фоновой очистки
+    cur.execute("""
+    SELECT CASE WHEN tm.status IN (?, ?) AND tm.timestamp <= ? THEN ? ELSE tm.status END
+    FROM team_matches tm
+    JOIN players p ON p.telegram_id = ?
+        AND p.id IN (tm.team1_player1_id, tm.team1_player2_id, tm.team2_player1_id, tm.team2_player2_id)
+    WHERE tm.id = ?
+    """, (TEAM_PENDING, TEAM_PARTIAL, _expiry_cutoff(), TEAM_EXPIRED, telegram_id, match_id))
+    row = cur.fetchone()
+    return row[0] if row else None
 
-        if winner_team == 1:
-            winners = team1
-            losers = team2
-            r_win_avg = team1_avg
-            r_lose_avg = team2_avg
+def confirm_team_participant(match_id, telegram_id):
+    # Подтверждение игрока; последнее подтверждение сразу засчитывает матч.
+    # Возвращает (подтверждено ли сейчас, статус матча после нажатия);
+    # статус None — матча нет или игрок в нём не участвует
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+        INSERT OR IGNORE INTO team_confirmations (match_id, player_id)
+        SELECT tm.id, p.id FROM team_matches tm
+        JOIN players p ON p.telegram_id = ?
+            AND p.id IN (tm.team1_player1_id, tm.team1_player2_id, tm.team2_player1_id, tm.team2_player2_id)
+        WHERE tm.id = ? AND tm.status IN (?, ?) AND tm.timestamp > ?
+        """, (telegram_id, match_id, TEAM_PENDING, TEAM_PARTIAL, _expiry_cutoff()))
+        if cur.rowcount == 0:
+            status = _team_match_status(cur, match_id, telegram_id)
+            conn.rollback()
+            return False, status
+
+        cur.execute("SELECT COUNT(*) FROM team_confirmations WHERE match_id = ?", (match_id,))
+        changes = []
+        if cur.fetchone()[0] < 4:
+            status = TEAM_PARTIAL
+            cur.execute("UPDATE team_matches SET status = ? WHERE id = ?", (status, match_id))
         else:
-            winners = team2
-            losers = team1
-            r_win_avg = team2_avg
-            r_lose_avg = team1_avg
-
-        # Пересчёт рейтингов каждого игрока
-        for player in winners:
-            new_rating, _ = calculate_elo(player[3], r_lose_avg, k)
-            cur.execute("UPDATE players SET rating = ? WHERE id = ?", (new_rating, player[0]))
-
-        for player in losers:
-            _, new_rating = calculate_elo(r_win_avg, player[3], k)
-            cur.execute("UPDATE players SET rating = ? WHERE id = ?", (new_rating, player[0]))
-
-        cur.execute("UPDATE team_matches SET confirmed = 1 WHERE id = ?", (match_id,))
+            status = TEAM_FINALIZED
+            changes = _finalize_team_match(cur, match_id)
         conn.commit()
-        return True
+    ratings_changed(changes)
+    return True, status
 
-def record_team_match(t1p1, t1p2, t2p1, t2p2, score1, score2):
+def reject_team_match(match_id, telegram_id):
+    # Отклонение матча участником. Возвращает (отклонён ли, статус, telegram_id участников);
+    # статус None — матча нет или игрок в нём не участвует
     with connect() as conn:
         cur = conn.cursor()
         cur.execute("""
-        INSERT INTO team_matches (
-            team1_player1_id, team1_player2_id,
-            team2_player1_id, team2_player2_id,
-            score1, score2
-        ) VALUES (?, ?, ?, ?, ?, ?)
-        """, (t1p1, t1p2, t2p1, t2p2, score1, score2))
+        UPDATE team_matches SET status = ?
+        WHERE id = ? AND status IN (?, ?) AND timestamp > ? AND (
+            SELECT id FROM players WHERE telegram_id = ?
+        ) IN (team1_player1_id, team1_player2_id, team2_player1_id, team2_player2_id)
+        """, (TEAM_REJECTED, match_id, TEAM_PENDING, TEAM_PARTIAL, _expiry_cutoff(), telegram_id))
+        if cur.rowcount == 0:
+            status = _team_match_status(cur, match_id, telegram_id)
+            conn.rollback()
+            return False, status, []
+
+        _forget_messages(cur, "team", match_id)
+        _, players = _team_match_players(cur, match_id)
         conn.commit()
-        return cur.lastrowid
+    return True, TEAM_REJECTED, [p[1] for p in players]
 
-def get_team_match(match_id):
+# ⌛ Сообщения с кнопками подтверждения и истечение неподтверждённых матчей
+_PENDING_MATCH_SQL = {
+    "single": "SELECT 1 FROM matches WHERE id = ? AND confirmed = 0",
+    "team": "SELECT 1 FROM team_matches WHERE id = ? AND status IN ('pending', 'partial')",
+}
+
+def remember_message(match_type, match_id, chat_id, message_id):
+    # Сохраняется, только пока матч ждёт подтверждения: если его уже подтвердили
+    # или отклонили, снимать кнопки не придётся
     with connect() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT * FROM team_matches WHERE id = ?", (match_id,))
-        return cur.fetchone()
-
-def confirm_team_participant(match_id, telegram_id):
-    match = get_team_match(match_id)
-    if not match:
-        return False
-
-    # Получаем ID игроков
-    _, t1p1, t1p2, t2p1, t2p2, *_ = match
-    player_ids = [t1p1, t1p2, t2p1, t2p2]
-    player_map = {get_player_by_id(pid)[1]: pid for pid in player_ids}  # telegram_id → id
-
-    if telegram_id not in player_map:
-        return False
-
-    # Определим, какая колонка подтверждения относится к пользователю
-    telegram_ids = list(player_map.keys())
-    pid_index = telegram_ids.index(telegram_id)
-
-    column = f"confirmed_player{pid_index + 1}"
-
+        cur.execute(f"""
+        INSERT OR REPLACE INTO pending_messages (match_type, match_id, chat_id, message_id)
+        SELECT ?, ?, ?, ? WHERE EXISTS ({_PENDING_MATCH_SQL[match_type]})
+        """, (match_type, match_id, chat_id, message_id, match_id))
+        conn.commit()
+        return cur.rowcount > 0
+
+def _forget_messages(cur, match_type, match_id):
+    cur.execute("DELETE FROM pending_messages WHERE match_type = ? AND match_id = ?", (match_type, match_id))
+
+def expire_matches(limit=500):
+    # Снимает с ожидания матчи старше MATCH_TTL_HOURS: матч 1x1 удаляется, как при
+    # отклонении, матч 2x2 получает статус expired. Ищутся по частичным индексам
+    # только среди ожидающих строк, поэтому стоимость зависит от числа истёкших, а не
+    # от размера истории. Возвращает (число истёкших матчей, [(chat_id, message_id)])
+    cutoff = _expiry_cutoff()
+    if not cutoff:
+        return 0, []
     with connect() as conn:
         cur = conn.cursor()
-        cur.execute(f"UPDATE team_matches SET {column} = 1 WHERE id = ?", (match_id,))
+        # Условия совпадают с условиями частичных индексов буквально — иначе SQLite их не выберет
+        cur.execute("SELECT id FROM matches WHERE confirmed = 0 AND timestamp <= ? LIMIT ?", (cutoff, limit))
+        expired = [("single", row[0]) for row in cur.fetchall()]
+        cur.execute("""
+        SELECT id FROM team_matches WHERE status IN ('pending', 'partial') AND timestamp <= ? LIMIT ?
+        """, (cutoff, limit))
+        expired += [("team", row[0]) for row in cur.fetchall()]
+        if not expired:
+            conn.rollback()
+            return 0, []
+
+        messages = []
+        for match_type, match_id in expired:
+            cur.execute("SELECT chat_id, message_id FROM pending_messages WHERE match_type = ? AND match_id = ?",
+                        (match_type, match_id))
+            messages += cur.fetchall()
+        cur.executemany("DELETE FROM pending_messages WHERE match_type = ? AND match_id = ?", expired)
+        cur.executemany("DELETE FROM matches WHERE id = ?",
+                        [(match_id,) for match_type, match_id in expired if match_type == "single"])
+        cur.executemany("UPDATE team_matches SET status = ? WHERE id = ?",
+                        [(TEAM_EXPIRED, match_id) for match_type, match_id in expired if match_type == "team"])
         conn.commit()
+    return len(expired), messages
 
-    return True
-
-def is_team_match_fully_confirmed(match_id):
-    match = get_team_match(match_id)
-    if not match:
-        return False
-    confirmed_flags = match[7:10]
-    return all(confirmed_flags)
-
-def finalize_team_match(match_id, k=32):
-    match = get_team_match(match_id)
-    if not match:
-        return False
+def get_rating_engine():
+    with connect() as conn:
+        return _rating_engine(conn.cursor())
 
-    _, t1p1, t1p2, t2p1, t2p2, score1, score2, *_ = match
+def set_rating_engine(name):
+    engine = create_engine(name)
+    # Сравниваем с тем, что записано в базе, а не с кэшем: её мог поменять другой процесс
+    _rating_engines.pop(current_database(), None)
+    with connect() as conn:
+        cur = conn.cursor()
+        if _rating_engine(cur).name == engine.name:
+            return engine
+        cur.execute("""
+        INSERT INTO settings (key, value) VALUES ('rating_engine', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (engine.name,))
+        if engine.name == ratings.Glicko2.name:
+            # Первый период Glicko-2 начинается с текущих рейтингов
+            cur.execute("DELETE FROM glicko_state")
+            cur.execute("""
+            INSERT INTO glicko_state (player_id, rating, rd, volatility)
+            SELECT id, rating, rd, volatility FROM players
+            """)
+            cur.execute("""
+            INSERT INTO settings (key, value)
+            SELECT 'glicko_last_event', COALESCE(MAX(id), 0) FROM rating_events WHERE true
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """)
+            cur.execute("""
+            INSERT INTO settings (key, value) VALUES ('glicko_closed_at', CURRENT_TIMESTAMP)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """)
+    _rating_engines[current_database()] = engine
+    return engine
+
+def _period_games(cur, after_event, last_event):
+    # Матчи, подтверждённые между двумя записями журнала: [(победители, проигравшие)]
+    cur.execute("""
+    SELECT player1_id, player2_id, NULL, NULL, score1, score2, winner_id FROM matches
+    WHERE id IN (SELECT match_id FROM rating_events WHERE id > ? AND id <= ? AND match_type = 'single')
+    UNION ALL
+    SELECT team1_player1_id, team1_player2_id, team2_player1_id, team2_player2_id, score1, score2, NULL
+    FROM team_matches
+    WHERE id IN (SELECT match_id FROM rating_events WHERE id > ? AND id <= ? AND match_type = 'team')
+    """, (after_event, last_event, after_event, last_event))
+    for a, b, c, d, score1, score2, winner_id in cur.fetchall():
+        if c is None:
+            yield ((a,), (b,)) if winner_id == a else ((b,), (a,))
+        else:
+            yield ((a, b), (c, d)) if score1 > score2 else ((c, d), (a, b))
 
-    winner_team = 1 if score1 > score2 else 2
+def close_rating_period():
+    # Закрывает период Glicko-2: все матчи периода пересчитываются вместе от состояния
+    # на его начало (glicko_state). Возвращает изменения рейтинга [(id, до, после)]
+    with connect() as conn:
+        cur = conn.cursor()
+        if _rating_engine(cur).name != ratings.Glicko2.name:
+            return []
+        cur.execute("SELECT value FROM settings WHERE key = 'glicko_last_event'")
+        row = cur.fetchone()
+        after_event = int(row[0]) if row else 0
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM rating_events")
+        last_event = cur.fetchone()[0]
 
-    team1 = [get_player_by_id(t1p1), get_player_by_id(t1p2)]
-    team2 = [get_player_by_id(t2p1), get_player_by_id(t2p2)]
+        cur.execute("""
+        SELECT p.id, p.rating, COALESCE(g.rating, ?), COALESCE(g.rd, ?), COALESCE(g.volatility, ?)
+        FROM players p LEFT JOIN glicko_state g ON g.player_id = p.id
+        """, (ratings.INITIAL_RATING, ratings.INITIAL_RD, ratings.INITIAL_VOLATILITY))
+        rows = cur.fetchall()
+        if not rows:
+            return []
+        pids, current, start_ratings, start_rds, start_vols = zip(*rows)
+        index = {pid: i for i, pid in enumerate(pids)}
+        games = []
+        for winners, losers in _period_games(cur, after_event, last_event):
+            for w in winners:
+                for l in losers:
+                    games.append((index[w], index[l], 1.0, 1 / len(losers)))
+                    games.append((index[l], index[w], 0.0, 1 / len(winners)))
+
+        np = ratings.load_numpy()
+        if np is not None and games:
+            i, j, s, weights = (np.array(column) for column in zip(*games))
+            new_state = zip(*(column.tolist() for column in ratings.glicko2_period_numpy(
+                start_ratings, start_rds, start_vols, i, j, s, weights)))
+        else:
+            new_state = ratings.glicko2_period(start_ratings, start_rds, start_vols, games)
+        new_state = list(new_state)
+
+        cur.executemany("""
+        INSERT INTO glicko_state (player_id, rating, rd, volatility) VALUES (?, ?, ?, ?)
+        ON CONFLICT(player_id) DO UPDATE SET
+            rating = excluded.rating, rd = excluded.rd, volatility = excluded.volatility
+        """, [(pid, *state) for pid, state in zip(pids, new_state)])
+        # В журнал попадают только изменившиеся рейтинги, отклонение меняется у всех
+        changes = _apply_rating_changes(cur, "period", None, [
+            (pid, before, round(rating))
+            for pid, before, (rating, _, _) in zip(pids, current, new_state)
+            if round(rating) != before
+        ])
+        cur.executemany("UPDATE players SET rd = ?, volatility = ? WHERE id = ?",
+                        [(rd, volatility, pid) for pid, (_, rd, volatility) in zip(pids, new_state)])
+        cur.execute("""
+        INSERT INTO settings (key, value) VALUES ('glicko_last_event', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (last_event,))
+        cur.execute("""
+        INSERT INTO settings (key, value) VALUES ('glicko_closed_at', CURRENT_TIMESTAMP)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """)
+        conn.commit()
+    ratings_changed(changes)
+    return changes
 
-    team1_avg = sum(p[3] for p in team1) / 2
-    team2_avg = sum(p[3] for p in team2) / 2
+def rating_period_wait(period_seconds):
+    # Сколько секунд осталось до закрытия периода Glicko-2 (0 — период пора закрыть).
+    # Время последнего закрытия хранится в settings, поэтому перезапуск бота не сдвигает
+    # границу периода. Клуб без отметки (база до её появления) отсчитывает период с этого момента
+    with connect() as conn:
+        cur = conn.cursor()
+        if _rating_engine(cur).name != ratings.Glicko2.name:
+            return period_seconds
+        cur.execute("""
+        SELECT (julianday('now') - julianday(value)) * 86400 FROM settings WHERE key = 'glicko_closed_at'
+        """)
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("INSERT INTO settings (key, value) VALUES ('glicko_closed_at', CURRENT_TIMESTAMP)")
+            conn.commit()
+            return period_seconds
+        return max(0.0, period_seconds - row[0])
+
+# 🗓 Сезоны и снимки таблицы рейтинга
+def _current_season(cur):
+    cur.execute("SELECT id FROM seasons WHERE ended_at IS NULL ORDER BY id DESC LIMIT 1")
+    return cur.fetchone()[0]
+
+def _snapshot_rows(cur, season):
+    cur.execute("SELECT id, username, rating FROM players ORDER BY rating DESC, id")
+    return [(season, position, pid, username, rating)
+            for position, (pid, username, rating) in enumerate(cur, start=1)]
+
+def _changed_snapshot_rows(cur, season, rows):
+    # Строки, которые отличаются от прошлого снимка сезона: после нескольких матчей
+    # сдвигаются лишь места между старым и новым рейтингом их участников
+    cur.execute("SELECT position, player_id, username, rating FROM leaderboard_snapshots WHERE season = ?",
+                (season,))
+    previous = {position: (pid, username, rating) for position, pid, username, rating in cur}
+    return [row for row in rows if previous.get(row[1]) != row[2:]]
+
+def _write_snapshot(cur, season, rows, changed=None):
+    cur.executemany("INSERT OR REPLACE INTO leaderboard_snapshots VALUES (?, ?, ?, ?, ?)",
+                    rows if changed is None else changed)
+    cur.execute("DELETE FROM leaderboard_snapshots WHERE season = ? AND position > ?", (season, len(rows)))
+    cur.execute("""
+    UPDATE seasons SET snapshot_at = CURRENT_TIMESTAMP, snapshot_size = ? WHERE id = ?
+    """, (len(rows), season))
+
+def snapshot_leaderboard():
+    # Снимок таблицы текущего сезона: (сезон, сколько строк снимка изменилось). Снимается
+    # всегда — имя игрока или новичок без матчей меняют таблицу без записей в журнале,
+    # а переписываются только отличающиеся строки. Таблица читается вне транзакции записи
+    # (WAL не мешает писателям), блокировка берётся только на запись готовых строк
+    with connect() as conn:
+        cur = conn.cursor()
+        season = _current_season(cur)
+        rows = _snapshot_rows(cur, season)
+        changed = _changed_snapshot_rows(cur, season, rows)
+        _write_snapshot(cur, season, rows, changed)
+        conn.commit()
+    return season, len(changed)
 
-    if winner_team == 1:
-        winners = team1
-        losers = team2
-        r_win_avg = team1_avg
-        r_lose_avg = team2_avg
-    else:
-        winners = team2
-        losers = team1
-        r_win_avg = team2_avg
-        r_lose_avg = team1_avg
+def snapshot_wait(interval_seconds):
+    # Сколько секунд осталось до следующего снимка текущего сезона: отсчёт от seasons.snapshot_at,
+    # так что перезапуск бота не откладывает снимок. Сезон без снимка снимается сразу
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+        SELECT (julianday('now') - julianday(snapshot_at)) * 86400 FROM seasons
+        WHERE ended_at IS NULL ORDER BY id DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+    if row is None or row[0] is None:
+        return 0.0
+    return max(0.0, interval_seconds - row[0])
+
+def get_season_table(season, first, last):
+    # Места first..last из снимка сезона: (сезон или None, когда снят, когда закончился,
+    # строк в снимке, [(место, username, рейтинг)]). Один запрос по первичным ключам
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+        SELECT s.snapshot_at, s.ended_at, s.snapshot_size, l.position, l.username, l.rating
+        FROM seasons s
+        LEFT JOIN leaderboard_snapshots l ON l.season = s.id AND l.position BETWEEN ? AND ?
+        WHERE s.id = ?
+        ORDER BY l.position
+        """, (first, last, season))
+        rows = cur.fetchall()
+    if not rows:
+        return None, None, None, 0, []
+    snapshot_at, ended_at, size = rows[0][:3]
+    return season, snapshot_at, ended_at, size, [row[3:] for row in rows if row[3] is not None]
+
+def get_seasons():
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, started_at, ended_at, snapshot_at, snapshot_size FROM seasons ORDER BY id")
+        return cur.fetchall()
 
+def has_finished_seasons():
+    # Мягкий сброс сезона есть только в журнале рейтинга: пересчёт по истории матчей
+    # его не повторит и вернёт рейтинги, как будто сезонов не было
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM seasons WHERE ended_at IS NOT NULL LIMIT 1")
+        return cur.fetchone() is not None
+
+def rollover_season(keep):
+    # Закрывает текущий сезон и начинает новый одной транзакцией: итоговый снимок,
+    # новая строка seasons и мягкий сброс — рейтинг сдвигается к начальному, от него
+    # остаётся доля keep. Сброс идёт через журнал (match_type 'season', match_id —
+    # номер нового сезона). Возвращает (закончившийся сезон, новый, [(id, до, после)])
+    # или None, если сезон уже закрыт другим процессом
     with connect() as conn:
         cur = conn.cursor()
-        for player in winners:
-            new_rating, _ = calculate_elo(player[3], r_lose_avg, k)
-            cur.execute("UPDATE players SET rating = ? WHERE id = ?", (new_rating, player[0]))
-        for player in losers:
-            _, new_rating = calculate_elo(r_win_avg, player[3], k)
-            cur.execute("UPDATE players SET rating = ? WHERE id = ?", (new_rating, player[0]))
+        season = _current_season(cur)
+        # Первая запись открывает BEGIN IMMEDIATE: снимок и сброс видят одни и те же рейтинги
+        cur.execute("UPDATE seasons SET ended_at = CURRENT_TIMESTAMP WHERE id = ? AND ended_at IS NULL",
+                    (season,))
+        if cur.rowcount == 0:
+            # Сезон успели закрыть параллельно
+            conn.rollback()
+            return None
+        rows = _snapshot_rows(cur, season)
+        _write_snapshot(cur, season, rows)
+        cur.execute("INSERT INTO seasons DEFAULT VALUES")
+        new_season = cur.lastrowid
+
+        initial = ratings.INITIAL_RATING
+        changes = [(pid, rating, round(initial + (rating - initial) * keep))
+                   for _, _, pid, _, rating in rows]
+        changes = _apply_rating_changes(cur, "season", new_season,
+                                        [change for change in changes if change[1] != change[2]])
+        # Glicko-2 пересчитывает период от состояния на его начало — сдвигаем и его
+        cur.executemany("UPDATE glicko_state SET rating = rating + ? WHERE player_id = ?",
+                        [(after - before, pid) for pid, before, after in changes])
         conn.commit()
-
-    return True
+    ratings_changed(changes)
+    return season, new_season, changes
+
+def forget_cached_ratings():
+    # Сбрасывает кэш игроков и индекс рейтингов базы: рейтинги изменил другой процесс
+    player_cache().clear()
+    _rating_indexes.pop(current_database(), None)
+    _rating_engines.pop(current_database(), None)
@@ -0,0 +1,52 @@
+# 🏆 Кэш таблицы рейтинга.
+# Таблица загружается из базы один раз и живёт до invalidate(): её сбрасывают
+# только операции, которые меняют рейтинги или список игроков, и записи другого процесса
+# (AsyncRatingStore.get_leaderboard).
+# Место игрока ищется по username, а не по рейтингу: рейтинг в кэше игроков может
+# отличаться от таблицы, если его только что изменил другой процесс.
+class Leaderboard:
+    def __init__(self, page_size=25):
+        self.page_size = page_size
+        self.version = 0
+        self._loaded_version = None
+        self._rows = []
+        self._positions = {}
+
+    @property
+    def loaded(self):
+        return self._loaded_version == self.version
+
+    def load(self, rows, version):
+        # rows: [(username, rating)], отсортированные по убыванию рейтинга.
+        # version — значение self.version на момент чтения из базы: если кэш успели
+        # сбросить, таблица всё равно показывается, но при следующем запросе перечитается
+        self._rows = list(rows)
+        self._positions = {username: i for i, (username, _) in enumerate(self._rows, start=1) if username}
+        self._loaded_version = version
+
+    def invalidate(self):
+        self.version += 1
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self) // self.page_size))
+
+    def page(self, number):
+        # (номер страницы, [(место, username, рейтинг)]); номер ограничивается допустимым
+        number = min(max(number, 1), self.pages)
+        start = (number - 1) * self.page_size
+        rows = self._rows[start:start + self.page_size]
+        return number, [(start + i, username, rating) for i, (username, rating) in enumerate(rows, start=1)]
+
+    def position(self, username):
+        # Место игрока (с 1) или None
+        return self._positions.get(username)
+
+    def around(self, position, radius=2):
+        # Соседи игрока по таблице: [(место, username, рейтинг)]
+        start = max(position - 1 - radius, 0)
+        rows = self._rows[start:position + radius]
+        return [(start + i, username, rating) for i, (username, rating) in enumerate(rows, start=1)]
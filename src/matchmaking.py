@@ -0,0 +1,101 @@
+import threading
+from bisect import bisect_left, insort
+
+from src.ratings import expected_score
+
+
+# 🎯 Индекс игроков по рейтингу для подбора соперников.
+# Отсортированный список (рейтинг, id) плюс словари id → рейтинг и id → username.
+# Ближайшие по рейтингу ищутся бинарным поиском и расходятся от найденного места
+# в обе стороны: O(log n + count) на запрос. После подтверждения матча меняются
+# только строки его участников (update), полная загрузка — один раз на базу.
+class RatingIndex:
+    def __init__(self):
+        self.loaded = False
+        self._keys = []
+        self._ratings = {}
+        self._usernames = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, rows):
+        # rows: [(id, username, рейтинг)]
+        with self._lock:
+            self._ratings = {pid: rating for pid, _, rating in rows}
+            self._usernames = {pid: username for pid, username, _ in rows}
+            self._keys = sorted((rating, pid) for pid, rating in self._ratings.items())
+            self.loaded = True
+
+    def _remove(self, pid):
+        rating = self._ratings.pop(pid, None)
+        if rating is not None:
+            i = bisect_left(self._keys, (rating, pid))
+            if i < len(self._keys) and self._keys[i] == (rating, pid):
+                del self._keys[i]
+
+    def put(self, pid, username, rating):
+        if not self.loaded:
+            return
+        with self._lock:
+            self._remove(pid)
+            self._ratings[pid] = rating
+            self._usernames[pid] = username
+            insort(self._keys, (rating, pid))
+
+    def set_username(self, pid, username):
+        with self._lock:
+            if pid in self._usernames:
+                self._usernames[pid] = username
+
+    def set_ratings(self, changes):
+        # changes: [(player_id, рейтинг до, рейтинг после)], как у PlayerCache
+        if not self.loaded:
+            return
+        with self._lock:
+            for pid, _, after in changes:
+                if pid in self._ratings:
+                    self._remove(pid)
+                    self._ratings[pid] = after
+                    insort(self._keys, (after, pid))
+
+    def nearest(self, pid, rating, count=5):
+        # [(id, username, рейтинг)] — count ближайших по рейтингу, кроме самого игрока
+        # и игроков без username (их нельзя вызвать на матч через /match @username)
+        with self._lock:
+            keys = self._keys
+            right = bisect_left(keys, (rating, pid))
+            left = right - 1
+            found = []
+            while len(found) < count and (left >= 0 or right < len(keys)):
+                if right >= len(keys) or (left >= 0 and rating - keys[left][0] <= keys[right][0] - rating):
+                    other_rating, other = keys[left]
+                    left -= 1
+                else:
+                    other_rating, other = keys[right]
+                    right += 1
+                username = self._usernames.get(other)
+                if other != pid and username:
+                    found.append((other, username, other_rating))
+            return found
+
+
+def team_rating(team):
+    # Сила команды — средний рейтинг, как у Эло в 2x2
+    return sum(rating for _, _, rating in team) / len(team)
+
+
+def balance_teams(players):
+    # Разбиение четырёх игроков [(id, username, рейтинг)] на две пары, при котором
+    # ожидаемый результат по Эло ближе всего к 50%: ((пара 1, пара 2), шанс пары 1).
+    # Разбиений всего три — первый игрок в паре с каждым из остальных
+    first, *rest = players
+    best = None
+    for partner in rest:
+        team1 = (first, partner)
+        team2 = tuple(p for p in rest if p is not partner)
+        chance = expected_score(team_rating(team1), team_rating(team2))
+        if best is None or abs(chance - 0.5) < abs(best[1] - 0.5):
+            best = ((team1, team2), chance)
+    return best
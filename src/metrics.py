@@ -0,0 +1,148 @@
+import threading
+from bisect import bisect_left
+
+
+# 📈 Минимальные метрики в формате Prometheus (text exposition 0.0.4).
+# Метрики пишутся и из event loop, и из потока базы, поэтому у каждой свой lock.
+# enabled = False выключает сбор (нужно, чтобы замерить накладные расходы).
+enabled = True
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def samples(self):
+        return [(self.name, (), self.function())]
+
+
+# Счётчик, значение которого считывается функцией в момент запроса (счётчики других объектов)
+class CounterFunction(Gauge):
+    kind = "counter"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Счётчики по корзинам (последняя — +Inf), сумма и количество
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket
+                    samples.append((f"{self.name}_bucket", key + (("le", bound),), cumulative))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name, help):
+        return self._metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def gauge(self, name, help, function):
+        self._metrics[name] = Gauge(name, help, function)
+        return self._metrics[name]
+
+    def counter_function(self, name, help, function):
+        # Для значений, которые только растут: Prometheus считает по ним rate() и increase()
+        self._metrics[name] = CounterFunction(name, help, function)
+        return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_labels_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram("bot_handler_seconds", "Время работы обработчика")
+update_seconds = registry.histogram("bot_update_seconds", "Время обработки апдейта целиком")
+statement_seconds = registry.histogram("sqlite_statement_seconds", "Время выполнения SQL-запроса")
+statements_per_update = registry.histogram(
+    "sqlite_statements_per_update", "SQL-запросов на один апдейт", buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34)
+)
+lock_wait_seconds = registry.histogram(
+    "sqlite_lock_wait_seconds", "Время запроса, открывшего транзакцию записи (включает ожидание блокировки)"
+)
+locked_errors = registry.counter("sqlite_locked_errors_total", "Ошибки database is locked")
+dropped_updates = registry.counter(
+    "bot_updates_dropped_total", "Апдейтов, отброшенных до обработчика (повторы и превышение лимита)"
+)
+
+
+async def start_server(host, port):
+    # Отдельный HTTP-сервер с /metrics; возвращает runner для остановки
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
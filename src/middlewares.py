@@ -0,0 +1,185 @@
+import asyncio
+from math import ceil
+from time import perf_counter
+
+from aiogram import BaseMiddleware
+
+from src import metrics
+from src.shards import club_of
+from src.throttle import TTLSet
+from src.tracing import update_statements
+
+
+# ⏳ Счётчик обрабатываемых апдейтов: при остановке бот дожидается,
+# пока завершатся уже начатые обработчики
+class InFlightMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def wait(self, timeout=None):
+        await asyncio.wait_for(self._idle.wait(), timeout)
+
+
+# 🚀 Время от запуска процесса до первого обработанного апдейта (started — perf_counter()
+# в начале запуска); после первого апдейта middleware только передаёт управление дальше
+class FirstUpdateMiddleware(BaseMiddleware):
+    def __init__(self, started):
+        self.started = started
+        self.seconds = None
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            if self.seconds is None:
+                self.seconds = perf_counter() - self.started
+
+
+# 🔂 Повторно доставленные апдейты и callback-запросы отбрасываются до обработчиков:
+# update_id и id запроса помнятся ttl секунд (Telegram повторяет доставку, если вебхук
+# не ответил вовремя, а клиент — запрос кнопки при плохой связи)
+class DeduplicationMiddleware(BaseMiddleware):
+    def __init__(self, ttl=600):
+        self.updates = TTLSet(ttl)
+        self.callbacks = TTLSet(ttl)
+
+    async def __call__(self, handler, event, data):
+        if not self.updates.add(event.update_id):
+            metrics.dropped_updates.inc(reason="duplicate_update")
+            return None
+        callback = event.callback_query
+        if callback is not None and not self.callbacks.add(callback.id):
+            metrics.dropped_updates.inc(reason="duplicate_callback")
+            return None
+        return await handler(event, data)
+
+
+def command_of(message):
+    # "/match@maria_bot @user 3:1" → "match"; None для обычного текста
+    text = message.text
+    if not text or not text.startswith("/"):
+        return None
+    words = text[1:].split(None, 1)
+    return words[0].split("@", 1)[0].lower() if words else None
+
+
+# 🪣 Лимит запросов на игрока и команду (src.throttle.RateLimiter). Для кнопок ключ — действие,
+# а повторное нажатие той же кнопки подтверждения или отклонения (те же данные) в течение
+# press_ttl секунд отбрасывается: двойной тап не запускает подтверждение матча второй раз.
+# Листание рейтинга туда и обратно — законные повторы, их ограничивает только лимит.
+# Регистрируется первой внутренней middleware, поэтому отброшенный апдейт не открывает базу клуба
+MATCH_ACTIONS = frozenset({"confirm", "reject", "team_confirm", "team_reject"})
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limiter, press_ttl=3, warn_interval=10, once_actions=MATCH_ACTIONS):
+        self.limiter = limiter
+        self.presses = TTLSet(press_ttl)
+        self.warned = TTLSet(warn_interval)
+        self.once_actions = once_actions
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if user is None:
+            return await handler(event, data)
+        payload = data.get("payload")
+        if payload is not None:
+            if payload.action in self.once_actions and not self.presses.add((user.id, payload)):
+                metrics.dropped_updates.inc(reason="repeated_press", command=f"callback_{payload.action}")
+                await event.answer()
+                return None
+            command = f"callback_{payload.action}"
+        else:
+            command = command_of(event)
+            if command is None:
+                return await handler(event, data)
+        wait = self.limiter.take((user.id, command))
+        if not wait:
+            return await handler(event, data)
+        metrics.dropped_updates.inc(reason="throttled", command=command)
+        if payload is not None:
+            await event.answer(f"⏳ Слишком часто, подожди {ceil(wait)} с.")
+        elif self.warned.add(user.id):
+            # Предупреждаем не чаще раза в warn_interval, иначе спам команд стал бы спамом ответов
+            await event.answer(f"⏳ Слишком много команд, подожди {ceil(wait)} с.")
+        return None
+
+
+# ⏱ Время обработки апдейта целиком и число SQL-запросов на апдейт
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        if not metrics.enabled:
+            return await handler(event, data)
+        counter = [0]
+        token = update_statements.set(counter)
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            update_statements.reset(token)
+            metrics.update_seconds.observe(perf_counter() - started, type=event.event_type)
+            metrics.statements_per_update.observe(counter[0], type=event.event_type)
+
+
+# ⏱ Время каждого обработчика из bot.py (внутренняя middleware: обработчик уже выбран)
+class HandlerTimingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        if not metrics.enabled:
+            return await handler(event, data)
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        payload = data.get("payload")
+        if payload is not None:
+            # Все кнопки идут через один обработчик — подписываем время действием кнопки
+            name = f"callback_{payload.action}"
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.handler_seconds.observe(perf_counter() - started, handler=name)
+
+
+# 🔘 Разбирает и проверяет данные кнопки до всех остальных middleware (payload).
+# Повреждённые, подделанные и старые кнопки, а также нажатия не тем игроком
+# отклоняются, не открывая базу клуба
+class CallbackDataMiddleware(BaseMiddleware):
+    def __init__(self, codec):
+        self.codec = codec
+        self.rejected = 0
+
+    async def __call__(self, handler, event, data):
+        payload = self.codec.unpack(event.data)
+        if payload is None:
+            self.rejected += 1
+            await event.answer("⚠️ Кнопка устарела или повреждена.")
+            return None
+        if payload.target and payload.target != event.from_user.id:
+            # Кнопка адресована другому игроку: проверка по данным кнопки, без запросов к базе
+            await event.answer("Эта кнопка не для тебя.")
+            return None
+        data["payload"] = payload
+        return await handler(event, data)
+
+
+# 🏓 Передаёт обработчику клуб апдейта и хранилище его базы (club_id, store)
+class ClubMiddleware(BaseMiddleware):
+    def __init__(self, shards):
+        self.shards = shards
+
+    async def __call__(self, handler, event, data):
+        payload = data.get("payload")
+        data["club_id"] = club_id = payload.club_id if payload else club_of(event)
+        data["store"] = await self.shards.get(club_id)
+        return await handler(event, data)
@@ -0,0 +1,265 @@
+# Версионированные миграции схемы.
+# Каждая миграция — (версия, список шагов); шаг — SQL-строка или функция от курсора.
+# Миграции применяются по порядку при старте, каждая в своей транзакции,
+# номер применённой версии записывается в schema_version.
+import sqlite3
+
+
+def fill_player_stats(cur):
+    # Шаг миграции 5: player_stats по подтверждённым матчам в порядке времени.
+    # Замороженная копия src.stats.rebuild_player_stats на схеме версии 5 (2x2 — флаги
+    # confirmed_player2..4): миграция не должна меняться вместе с живым кодом
+    cur.execute("DELETE FROM player_stats")
+    cur.execute("""
+    SELECT 0, player1_id, NULL, player2_id, NULL, score1, score2, winner_id, timestamp
+    FROM matches WHERE confirmed = 1
+    UNION ALL
+    SELECT 1, team1_player1_id, team1_player2_id, team2_player1_id, team2_player2_id,
+           score1, score2, NULL, timestamp
+    FROM team_matches
+    WHERE confirmed_player2 = 1 AND confirmed_player3 = 1 AND confirmed_player4 = 1
+    ORDER BY timestamp, 1, 2
+    """)
+    stats = {}
+    for doubles, a, b, c, d, score1, score2, winner_id, _ in cur.fetchall():
+        if doubles:
+            team1, team2, team1_won = (a, b), (c, d), score1 > score2
+        else:
+            team1, team2, team1_won = (a,), (c,), winner_id == a
+        for players, won, points_for, points_against in (
+            (team1, team1_won, score1, score2),
+            (team2, not team1_won, score2, score1),
+        ):
+            for pid in players:
+                # [games, wins, losses, singles_games, singles_wins, doubles_games,
+                #  doubles_wins, points_for, points_against, streak]
+                row = stats.setdefault(pid, [0] * 10)
+                row[0] += 1
+                row[1 if won else 2] += 1
+                row[5 if doubles else 3] += 1
+                row[6 if doubles else 4] += won
+                row[7] += points_for
+                row[8] += points_against
+                streak = row[9]
+                row[9] = (streak + 1 if streak > 0 else 1) if won else (streak - 1 if streak < 0 else -1)
+
+    # Пиковый рейтинг — по журналу изменений рейтинга
+    cur.execute("""
+    SELECT p.id, MAX(p.rating, COALESCE(MAX(e.rating_after), 0), 1500)
+    FROM players p LEFT JOIN rating_events e ON e.player_id = p.id
+    GROUP BY p.id
+    """)
+    peaks = dict(cur.fetchall())
+    cur.executemany("""
+    INSERT INTO player_stats (player_id, games, wins, losses, singles_games, singles_wins,
+                              doubles_games, doubles_wins, points_for, points_against,
+                              streak, peak_rating)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(pid, *row, peaks.get(pid, 1500)) for pid, row in stats.items()])
+
+
+MIGRATIONS = [
+    # 1: индексы для поиска игроков и таблицы рейтинга
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_players_username ON players(username)",
+        "CREATE INDEX IF NOT EXISTS idx_players_rating ON players(rating DESC)",
+    ]),
+    # 2: индексы для подсчёта матчей игрока
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_matches_player1 ON matches(player1_id, confirmed)",
+        "CREATE INDEX IF NOT EXISTS idx_matches_player2 ON matches(player2_id, confirmed)",
+    ]),
+    # 3: индексы по участникам матчей 2x2
+    (3, [
+        "CREATE INDEX IF NOT EXISTS idx_team_matches_t1p1 ON team_matches(team1_player1_id)",
+        "CREATE INDEX IF NOT EXISTS idx_team_matches_t1p2 ON team_matches(team1_player2_id)",
+        "CREATE INDEX IF NOT EXISTS idx_team_matches_t2p1 ON team_matches(team2_player1_id)",
+        "CREATE INDEX IF NOT EXISTS idx_team_matches_t2p2 ON team_matches(team2_player2_id)",
+    ]),
+    # 4: журнал изменений рейтинга; уже накопленный рейтинг переносится начальной записью
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS rating_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER NOT NULL,
+            match_id INTEGER,
+            match_type TEXT NOT NULL,
+            rating_before INTEGER NOT NULL,
+            rating_after INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(player_id) REFERENCES players(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rating_events_player ON rating_events(player_id, timestamp)",
+        """
+        INSERT INTO rating_events (player_id, match_type, rating_before, rating_after, delta)
+        SELECT id, 'initial', 1500, rating, rating - 1500 FROM players WHERE rating != 1500
+        """,
+    ]),
+    # 5: накопленная статистика игроков для /whoami, заполняется по истории
+    (5, [
+        """
+        CREATE TABLE IF NOT EXISTS player_stats (
+            player_id INTEGER PRIMARY KEY,
+            games INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            singles_games INTEGER NOT NULL DEFAULT 0,
+            singles_wins INTEGER NOT NULL DEFAULT 0,
+            doubles_games INTEGER NOT NULL DEFAULT 0,
+            doubles_wins INTEGER NOT NULL DEFAULT 0,
+            points_for INTEGER NOT NULL DEFAULT 0,
+            points_against INTEGER NOT NULL DEFAULT 0,
+            streak INTEGER NOT NULL DEFAULT 0,
+            peak_rating INTEGER NOT NULL DEFAULT 1500,
+            FOREIGN KEY(player_id) REFERENCES players(id)
+        )
+        """,
+        fill_player_stats,
+    ]),
+    # 6: системы рейтинга — отклонение и волатильность игрока, настройки клуба
+    #    и состояние Glicko-2 на начало текущего периода
+    (6, [
+        "ALTER TABLE players ADD COLUMN rd REAL NOT NULL DEFAULT 350",
+        "ALTER TABLE players ADD COLUMN volatility REAL NOT NULL DEFAULT 0.06",
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS glicko_state (
+            player_id INTEGER PRIMARY KEY,
+            rating REAL NOT NULL,
+            rd REAL NOT NULL,
+            volatility REAL NOT NULL,
+            FOREIGN KEY(player_id) REFERENCES players(id)
+        )
+        """,
+    ]),
+    # 7: матч 2x2 как конечный автомат: статус и подтверждения участников в отдельной таблице.
+    #    Старые флаги confirmed_player2..4 переносятся и больше не используются
+    (7, [
+        "ALTER TABLE team_matches ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'",
+        """
+        CREATE TABLE IF NOT EXISTS team_confirmations (
+            match_id INTEGER NOT NULL,
+            player_id INTEGER NOT NULL,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (match_id, player_id),
+            FOREIGN KEY(match_id) REFERENCES team_matches(id),
+            FOREIGN KEY(player_id) REFERENCES players(id)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT OR IGNORE INTO team_confirmations (match_id, player_id)
+        SELECT id, team1_player1_id FROM team_matches
+        UNION ALL SELECT id, team1_player2_id FROM team_matches WHERE confirmed_player2 = 1
+        UNION ALL SELECT id, team2_player1_id FROM team_matches WHERE confirmed_player3 = 1
+        UNION ALL SELECT id, team2_player2_id FROM team_matches WHERE confirmed_player4 = 1
+        """,
+        """
+        UPDATE team_matches SET status = CASE
+            WHEN confirmed_player2 = 1 AND confirmed_player3 = 1 AND confirmed_player4 = 1 THEN 'finalized'
+            WHEN confirmed_player2 = 1 OR confirmed_player3 = 1 OR confirmed_player4 = 1 THEN 'partial'
+            ELSE 'pending'
+        END
+        """,
+    ]),
+    # 8: истечение неподтверждённых матчей. Частичные индексы содержат только ожидающие
+    #    строки, поэтому поиск истёкших не зависит от размера истории. В pending_messages —
+    #    отправленные сообщения с кнопками, которые нужно снять, когда матч истечёт
+    (8, [
+        "CREATE INDEX IF NOT EXISTS idx_matches_pending ON matches(timestamp) WHERE confirmed = 0",
+        """
+        CREATE INDEX IF NOT EXISTS idx_team_matches_pending ON team_matches(timestamp)
+        WHERE status IN ('pending', 'partial')
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pending_messages (
+            match_type TEXT NOT NULL,
+            match_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (match_type, match_id, chat_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    # 9: сезоны и снимки таблицы рейтинга. Снимок — по строке на игрока с ключом (сезон, место),
+    #    поэтому страница таблицы любого сезона читается одним диапазоном первичного ключа.
+    #    Вся уже накопленная история становится первым сезоном
+    (9, [
+        """
+        CREATE TABLE IF NOT EXISTS seasons (
+            id INTEGER PRIMARY KEY,
+            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            ended_at TEXT,
+            snapshot_at TEXT,
+            snapshot_size INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        INSERT INTO seasons (id, started_at)
+        SELECT 1, COALESCE((SELECT MIN(timestamp) FROM matches), CURRENT_TIMESTAMP)
+        WHERE NOT EXISTS (SELECT 1 FROM seasons)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+            season INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            player_id INTEGER NOT NULL,
+            username TEXT,
+            rating INTEGER NOT NULL,
+            PRIMARY KEY (season, position)
+        ) WITHOUT ROWID
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def is_current(conn):
+    # Одна дешёвая проверка при запуске: схема уже последней версии, создавать
+    # таблицы и проверять миграции не нужно
+    try:
+        version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return False
+    return version == LATEST_VERSION
+
+
+def get_schema_version(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def migrate(conn):
+    current = get_schema_version(conn)
+    cur = conn.cursor()
+    for version, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        cur.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        current = version
+    return current
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from collections import deque
+
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# 📬 Очередь исходящих уведомлений.
+# Обработчики только ставят сообщение в очередь и сразу отвечают пользователю,
+# а несколько воркеров отправляют сообщения параллельно, соблюдая общий лимит
+# Telegram и лимит на один чат. RetryAfter и сетевые ошибки повторяются с паузой,
+# остальные ошибки (бот заблокирован, чат не найден) записываются в failures.
+# Через ту же очередь и лимиты идут правки уже отправленных сообщений (edit).
+class Notifier:
+    def __init__(self, bot, workers=4, global_rate=25, chat_interval=1.0, max_attempts=5):
+        self.bot = bot
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._global_interval = 1 / global_rate
+        self._chat_interval = chat_interval
+        self._next_global = 0.0
+        self._next_chat = {}
+        self._queue = asyncio.Queue()
+        self._retries = set()
+        self._tasks = []
+        self.sent = 0
+        self.retried = 0
+        self.failures = deque(maxlen=100)
+
+    @property
+    def pending(self):
+        # Повторы, отложенные через call_later, ещё не в очереди, но тоже не доставлены
+        return self._queue.qsize() + len(self._retries)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        # Даём дослать то, что уже в очереди и ждёт повтора, затем останавливаем воркеров.
+        # Не дождавшиеся повторы отменяются, чтобы не сработать на остановленном боте
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except TimeoutError:
+            logger.warning("Notifier stopped with %d unsent messages", self.pending)
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._queue.join()
+            if not self._retries:
+                return
+            await asyncio.sleep(max(0, min(h.when() for h in self._retries) - loop.time()))
+
+    def send(self, chat_id, text, on_sent=None, **kwargs):
+        # on_sent(message) вызывается после отправки — например, чтобы запомнить message_id
+        self._queue.put_nowait((self.bot.send_message, chat_id, text, kwargs, on_sent, 1))
+
+    def edit(self, chat_id, message_id, text, **kwargs):
+        # Без reply_markup правка заодно убирает кнопки под сообщением
+        kwargs["message_id"] = message_id
+        self._queue.put_nowait((self.bot.edit_message_text, chat_id, text, kwargs, None, 1))
+
+    def _reserve_slot(self, chat_id):
+        # Время, когда можно отправить сообщение в чат, с учётом обоих лимитов
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+        self._next_global = start + self._global_interval
+        self._next_chat[chat_id] = start + self._chat_interval
+        if len(self._next_chat) > 10000:
+            self._next_chat = {c: t for c, t in self._next_chat.items() if t > now}
+        return start - now
+
+    def _retry_later(self, item, delay):
+        method, chat_id, text, kwargs, on_sent, attempt = item
+        self.retried += 1
+        retry = (method, chat_id, text, kwargs, on_sent, attempt + 1)
+        handle = asyncio.get_running_loop().call_later(delay, lambda: self._requeue(handle, retry))
+        self._retries.add(handle)
+
+    def _requeue(self, handle, item):
+        self._retries.discard(handle)
+        self._queue.put_nowait(item)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._deliver(item)
+            except Exception:
+                logger.exception("Notifier failed to deliver a message")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, item):
+        method, chat_id, text, kwargs, on_sent, attempt = item
+        delay = self._reserve_slot(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        try:
+            message = await method(chat_id=chat_id, text=text, **kwargs)
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            # Флуд-контроль действует на весь бот: сдвигаем общий слот
+            loop = asyncio.get_running_loop()
+            self._next_global = max(self._next_global, loop.time() + e.retry_after)
+            if attempt < self.max_attempts:
+                self._retry_later(item, e.retry_after)
+            else:
+                self.failures.append((chat_id, text, repr(e)))
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt < self.max_attempts:
+                self._retry_later(item, 2 ** attempt)
+            else:
+                self.failures.append((chat_id, text, repr(e)))
+        except TelegramAPIError as e:
+            self.failures.append((chat_id, text, repr(e)))
+            logger.warning("Notification to %s failed: %s", chat_id, e)
+        else:
+            if on_sent is not None:
+                await on_sent(message)
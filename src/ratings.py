@@ -0,0 +1,352 @@
+# 🧮 Рейтинговые системы клуба.
+#
+#   python -m src.ratings --db clubs/-100123.sqlite3 engine glicko2
+#   python -m src.ratings --db clubs/-100123.sqlite3 period
+#   python -m src.ratings synthetic --players 100000 --games 300000
+#
+# Система выбирается для каждого клуба (таблица settings) и пересчитывает рейтинги
+# участников одного матча: rate(winners, losers) принимает и возвращает
+# [(player_id, рейтинг, отклонение, волатильность)], сначала победителей.
+#
+# elo       — прежний Эло с K=32, в 2x2 соперником считается средний рейтинг команды.
+# glicko2   — Glicko-2: после матча рейтинг обновляется сразу (матч как отдельный период),
+#             а раз в период (ночью) все матчи периода пересчитываются вместе от
+#             состояния на начало периода — векторно по всем игрокам, если есть numpy.
+# trueskill — гауссова модель команд в духе TrueSkill: сила команды — сумма игроков,
+#             неопределённость каждого игрока уменьшается с каждым матчем.
+#
+# Отклонение и волатильность хранятся в players.rd и players.volatility; Эло их не меняет.
+import argparse
+import math
+import random
+import time
+from functools import lru_cache
+
+
+ELO_K = 32
+INITIAL_RATING = 1500
+INITIAL_RD = 350
+INITIAL_VOLATILITY = 0.06
+# Glicko-2: переход к внутренней шкале и ограничение изменения волатильности
+GLICKO_SCALE = 173.7178
+GLICKO_TAU = 0.5
+GLICKO_EPSILON = 1e-6
+
+
+def expected_score(rating, opponent_rating):
+    # Ожидаемый результат (вероятность победы) игрока с rating против opponent_rating по Эло
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def calculate_elo(r_winner, r_loser, k=ELO_K):
+    expected = expected_score(r_winner, r_loser)
+    r_winner_new = r_winner + k * (1 - expected)
+    r_loser_new = r_loser + k * (0 - (1 - expected))
+    return round(r_winner_new), round(r_loser_new)
+
+
+class Elo:
+    name = "elo"
+    uses_deviation = False
+
+    def __init__(self, k=ELO_K):
+        self.k = k
+
+    def rate(self, winners, losers):
+        if len(winners) == 1 and len(losers) == 1:
+            (w, r_w, rd_w, vol_w), (l, r_l, rd_l, vol_l) = winners[0], losers[0]
+            new_w, new_l = calculate_elo(r_w, r_l, self.k)
+            return [(w, new_w, rd_w, vol_w), (l, new_l, rd_l, vol_l)]
+
+        r_win_avg = sum(p[1] for p in winners) / len(winners)
+        r_lose_avg = sum(p[1] for p in losers) / len(losers)
+        rated = []
+        for pid, rating, rd, volatility in winners:
+            new_rating, _ = calculate_elo(rating, r_lose_avg, self.k)
+            rated.append((pid, new_rating, rd, volatility))
+        for pid, rating, rd, volatility in losers:
+            _, new_rating = calculate_elo(r_win_avg, rating, self.k)
+            rated.append((pid, new_rating, rd, volatility))
+        return rated
+
+
+# 📐 Glicko-2 (Glickman, «Example of the Glicko-2 system»)
+def _glicko_g(phi):
+    return 1 / math.sqrt(1 + 3 * phi * phi / math.pi ** 2)
+
+
+def _glicko_volatility(phi, sigma, v, delta, tau):
+    # Новая волатильность: корень f(x) = 0 методом Иллинойса
+    a = math.log(sigma * sigma)
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta * delta - phi * phi - v - ex) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / (tau * tau)
+
+    big_a = a
+    if delta * delta > phi * phi + v:
+        big_b = math.log(delta * delta - phi * phi - v)
+    else:
+        k = 1
+        while f(a - k * tau) < 0:
+            k += 1
+        big_b = a - k * tau
+    f_a, f_b = f(big_a), f(big_b)
+    while abs(big_b - big_a) > GLICKO_EPSILON:
+        big_c = big_a + (big_a - big_b) * f_a / (f_b - f_a)
+        f_c = f(big_c)
+        if f_c * f_b <= 0:
+            big_a, f_a = big_b, f_b
+        else:
+            f_a /= 2
+        big_b, f_b = big_c, f_c
+    return math.exp(big_a / 2)
+
+
+def glicko2_player(rating, rd, volatility, games, tau=GLICKO_TAU):
+    # Состояние игрока после периода; games — [(рейтинг, rd соперника, результат 0/1, вес)]
+    mu = (rating - INITIAL_RATING) / GLICKO_SCALE
+    phi = rd / GLICKO_SCALE
+    if not games:
+        return rating, GLICKO_SCALE * math.sqrt(phi * phi + volatility * volatility), volatility
+
+    v_inv = 0.0
+    score = 0.0
+    for opp_rating, opp_rd, s, weight in games:
+        g = _glicko_g(opp_rd / GLICKO_SCALE)
+        expected = 1 / (1 + math.exp(-g * (mu - (opp_rating - INITIAL_RATING) / GLICKO_SCALE)))
+        v_inv += weight * g * g * expected * (1 - expected)
+        score += weight * g * (s - expected)
+    v = 1 / v_inv
+    sigma = _glicko_volatility(phi, volatility, v, v * score, tau)
+    phi_star = math.sqrt(phi * phi + sigma * sigma)
+    phi_new = 1 / math.sqrt(1 / (phi_star * phi_star) + 1 / v)
+    mu_new = mu + phi_new * phi_new * score
+    return INITIAL_RATING + GLICKO_SCALE * mu_new, GLICKO_SCALE * phi_new, sigma
+
+
+class Glicko2:
+    name = "glicko2"
+    uses_deviation = True
+
+    def __init__(self, tau=GLICKO_TAU):
+        self.tau = tau
+
+    def rate(self, winners, losers):
+        rated = []
+        for side, opponents, s in ((winners, losers, 1), (losers, winners, 0)):
+            weight = 1 / len(opponents)
+            for pid, rating, rd, volatility in side:
+                games = [(o[1], o[2], s, weight) for o in opponents]
+                rated.append((pid, *glicko2_player(rating, rd, volatility, games, self.tau)))
+        return rated
+
+
+def glicko2_period(ratings, rds, volatilities, games, tau=GLICKO_TAU):
+    # Период целиком на чистом Python. Индексы игроков — позиции в ratings;
+    # games — [(i, j, результат i против j, вес)], каждая партия в обе стороны
+    per_player = [[] for _ in ratings]
+    for i, j, s, weight in games:
+        per_player[i].append((ratings[j], rds[j], s, weight))
+    return [
+        glicko2_player(r, rd, vol, player_games, tau)
+        for r, rd, vol, player_games in zip(ratings, rds, volatilities, per_player)
+    ]
+
+
+@lru_cache(maxsize=None)
+def load_numpy():
+    # numpy нужен только при закрытии периода, поэтому импортируется при первом
+    # вызове, а не при запуске бота. None — numpy не установлен
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def glicko2_period_numpy(ratings, rds, volatilities, i, j, s, weights, tau=GLICKO_TAU):
+    # То же, что glicko2_period, одной серией векторных операций по всем игрокам;
+    # возвращает массивы (рейтинг, rd, волатильность)
+    np = load_numpy()
+    if np is None:
+        raise RuntimeError("Для векторного пересчёта периода нужен numpy")
+    n = len(ratings)
+    mu = (np.asarray(ratings, dtype=np.float64) - INITIAL_RATING) / GLICKO_SCALE
+    phi = np.asarray(rds, dtype=np.float64) / GLICKO_SCALE
+    sigma = np.asarray(volatilities, dtype=np.float64)
+
+    g = 1 / np.sqrt(1 + 3 * phi[j] ** 2 / np.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu[i] - mu[j])))
+    v_inv = np.bincount(i, weights * g * g * expected * (1 - expected), minlength=n)
+    score = np.bincount(i, weights * g * (s - expected), minlength=n)
+
+    played = v_inv > 0
+    mu_p, phi_p, sigma_p = mu[played], phi[played], sigma[played]
+    v = 1 / v_inv[played]
+    score_p = score[played]
+    delta = v * score_p
+
+    # Метод Иллинойса сразу для всех сыгравших игроков
+    a = np.log(sigma_p ** 2)
+    phi2 = phi_p ** 2
+    tau2 = tau * tau
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi2 - v - ex) / (2 * (phi2 + v + ex) ** 2) - (x - a) / tau2
+
+    big_a = a.copy()
+    big_b = np.empty_like(a)
+    large = delta ** 2 > phi2 + v
+    big_b[large] = np.log(delta[large] ** 2 - phi2[large] - v[large])
+    k = np.ones_like(a)
+    small = ~large
+    while small.any():
+        still = f(a - k * tau) < 0
+        small &= still
+        k[small] += 1
+    big_b[~large] = (a - k * tau)[~large]
+
+    f_a, f_b = f(big_a), f(big_b)
+    active = np.abs(big_b - big_a) > GLICKO_EPSILON
+    while active.any():
+        idx = np.nonzero(active)[0]
+        sa, sb, fa, fb = big_a[idx], big_b[idx], f_a[idx], f_b[idx]
+        c = sa + (sa - sb) * fa / (fb - fa)
+        ex = np.exp(c)
+        fc = ex * (delta[idx] ** 2 - phi2[idx] - v[idx] - ex) / (2 * (phi2[idx] + v[idx] + ex) ** 2) - (c - a[idx]) / tau2
+        swap = fc * fb <= 0
+        big_a[idx] = np.where(swap, sb, sa)
+        f_a[idx] = np.where(swap, fb, fa / 2)
+        big_b[idx], f_b[idx] = c, fc
+        active[idx] = np.abs(c - big_a[idx]) > GLICKO_EPSILON
+
+    sigma_new = np.exp(big_a / 2)
+    phi_star = np.sqrt(phi2 + sigma_new ** 2)
+    phi_new = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+    mu_new = mu_p + phi_new ** 2 * score_p
+
+    # Не игравшие в периоде: растёт только отклонение
+    out_mu, out_phi, out_sigma = mu.copy(), np.sqrt(phi ** 2 + sigma ** 2), sigma.copy()
+    out_mu[played], out_phi[played], out_sigma[played] = mu_new, phi_new, sigma_new
+    return INITIAL_RATING + GLICKO_SCALE * out_mu, GLICKO_SCALE * out_phi, out_sigma
+
+
+# 👥 Командная модель в духе TrueSkill (две команды, без ничьих) на шкале рейтинга:
+# сила игрока ~ N(рейтинг, rd²), исполнение — сила плюс шум β
+TRUESKILL_BETA = INITIAL_RD / 2
+TRUESKILL_TAU = INITIAL_RD / 100
+
+
+def _normal_pdf(x):
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def _normal_cdf(x):
+    return (1 + math.erf(x / math.sqrt(2))) / 2
+
+
+class TrueSkill:
+    name = "trueskill"
+    uses_deviation = True
+
+    def __init__(self, beta=TRUESKILL_BETA, tau=TRUESKILL_TAU):
+        self.beta = beta
+        self.tau = tau
+
+    def rate(self, winners, losers):
+        players = winners + losers
+        variances = {pid: rd * rd + self.tau * self.tau for pid, _, rd, _ in players}
+        c = math.sqrt(sum(variances.values()) + len(players) * self.beta * self.beta)
+        t = (sum(p[1] for p in winners) - sum(p[1] for p in losers)) / c
+        # Поправки среднего и дисперсии для победы (усечённое нормальное распределение)
+        v = _normal_pdf(t) / max(_normal_cdf(t), 1e-12)
+        w = v * (v + t)
+        rated = []
+        for side, sign in ((winners, 1), (losers, -1)):
+            for pid, rating, _, volatility in side:
+                variance = variances[pid]
+                new_rating = rating + sign * variance / c * v
+                new_rd = math.sqrt(variance * max(1 - variance / (c * c) * w, 1e-6))
+                rated.append((pid, new_rating, new_rd, volatility))
+        return rated
+
+
+ENGINES = {engine.name: engine for engine in (Elo, Glicko2, TrueSkill)}
+
+
+def create_engine(name):
+    return ENGINES.get(name, Elo)()
+
+
+def synthetic_period(players, games, team_share=0.2, seed=0):
+    # Случайное состояние игроков и партии периода в виде массивов для glicko2_period_numpy
+    rnd = random.Random(seed)
+    ratings = [rnd.gauss(INITIAL_RATING, 200) for _ in range(players)]
+    rds = [rnd.uniform(50, INITIAL_RD) for _ in range(players)]
+    volatilities = [INITIAL_VOLATILITY] * players
+    rows = []
+    for _ in range(games):
+        if rnd.random() < team_share:
+            a, b, c, d = rnd.sample(range(players), 4)
+            winners, losers = (a, b), (c, d)
+        else:
+            a, b = rnd.sample(range(players), 2)
+            winners, losers = (a,), (b,)
+        for w in winners:
+            for l in losers:
+                rows.append((w, l, 1.0, 1 / len(losers)))
+                rows.append((l, w, 0.0, 1 / len(winners)))
+    return ratings, rds, volatilities, rows
+
+
+def main(argv=None):
+    from src import db
+
+    parser = argparse.ArgumentParser(description="Рейтинговые системы клуба")
+    parser.add_argument("--db", default=db.DB_NAME, help="файл базы (клубы — clubs/<id>.sqlite3)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    engine_cmd = commands.add_parser("engine", help="показать или сменить систему рейтинга клуба")
+    engine_cmd.add_argument("name", nargs="?", choices=sorted(ENGINES))
+    commands.add_parser("period", help="закрыть период Glicko-2")
+    synthetic = commands.add_parser("synthetic", help="замерить векторный пересчёт периода")
+    synthetic.add_argument("--players", type=int, default=100_000)
+    synthetic.add_argument("--games", type=int, default=300_000)
+    synthetic.add_argument("--check", type=int, default=0, metavar="N",
+                           help="сверить первые N игроков с пересчётом на чистом Python")
+    args = parser.parse_args(argv)
+    db.DB_NAME = args.db
+
+    if args.command == "synthetic":
+        ratings, rds, volatilities, rows = synthetic_period(args.players, args.games)
+        np = load_numpy()
+        if np is None:
+            parser.error("для synthetic нужен numpy")
+        i, j, s, w = (np.array(column) for column in zip(*rows))
+        started = time.perf_counter()
+        new_ratings, new_rds, new_vols = glicko2_period_numpy(ratings, rds, volatilities, i, j, s, w)
+        elapsed = time.perf_counter() - started
+        print(f"glicko2: {args.players} игроков, {args.games} матчей за {elapsed:.3f} с")
+        if args.check:
+            expected = glicko2_period(ratings, rds, volatilities, rows)[:args.check]
+            worst = max(
+                max(abs(a - b) for a, b in zip(python, vector))
+                for python, vector in zip(expected, zip(new_ratings, new_rds, new_vols))
+            )
+            print(f"Расхождение с чистым Python на {args.check} игроках: {worst:.2e}")
+        return
+
+    db.init_db()
+    if args.command == "engine":
+        if args.name:
+            db.set_rating_engine(args.name)
+        print(f"Система рейтинга: {db.get_rating_engine().name}")
+        return
+
+    changes = db.close_rating_period()
+    print(f"Период закрыт, рейтинг изменился у {len(changes)} игроков.")
+
+
+if __name__ == "__main__":
+    main()
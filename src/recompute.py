@@ -0,0 +1,199 @@
+# 🔄 Пересчёт рейтингов с нуля по истории подтверждённых матчей.
+#
+#   python -m src.recompute --k 24 --dry-run
+#   python -m src.recompute --synthetic 1000000 --players 2000
+#
+# Матчи читаются потоком в порядке времени. Быстрый режим (NumPy) раскладывает
+# матчи по «слоям»: в одном слое каждый игрок встречается не больше одного раза,
+# поэтому весь слой обновляется одной векторной операцией, а результат совпадает
+# с последовательным пересчётом.
+import argparse
+import random
+import time
+
+from src import db
+from src.ratings import expected_score
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+INITIAL_RATING = 1500
+
+SINGLE = 0
+TEAM = 1
+
+
+def iter_confirmed_matches(conn):
+    # (тип, победители, проигравшие) по всем подтверждённым матчам в порядке времени
+    cur = conn.cursor()
+    cur.execute("""
+    SELECT 'single', id, player1_id, player2_id, NULL, NULL, score1, score2, winner_id, timestamp
+    FROM matches WHERE confirmed = 1
+    UNION ALL
+    SELECT 'team', id, team1_player1_id, team1_player2_id, team2_player1_id, team2_player2_id,
+           score1, score2, NULL, timestamp
+    FROM team_matches
+    WHERE status = 'finalized'
+    ORDER BY timestamp, 1, 2
+    """)
+    for kind, _, a, b, c, d, score1, score2, winner_id, _ in cur:
+        if kind == "single":
+            if winner_id == a:
+                yield SINGLE, (a,), (b,)
+            else:
+                yield SINGLE, (b,), (a,)
+        elif score1 > score2:
+            yield TEAM, (a, b), (c, d)
+        else:
+            yield TEAM, (c, d), (a, b)
+
+
+def replay(matches, k=db.ELO_K):
+    ratings = {}
+    for kind, winners, losers in matches:
+        if kind == SINGLE:
+            (w,), (l,) = winners, losers
+            ratings[w], ratings[l] = db.calculate_elo(ratings.get(w, INITIAL_RATING),
+                                                      ratings.get(l, INITIAL_RATING), k)
+            continue
+
+        players = [(pid, None, None, ratings.get(pid, INITIAL_RATING), None, None) for pid in winners + losers]
+        # _team_rating_changes ждёт игроков в порядке команда 1, команда 2 и счёт
+        for pid, _, after in db._team_rating_changes(players, 1, 0, k):
+            ratings[pid] = after
+    return ratings
+
+
+def replay_numpy(matches, k=db.ELO_K):
+    if np is None:
+        raise RuntimeError("Для быстрого пересчёта нужен numpy")
+
+    # Слой матча — на единицу больше последнего слоя любого из его игроков.
+    # Слоты матча: победитель, напарник, проигравший, напарник (в 1x1 игрок повторяется)
+    last_layer = {}
+    get_layer = last_layer.get
+    layers = []
+    slots = []
+    for kind, winners, losers in matches:
+        if kind == TEAM:
+            a, b = winners
+            c, d = losers
+            layer = max(get_layer(a, -1), get_layer(b, -1), get_layer(c, -1), get_layer(d, -1)) + 1
+            last_layer[a] = last_layer[b] = last_layer[c] = last_layer[d] = layer
+            slots += (a, b, c, d)
+        else:
+            (a,), (c,) = winners, losers
+            layer = max(get_layer(a, -1), get_layer(c, -1)) + 1
+            last_layer[a] = last_layer[c] = layer
+            slots += (a, a, c, c)
+        layers.append(layer)
+
+    if not layers:
+        return {}
+
+    slots = np.array(slots, dtype=np.int64).reshape(-1, 4)
+    pids, slots = np.unique(slots, return_inverse=True)
+    slots = slots.reshape(-1, 4)
+    ratings = np.full(len(pids), INITIAL_RATING, dtype=np.float64)
+
+    layer_of = np.array(layers, dtype=np.int64)
+    order = np.argsort(layer_of, kind="stable")
+    bounds = np.searchsorted(layer_of[order], np.arange(layer_of.max() + 2))
+
+    # Матч 1x1 — это «команды» из одного повторённого игрока: средний рейтинг команды
+    # совпадает с рейтингом игрока, и формула 2x2 сводится к calculate_elo
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        batch = slots[order[start:stop]]
+        win, lose = batch[:, :2], batch[:, 2:]
+        r_win, r_lose = ratings[win], ratings[lose]
+        r_win_avg = r_win.sum(axis=1, keepdims=True) / 2
+        r_lose_avg = r_lose.sum(axis=1, keepdims=True) / 2
+        expected_w = expected_score(r_win, r_lose_avg)
+        expected_l = expected_score(r_win_avg, r_lose)
+        # Все игроки внутри слоя различны, поэтому запись не затирает чужие обновления
+        ratings[win] = np.round(r_win + k * (1 - expected_w))
+        ratings[lose] = np.round(r_lose + k * (0 - (1 - expected_l)))
+
+    return dict(zip(pids.tolist(), ratings.astype(np.int64).tolist()))
+
+
+def diff_ratings(conn, ratings):
+    # [(id, username, текущий, пересчитанный)] для игроков, у которых рейтинг изменится
+    cur = conn.cursor()
+    cur.execute("SELECT id, username, rating FROM players ORDER BY id")
+    return [
+        (pid, username, current, ratings.get(pid, INITIAL_RATING))
+        for pid, username, current in cur
+        if ratings.get(pid, INITIAL_RATING) != current
+    ]
+
+
+def apply_ratings(conn, diff):
+    with conn:
+        changes = db._apply_rating_changes(conn.cursor(), "recompute", None,
+                                           [(pid, current, new) for pid, _, current, new in diff])
+    db.ratings_changed(changes)
+
+
+def synthetic_matches(n, players, team_share=0.2, seed=0):
+    rnd = random.Random(seed)
+    ids = range(1, players + 1)
+    for _ in range(n):
+        if rnd.random() < team_share:
+            a, b, c, d = rnd.sample(ids, 4)
+            yield TEAM, (a, b), (c, d)
+        else:
+            a, b = rnd.sample(ids, 2)
+            yield SINGLE, (a,), (b,)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пересчёт рейтингов по истории матчей")
+    parser.add_argument("--db", default=db.DB_NAME, help="файл базы (клубы — clubs/<id>.sqlite3)")
+    parser.add_argument("--k", type=int, default=db.ELO_K, help="коэффициент K для Эло")
+    parser.add_argument("--dry-run", action="store_true", help="только показать разницу")
+    parser.add_argument("--engine", choices=["auto", "python", "numpy"], default="auto")
+    parser.add_argument("--synthetic", type=int, metavar="N",
+                        help="пересчитать N случайных матчей без базы и замерить время")
+    parser.add_argument("--players", type=int, default=1000, help="игроков в синтетическом прогоне")
+    args = parser.parse_args(argv)
+    db.DB_NAME = args.db
+
+    engine = args.engine
+    if engine == "auto":
+        engine = "numpy" if np is not None else "python"
+    run = replay_numpy if engine == "numpy" else replay
+
+    if args.synthetic:
+        matches = list(synthetic_matches(args.synthetic, args.players))
+        started = time.perf_counter()
+        ratings = run(matches, args.k)
+        elapsed = time.perf_counter() - started
+        print(f"{engine}: {len(matches)} матчей, {len(ratings)} игроков за {elapsed:.2f} с")
+        return
+
+    db.init_db()
+    if db.get_rating_engine().name != "elo":
+        parser.error("пересчёт по истории поддерживает только Эло; для Glicko-2 есть python -m src.ratings period")
+    if db.has_finished_seasons():
+        parser.error("пересчёт по истории отменил бы мягкий сброс закрытых сезонов")
+    conn = db.connect()
+    started = time.perf_counter()
+    ratings = run(iter_confirmed_matches(conn), args.k)
+    elapsed = time.perf_counter() - started
+    diff = diff_ratings(conn, ratings)
+
+    for _, username, current, new in diff:
+        print(f"@{username}: {current} → {new} ({new - current:+d})")
+    print(f"{engine}: пересчёт за {elapsed:.2f} с, изменится рейтинг у {len(diff)} игроков")
+
+    if not args.dry_run and diff:
+        apply_ratings(conn, diff)
+        print("Рейтинги обновлены.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# 🗓 Сезоны клуба.
+#
+#   python -m src.seasons --db clubs/-100123.sqlite3 list
+#   python -m src.seasons --db clubs/-100123.sqlite3 snapshot
+#   python -m src.seasons --db clubs/-100123.sqlite3 rollover --keep 0.5
+#
+# Бот периодически снимает таблицу текущего сезона в leaderboard_snapshots, и
+# /rating season=<n> читает её оттуда. rollover одной транзакцией пишет итоговый снимок,
+# открывает новый сезон и мягко сбрасывает рейтинги: от отрыва от начального рейтинга
+# остаётся доля --keep (0 — полный сброс, 1 — без сброса). Сброс записывается в журнал
+# rating_events, поэтому история рейтинга игрока его показывает. В клубах с Glicko-2
+# перед закрытием сезона закрывается текущий период.
+#
+# Запущенный бот замечает запись другого процесса при следующем чтении рейтингов
+# (db.sync_external_writes) и перечитывает свои кэши.
+import argparse
+
+from src import db
+
+
+SOFT_RESET_KEEP = 0.5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сезоны клуба")
+    parser.add_argument("--db", default=db.DB_NAME, help="файл базы (клубы — clubs/<id>.sqlite3)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="список сезонов")
+    commands.add_parser("snapshot", help="снять таблицу текущего сезона")
+    rollover = commands.add_parser("rollover", help="закрыть сезон и начать новый")
+    rollover.add_argument("--keep", type=float, default=SOFT_RESET_KEEP,
+                          help="доля отрыва от начального рейтинга, которая остаётся (0..1)")
+    args = parser.parse_args(argv)
+    db.DB_NAME = args.db
+    db.init_db()
+
+    if args.command == "list":
+        for season, started_at, ended_at, snapshot_at, size in db.get_seasons():
+            state = f"закончился {ended_at}" if ended_at else "идёт"
+            snapshot = f"снимок {snapshot_at}, игроков {size}" if snapshot_at else "снимка нет"
+            print(f"Сезон {season}: начался {started_at}, {state}; {snapshot}")
+        return
+
+    if args.command == "snapshot":
+        season, changed = db.snapshot_leaderboard()
+        print(f"Сезон {season}: изменилось строк таблицы: {changed}.")
+        return
+
+    if not 0 <= args.keep <= 1:
+        parser.error("--keep должен быть от 0 до 1")
+    db.close_rating_period()
+    result = db.rollover_season(args.keep)
+    if result is None:
+        print("Сезон уже закрыт другим процессом.")
+        return
+    season, new_season, changes = result
+    print(f"Сезон {season} закрыт, начался сезон {new_season}; рейтинг сброшен у {len(changes)} игроков.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import asyncio
+import contextlib
+import os
+from collections import OrderedDict
+
+from aiogram.types import Message
+
+from src.store import AsyncRatingStore
+
+
+DEFAULT_CLUB = 0
+
+
+# 🏓 Клубы: у каждого группового чата свой рейтинг в отдельном файле базы,
+# поэтому запись в одном клубе не ждёт блокировку другого, а /rating читает только свой файл.
+# Личные чаты и старые данные — клуб 0, он живёт в db.DB_NAME; перенести их в базу
+# группы можно через src.transfer (см. описание модуля).
+# Открытыми держатся соединения не более чем capacity клубов: давно не использованные
+# закрываются и откроются заново при следующем запросе.
+class ShardResolver:
+    def __init__(self, directory="clubs", capacity=64):
+        self.directory = directory
+        self.capacity = capacity
+        self.default = AsyncRatingStore()
+        self._stores = {}
+        self._open = OrderedDict()
+        self._create_lock = asyncio.Lock()
+
+    def path(self, club_id):
+        return os.path.join(self.directory, f"{club_id}.sqlite3")
+
+    async def get(self, club_id):
+        if club_id == DEFAULT_CLUB:
+            # Схема основной базы проверяется при первом запросе, а не при импорте бота
+            await self.default.init_db()
+            return self.default
+        store = self._stores.get(club_id)
+        if store is None:
+            async with self._create_lock:
+                store = self._stores.get(club_id)
+                if store is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    store = AsyncRatingStore(self.path(club_id))
+                    await store.init_db()
+                    self._stores[club_id] = store
+        self._open[club_id] = store
+        self._open.move_to_end(club_id)
+        while len(self._open) > self.capacity:
+            _, old = self._open.popitem(last=False)
+            old.release()
+        return store
+
+    @contextlib.asynccontextmanager
+    async def borrow(self, club_id):
+        # Хранилище клуба для фоновых задач: уже открытое берётся как есть, не поднимаясь
+        # в LRU, а закрытое открывается только на время задачи. Иначе обход всех клубов
+        # вытеснял бы из capacity те, которыми сейчас пользуются
+        if club_id == DEFAULT_CLUB:
+            yield await self.get(club_id)
+            return
+        store = self._open.get(club_id)
+        if store is not None:
+            yield store
+            return
+        store = AsyncRatingStore(self.path(club_id))
+        try:
+            await store.init_db()
+            yield store
+        finally:
+            store.release()
+
+    def club_ids(self):
+        # Все клубы, у которых уже есть файл базы. Посторонние файлы (резервные копии
+        # вроде -100123.backup.sqlite3) пропускаются
+        if not os.path.isdir(self.directory):
+            return []
+        ids = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".sqlite3"):
+                continue
+            try:
+                ids.append(int(name[:-len(".sqlite3")]))
+            except ValueError:
+                continue
+        return ids
+
+    def __len__(self):
+        return len(self._open)
+
+    def close(self):
+        self.default.close()
+        for store in self._stores.values():
+            store.close()
+        self._open.clear()
+
+
+def club_of(event):
+    # Клуб сообщения — его групповой чат; клуб кнопки записан в её данных (src.callbacks)
+    if isinstance(event, Message) and event.chat.type != "private":
+        return event.chat.id
+    return DEFAULT_CLUB
@@ -0,0 +1,128 @@
+# 📈 Статистика игроков в таблице player_stats.
+#
+# Статистика обновляется инкрементально при подтверждении матчей (src.db),
+# а этот модуль умеет пересобрать её с нуля по истории:
+#
+#   python -m src.stats --backfill
+import argparse
+
+INITIAL_RATING = 1500
+
+STATS_COLUMNS = (
+    "player_id", "games", "wins", "losses",
+    "singles_games", "singles_wins", "doubles_games", "doubles_wins",
+    "points_for", "points_against", "streak", "peak_rating",
+)
+
+# Один матч одного игрока прибавляется к его строке; streak > 0 — серия побед, < 0 — поражений
+UPSERT_SQL = f"""
+INSERT INTO player_stats ({", ".join(STATS_COLUMNS)})
+VALUES ({", ".join("?" * len(STATS_COLUMNS))})
+ON CONFLICT(player_id) DO UPDATE SET
+    games = games + excluded.games,
+    wins = wins + excluded.wins,
+    losses = losses + excluded.losses,
+    singles_games = singles_games + excluded.singles_games,
+    singles_wins = singles_wins + excluded.singles_wins,
+    doubles_games = doubles_games + excluded.doubles_games,
+    doubles_wins = doubles_wins + excluded.doubles_wins,
+    points_for = points_for + excluded.points_for,
+    points_against = points_against + excluded.points_against,
+    streak = CASE
+        WHEN excluded.wins > 0 THEN CASE WHEN streak > 0 THEN streak + 1 ELSE 1 END
+        ELSE CASE WHEN streak < 0 THEN streak - 1 ELSE -1 END
+    END,
+    peak_rating = MAX(peak_rating, excluded.peak_rating)
+"""
+
+
+def match_stats_rows(doubles, winners, losers, winner_score, loser_score):
+    # Строки для UPSERT_SQL: winners/losers — [(player_id, рейтинг после матча)]
+    rows = []
+    for players, won, points_for, points_against in (
+        (winners, 1, winner_score, loser_score),
+        (losers, 0, loser_score, winner_score),
+    ):
+        for pid, rating in players:
+            rows.append((
+                pid, 1, won, 1 - won,
+                1 - doubles, won * (1 - doubles), doubles, won * doubles,
+                points_for, points_against, 1 if won else -1, max(rating, INITIAL_RATING),
+            ))
+    return rows
+
+
+def rebuild_player_stats(cur):
+    # Пересобирает player_stats по всем подтверждённым матчам в порядке времени
+    cur.execute("DELETE FROM player_stats")
+    cur.execute("""
+    SELECT 0, player1_id, NULL, player2_id, NULL, score1, score2, winner_id, timestamp
+    FROM matches WHERE confirmed = 1
+    UNION ALL
+    SELECT 1, team1_player1_id, team1_player2_id, team2_player1_id, team2_player2_id,
+           score1, score2, NULL, timestamp
+    FROM team_matches
+    WHERE status = 'finalized'
+    ORDER BY timestamp, 1, 2
+    """)
+    stats = {}
+    for doubles, a, b, c, d, score1, score2, winner_id, _ in cur.fetchall():
+        if doubles:
+            team1, team2 = [(a, 0), (b, 0)], [(c, 0), (d, 0)]
+            team1_won = score1 > score2
+        else:
+            team1, team2 = [(a, 0)], [(c, 0)]
+            team1_won = winner_id == a
+        if team1_won:
+            rows = match_stats_rows(doubles, team1, team2, score1, score2)
+        else:
+            rows = match_stats_rows(doubles, team2, team1, score2, score1)
+        for row in rows:
+            pid, won = row[0], row[2]
+            current = stats.get(pid)
+            if current is None:
+                stats[pid] = list(row)
+                continue
+            for i in range(1, 10):
+                current[i] += row[i]
+            streak = current[10]
+            current[10] = (streak + 1 if streak > 0 else 1) if won else (streak - 1 if streak < 0 else -1)
+
+    # Пиковый рейтинг — по журналу изменений рейтинга
+    cur.execute("""
+    SELECT p.id, MAX(p.rating, COALESCE(MAX(e.rating_after), 0), ?)
+    FROM players p LEFT JOIN rating_events e ON e.player_id = p.id
+    GROUP BY p.id
+    """, (INITIAL_RATING,))
+    for pid, peak in cur.fetchall():
+        if pid in stats:
+            stats[pid][11] = peak
+
+    cur.executemany(
+        f"INSERT INTO player_stats ({', '.join(STATS_COLUMNS)}) VALUES ({', '.join('?' * len(STATS_COLUMNS))})",
+        [tuple(row) for row in stats.values()],
+    )
+    return len(stats)
+
+
+def main(argv=None):
+    from src import db
+
+    parser = argparse.ArgumentParser(description="Статистика игроков")
+    parser.add_argument("--db", default=db.DB_NAME, help="файл базы (клубы — clubs/<id>.sqlite3)")
+    parser.add_argument("--backfill", action="store_true", help="пересобрать player_stats по истории матчей")
+    args = parser.parse_args(argv)
+    db.DB_NAME = args.db
+    if not args.backfill:
+        parser.print_help()
+        return
+
+    db.init_db()
+    conn = db.connect()
+    with conn:
+        count = rebuild_player_stats(conn.cursor())
+    print(f"Статистика пересобрана для {count} игроков.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from src import db
+from src.batch import BatchWriter
+from src.leaderboard import Leaderboard
+
+
+# Асинхронная обёртка над src.db: все обращения к sqlite3 выполняются в отдельном
+# пуле потоков, поэтому медленная запись или заблокированная база не останавливают
+# event loop. Один поток по умолчанию — SQLite всё равно допускает одного писателя.
+# path — файл базы клуба (None — db.DB_NAME); потоки пула работают только с ним.
+class AsyncRatingStore:
+    def __init__(self, path=None, max_workers=1):
+        self.path = path
+        self.max_workers = max_workers
+        self._executor = None
+        self.leaderboard = Leaderboard()
+        self._leaderboard_lock = asyncio.Lock()
+        # Счётчик внешних записей базы (db.sync_external_writes), учтённый в таблице рейтинга
+        self._external_generation = 0
+        self._schema_checked = False
+        self._schema_lock = asyncio.Lock()
+        # Создание и отклонение матчей пишутся пачками, см. src.batch
+        self.writer = BatchWriter(self._run)
+
+    @property
+    def opened(self):
+        return self._executor is not None
+
+    async def _run(self, func, *args, **kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="db",
+                initializer=db.use_database, initargs=(self.path,),
+            )
+        loop = asyncio.get_running_loop()
+        # Копия контекста: трассировка SQL относит запросы к апдейту, который их вызвал
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, partial(context.run, func, *args, **kwargs))
+
+    def release(self):
+        # Закрывает соединение и поток, не дожидаясь уже поставленных запросов;
+        # следующий запрос откроет их заново
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.submit(db.release_database)
+            executor.shutdown(wait=False)
+            self.leaderboard = Leaderboard()
+
+    def close(self):
+        self.writer.close()
+        if self._executor is not None:
+            self._executor.submit(db.close_connections).result()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # 👤 Игроки
+    async def init_db(self):
+        # Схема проверяется один раз за жизнь хранилища; параллельные первые
+        # запросы ждут одну проверку
+        if not self._schema_checked:
+            async with self._schema_lock:
+                if not self._schema_checked:
+                    await self._run(db.init_db)
+                    self._schema_checked = True
+
+    async def warm_up(self, page=500):
+        # Кэш игроков и таблица рейтинга загружаются заранее, а не первыми апдейтами.
+        # Игроки читаются страницами, чтобы апдейты успевали встать в очередь между ними
+        await self.init_db()
+        capacity = db.player_cache(self.path).capacity
+        before_id, loaded = None, 0
+        while loaded < capacity:
+            before_id = await self._run(db.warm_player_cache, before_id, min(page, capacity - loaded))
+            loaded += page
+            if before_id is None:
+                break
+        await self.get_leaderboard()
+
+    async def register_player(self, telegram_id, username):
+        result = await self._run(db.register_player, telegram_id, username)
+        self.leaderboard.invalidate()
+        return result
+
+    async def update_username(self, telegram_id, username):
+        changed = await self._run(db.update_username, telegram_id, username)
+        if changed:
+            self.leaderboard.invalidate()
+        return changed
+
+    async def get_player_by_username(self, username):
+        return await self._run(db.get_player_by_username, username)
+
+    async def get_player_by_telegram_id(self, telegram_id):
+        return await self._run(db.get_player_by_telegram_id, telegram_id)
+
+    async def get_player_by_id(self, pid):
+        return await self._run(db.get_player_by_id, pid)
+
+    async def get_player_stats(self, player_id):
+        return await self._run(db.get_player_stats, player_id)
+
+    async def get_games_played(self, player_id):
+        return await self._run(db.get_games_played, player_id)
+
+    async def get_rating_history(self, player_id, since=None):
+        return await self._run(db.get_rating_history, player_id, since)
+
+    async def get_rating_at(self, player_id, moment):
+        return await self._run(db.get_rating_at, player_id, moment)
+
+    async def get_rating_table(self):
+        return await self._run(db.get_rating_table)
+
+    async def suggest_opponents(self, player_id, rating, count=5):
+        return await self._run(db.suggest_opponents, player_id, rating, count)
+
+    # 🧮 Система рейтинга клуба
+    async def get_rating_engine(self):
+        return await self._run(db.get_rating_engine)
+
+    async def set_rating_engine(self, name):
+        return await self._run(db.set_rating_engine, name)
+
+    async def close_rating_period(self):
+        changes = await self._run(db.close_rating_period)
+        if changes:
+            self.leaderboard.invalidate()
+        return changes
+
+    async def rating_period_wait(self, period_seconds):
+        return await self._run(db.rating_period_wait, period_seconds)
+
+    async def get_leaderboard(self):
+        # Рейтинги могли изменить извне (python -m src.recompute, src.seasons rollover...):
+        # тогда таблица перечитывается. Параллельные запросы ждут одну загрузку, а не читают её каждый сам
+        generation = await self._run(db.sync_external_writes)
+        if generation != self._external_generation:
+            self._external_generation = generation
+            self.leaderboard.invalidate()
+        if not self.leaderboard.loaded:
+            async with self._leaderboard_lock:
+                if not self.leaderboard.loaded:
+                    version = self.leaderboard.version
+                    self.leaderboard.load(await self._run(db.get_rating_table), version)
+        return self.leaderboard
+
+    # 🗓 Сезоны
+    async def snapshot_leaderboard(self):
+        return await self._run(db.snapshot_leaderboard)
+
+    async def snapshot_wait(self, interval_seconds):
+        return await self._run(db.snapshot_wait, interval_seconds)
+
+    async def get_season_table(self, season, page):
+        size = self.leaderboard.page_size
+        return await self._run(db.get_season_table, season, (page - 1) * size + 1, page * size)
+
+    async def rollover_season(self, keep):
+        result = await self._run(db.rollover_season, keep)
+        if result:
+            self.leaderboard.invalidate()
+        return result
+
+    # 🎮 Матчи 1x1
+    async def record_match(self, player1_id, player2_id, score1, score2, winner_id):
+        return await self.writer.submit(db.record_match, player1_id, player2_id, score1, score2, winner_id)
+
+    async def get_match(self, match_id):
+        return await self._run(db.get_match, match_id)
+
+    async def get_match_players(self, match_id):
+        return await self._run(db.get_match_players, match_id)
+
+    async def confirm_match(self, match_id):
+        players = await self._run(db.confirm_match, match_id)
+        if players:
+            self.leaderboard.invalidate()
+        return players
+
+    async def delete_match(self, match_id):
+        return await self.writer.submit(db.delete_match, match_id)
+
+    # 👥 Матчи 2x2
+    async def record_team_match(self, t1p1, t1p2, t2p1, t2p2, score1, score2):
+        return await self.writer.submit(db.record_team_match, t1p1, t1p2, t2p1, t2p2, score1, score2)
+
+    async def get_team_match(self, match_id):
+        return await self._run(db.get_team_match, match_id)
+
+    async def confirm_team_participant(self, match_id, telegram_id):
+        confirmed, status = await self.writer.submit(db.confirm_team_participant, match_id, telegram_id)
+        if status == db.TEAM_FINALIZED and confirmed:
+            self.leaderboard.invalidate()
+        return confirmed, status
+
+    async def reject_team_match(self, match_id, telegram_id):
+        return await self.writer.submit(db.reject_team_match, match_id, telegram_id)
+
+    # ⌛ Истечение неподтверждённых матчей
+    async def remember_message(self, match_type, match_id, chat_id, message_id):
+        return await self.writer.submit(db.remember_message, match_type, match_id, chat_id, message_id)
+
+    async def expire_matches(self, limit=500):
+        return await self._run(db.expire_matches, limit)
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from time import monotonic
+
+
+# 🪣 Token bucket на ключ (telegram_id, команда): burst запросов подряд, дальше — rate в секунду.
+# Корзины хранятся в OrderedDict по времени последнего запроса, самые старые вытесняются
+# сверх capacity: вытесненная корзина всё равно успела бы наполниться. Всё работает
+# в event loop, поэтому без блокировок.
+class RateLimiter:
+    def __init__(self, rate, burst, capacity=100_000, clock=monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key):
+        # 0 — запрос разрешён, иначе — сколько секунд ждать следующего токена
+        now = self.clock()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.capacity:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# ⌛ Множество недавно виденных ключей: ключ живёт ttl секунд. TTL у всех ключей одинаковый,
+# поэтому порядок вставки — это порядок истечения, и просроченные снимаются с начала
+class TTLSet:
+    def __init__(self, ttl, capacity=100_000, clock=monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.clock = clock
+        self._expires = OrderedDict()
+
+    def __len__(self):
+        return len(self._expires)
+
+    def _purge(self, now):
+        expires = self._expires
+        while expires:
+            key, expiry = next(iter(expires.items()))
+            if expiry > now:
+                return
+            del expires[key]
+
+    def add(self, key):
+        # True — ключ новый, False — уже встречался за последние ttl секунд
+        now = self.clock()
+        self._purge(now)
+        if key in self._expires:
+            return False
+        self._expires[key] = now + self.ttl
+        if len(self._expires) > self.capacity:
+            self._expires.popitem(last=False)
+        return True
@@ -0,0 +1,61 @@
+import sqlite3
+from contextvars import ContextVar
+from time import perf_counter
+
+from src import metrics
+
+
+# 🔎 Трассировка SQL: соединения открываются с factory=TracingConnection,
+# каждый запрос попадает в гистограмму sqlite_statement_seconds по типу (SELECT, INSERT, ...).
+# Счётчик запросов текущего апдейта лежит в contextvar: его ставит UpdateMetricsMiddleware,
+# а AsyncRatingStore запускает функции базы в копии контекста, поэтому счётчик виден и в потоке базы.
+update_statements = ContextVar("update_statements", default=None)
+
+
+def _statement_kind(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def _observe(cursor, sql, call, parameters):
+    conn = cursor.connection
+    opening = not conn.in_transaction
+    started = perf_counter()
+    try:
+        return call(sql, parameters)
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e):
+            metrics.locked_errors.inc()
+        raise
+    finally:
+        elapsed = perf_counter() - started
+        metrics.statement_seconds.observe(elapsed, kind=_statement_kind(sql))
+        if opening and conn.in_transaction:
+            # Запрос открыл транзакцию IMMEDIATE — в его время входит ожидание блокировки записи
+            metrics.lock_wait_seconds.observe(elapsed)
+        counter = update_statements.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+class TracingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        if not metrics.enabled:
+            return super().execute(sql, parameters)
+        return _observe(self, sql, super().execute, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not metrics.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        return _observe(self, sql, super().executemany, seq_of_parameters)
+
+
+class TracingConnection(sqlite3.Connection):
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
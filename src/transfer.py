@@ -0,0 +1,438 @@
+# 📦 Импорт и экспорт истории матчей (JSONL или CSV).
+#
+#   python -m src.transfer --db clubs/-100123.sqlite3 export season.jsonl
+#   python -m src.transfer export matches.csv --table matches
+#   python -m src.transfer import tournament.csv --table matches --recompute
+#   python -m src.transfer import season.jsonl --recompute
+#
+# Таблицы и поля записей:
+#   players      — telegram_id, username, rating
+#   matches      — player1, player2, score1, score2, confirmed, timestamp
+#   team_matches — team1_player1, team1_player2, team2_player1, team2_player2,
+#                  score1, score2, status, timestamp
+# Игрок в матче — username (можно с @) или telegram_id числом. confirmed по умолчанию 1,
+# status — finalized, timestamp — время импорта: результаты турнира считаются согласованными.
+#
+# В JSONL без --table пишутся все три таблицы подряд, у каждой записи есть поле table;
+# CSV — всегда одна таблица. Файлы читаются и пишутся потоком, а вставка идёт пачками
+# executemany по --chunk строк в своей транзакции, поэтому память не зависит от размера
+# файла (в памяти — только соответствие игроков их id). Матчи, игроки которых не найдены,
+# пропускаются и перечисляются в stderr.
+#
+# Импортированные матчи не меняют рейтинги сами: --recompute пересчитывает рейтинги
+# по всей истории (src.recompute, только Эло и только пока ни один сезон не закрыт)
+# и пересобирает статистику игроков.
+# Бот держит кэши игроков и рейтинга, поэтому импорт лучше делать при остановленном боте.
+# Для больших файлов --defer-indexes снимает индексы матчей на время вставки и строит их
+# заново в конце — так импорт примерно в полтора-два раза быстрее.
+#
+# Перенос истории в базу клуба. До появления клубов все чаты писали в общую db.sqlite3
+# (клуб 0), и группа, которая уже играла, начинает с пустой таблицы. Её игроки и матчи
+# переносятся при остановленном боте (chat_id группы — отрицательное число):
+#
+#   python -m src.transfer export club0.jsonl
+#   python -m src.transfer --db clubs/<chat_id>.sqlite3 import club0.jsonl
+#   python -m src.stats --db clubs/<chat_id>.sqlite3 --backfill
+#
+# Рейтинги переносятся как есть (начальной записью 'import' в журнале), статистику
+# пересобирает --backfill. Состояние Glicko-2 не переносится: систему рейтинга клуба
+# нужно выбрать заново. Общая база не меняется, личные чаты продолжают работать с ней.
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import sys
+import time
+from datetime import datetime, timezone
+
+from src import db
+from src.ratings import INITIAL_RATING
+from src.stats import rebuild_player_stats
+
+
+CHUNK_SIZE = 10_000
+
+COLUMNS = {
+    "players": ("telegram_id", "username", "rating"),
+    "matches": ("player1", "player2", "score1", "score2", "confirmed", "timestamp"),
+    "team_matches": ("team1_player1", "team1_player2", "team2_player1", "team2_player2",
+                     "score1", "score2", "status", "timestamp"),
+}
+
+EXPORT_SQL = {
+    "players": "SELECT telegram_id, username, rating FROM players ORDER BY id",
+    "matches": """
+    SELECT COALESCE(p1.username, p1.telegram_id), COALESCE(p2.username, p2.telegram_id),
+           m.score1, m.score2, m.confirmed, m.timestamp
+    FROM matches m
+    JOIN players p1 ON p1.id = m.player1_id
+    JOIN players p2 ON p2.id = m.player2_id
+    ORDER BY m.id
+    """,
+    "team_matches": """
+    SELECT COALESCE(a.username, a.telegram_id), COALESCE(b.username, b.telegram_id),
+           COALESCE(c.username, c.telegram_id), COALESCE(d.username, d.telegram_id),
+           tm.score1, tm.score2, tm.status, tm.timestamp
+    FROM team_matches tm
+    JOIN players a ON a.id = tm.team1_player1_id
+    JOIN players b ON b.id = tm.team1_player2_id
+    JOIN players c ON c.id = tm.team2_player1_id
+    JOIN players d ON d.id = tm.team2_player2_id
+    ORDER BY tm.id
+    """,
+}
+
+INSERT_SQL = {
+    "players": "INSERT OR IGNORE INTO players (telegram_id, username, rating) VALUES (?, ?, ?)",
+    "matches": """
+    INSERT INTO matches (player1_id, player2_id, score1, score2, winner_id, confirmed, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    """,
+    "team_matches": """
+    INSERT INTO team_matches (team1_player1_id, team1_player2_id, team2_player1_id, team2_player2_id,
+                              score1, score2, status, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    """,
+}
+
+TEAM_STATUSES = (db.TEAM_PENDING, db.TEAM_PARTIAL, db.TEAM_FINALIZED, db.TEAM_REJECTED, db.TEAM_EXPIRED)
+
+
+# 📤 Экспорт
+def export_rows(conn, table):
+    cur = conn.cursor()
+    cur.arraysize = CHUNK_SIZE
+    cur.execute(EXPORT_SQL[table])
+    while True:
+        rows = cur.fetchmany()
+        if not rows:
+            return
+        yield from rows
+
+
+def write_jsonl(out, table, rows, tagged=False):
+    columns = COLUMNS[table]
+    count = 0
+    for row in rows:
+        record = dict(zip(columns, row))
+        if tagged:
+            record = {"table": table, **record}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(out, table, rows):
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS[table])
+    count = 0
+    for chunk in chunked(rows, CHUNK_SIZE):
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def export(conn, out, fmt, table=None):
+    # {таблица: строк}; без table (только JSONL) — все таблицы по порядку
+    if fmt == "csv":
+        return {table: write_csv(out, table, export_rows(conn, table))}
+    tables = [table] if table else list(COLUMNS)
+    return {name: write_jsonl(out, name, export_rows(conn, name), tagged=table is None) for name in tables}
+
+
+# 📥 Импорт
+def read_jsonl(lines, skipped):
+    # (номер строки, запись); строки, которые не разбираются, попадают в skipped
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            skipped.append((number, e))
+            continue
+        if not isinstance(record, dict):
+            skipped.append((number, ValueError("запись должна быть объектом")))
+            continue
+        yield number, record
+
+
+def read_csv(lines, skipped):
+    # Номер строки файла: первая строка — заголовок
+    return enumerate(csv.DictReader(lines), start=2)
+
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _optional(value):
+    # В CSV пустое поле — это отсутствие значения
+    return None if value is None or value == "" else value
+
+
+def _timestamp(value):
+    # Время в формате базы (UTC, "YYYY-MM-DD HH:MM:SS"): с ним сравнивают строки истечение
+    # матчей и периоды Glicko-2. Время с часовым поясом переводится в UTC; что не разбирается
+    # datetime.fromisoformat — ошибка записи
+    value = _optional(value)
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(str(value).strip())
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _flag(value, default):
+    value = _optional(value)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ("1", "true", "yes") else 0
+    return 1 if value else 0
+
+
+class PlayerIds:
+    # username и telegram_id → players.id; перечитывается после импорта игроков.
+    # Разрешённые значения запоминаются как есть, поэтому повторный игрок — один поиск в dict
+    def __init__(self, conn):
+        self.conn = conn
+        self.stale = True
+        self._by_username = {}
+        self._by_telegram_id = {}
+        self._resolved = {}
+
+    def _load(self):
+        cur = self.conn.cursor()
+        cur.execute("SELECT id, telegram_id, username FROM players")
+        self._by_username = {}
+        self._by_telegram_id = {}
+        self._resolved = {}
+        for pid, telegram_id, username in cur:
+            self._by_telegram_id[telegram_id] = pid
+            if username is not None:
+                self._by_username[username] = pid
+        self.stale = False
+
+    def _find(self, value):
+        if isinstance(value, int):
+            return self._by_telegram_id.get(value)
+        value = str(value).strip().lstrip("@")
+        return self._by_telegram_id.get(int(value)) if value.isdigit() else self._by_username.get(value)
+
+    def __call__(self, value):
+        if self.stale:
+            self._load()
+        pid = self._resolved.get(value)
+        if pid is None:
+            pid = self._find(value)
+            if pid is None:
+                raise LookupError(f"игрок {value!r} не найден")
+            self._resolved[value] = pid
+        return pid
+
+
+def player_row(record, ids):
+    rating = _optional(record.get("rating"))
+    return (int(record["telegram_id"]), _optional(record.get("username")),
+            INITIAL_RATING if rating is None else int(rating))
+
+
+def match_row(record, ids):
+    player1, player2 = ids(record["player1"]), ids(record["player2"])
+    score1, score2 = int(record["score1"]), int(record["score2"])
+    confirmed = record.get("confirmed")
+    return (player1, player2, score1, score2, player1 if score1 > score2 else player2,
+            1 if confirmed is None or confirmed == "" else _flag(confirmed, 1),
+            _timestamp(record.get("timestamp")))
+
+
+def team_match_row(record, ids):
+    players = [ids(record[field]) for field in COLUMNS["team_matches"][:4]]
+    if len(set(players)) != 4:
+        raise ValueError("все 4 игрока должны быть разными")
+    status = _optional(record.get("status")) or db.TEAM_FINALIZED
+    if status not in TEAM_STATUSES:
+        raise ValueError(f"неизвестный статус {status!r}")
+    return (*players, int(record["score1"]), int(record["score2"]), status, _timestamp(record.get("timestamp")))
+
+
+ROW_BUILDERS = {"players": player_row, "matches": match_row, "team_matches": team_match_row}
+
+
+def import_records(conn, records, table=None, skipped=None, chunk_size=CHUNK_SIZE):
+    # records — [(номер строки, запись)]; записи без поля table относятся к table.
+    # Строки копятся по таблицам и пишутся одной транзакцией на chunk_size строк;
+    # игроки из буфера записываются раньше матчей, которые на них ссылаются.
+    # Возвращает ({таблица: вставлено строк}, [(номер строки, ошибка)])
+    skipped = [] if skipped is None else skipped
+    ids = PlayerIds(conn)
+    counts = {}
+    buffers = {name: [] for name in INSERT_SQL}
+    buffered = 0
+
+    def flush():
+        with conn:
+            cur = conn.cursor()
+            players = buffers["players"]
+            if players:
+                cur.execute("SELECT COALESCE(MAX(id), 0) FROM players")
+                last_id = cur.fetchone()[0]
+                cur.executemany(INSERT_SQL["players"], players)
+                # Рейтинг новых игроков — начальной записью в журнале, как в миграции 4
+                cur.execute("""
+                INSERT INTO rating_events (player_id, match_type, rating_before, rating_after, delta)
+                SELECT id, 'import', ?, rating, rating - ? FROM players WHERE id > ? AND rating != ?
+                """, (INITIAL_RATING, INITIAL_RATING, last_id, INITIAL_RATING))
+                ids.stale = True
+            for name, rows in buffers.items():
+                if rows and name != "players":
+                    cur.executemany(INSERT_SQL[name], rows)
+        for name, rows in buffers.items():
+            if rows:
+                counts[name] = counts.get(name, 0) + len(rows)
+                rows.clear()
+
+    pending_players = buffers["players"]
+    for number, record in records:
+        name = record.get("table") or table
+        build = ROW_BUILDERS.get(name)
+        if build is None:
+            skipped.append((number, ValueError(f"неизвестная таблица {name!r}")))
+            continue
+        if pending_players and name != "players":
+            flush()
+            buffered = 0
+        try:
+            row = build(record, ids)
+        except (KeyError, LookupError, TypeError, ValueError) as e:
+            skipped.append((number, e))
+            continue
+        buffers[name].append(row)
+        buffered += 1
+        if buffered >= chunk_size:
+            flush()
+            buffered = 0
+    if buffered:
+        flush()
+    return counts, skipped
+
+
+@contextlib.contextmanager
+def deferred_indexes(conn, tables=("matches", "team_matches")):
+    # 🗂 Индексы матчей удаляются на время импорта и строятся заново в конце: одна сортировка
+    # вместо обновления двух-четырёх B-деревьев на каждую строку. Пока индексов нет, запросы
+    # бота к матчам идут полным просмотром, поэтому режим — только для остановленного бота
+    placeholders = ", ".join("?" * len(tables))
+    with conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        """, tables)
+        indexes = cur.fetchall()
+        for name, _ in indexes:
+            cur.execute(f'DROP INDEX "{name}"')
+    try:
+        yield
+    finally:
+        with conn:
+            cur = conn.cursor()
+            for _, sql in indexes:
+                cur.execute(sql)
+
+
+def recompute(conn):
+    # Рейтинги по всей истории и статистика игроков после импорта
+    from src import recompute as recompute_module
+
+    ratings = recompute_module.replay(recompute_module.iter_confirmed_matches(conn))
+    diff = recompute_module.diff_ratings(conn, ratings)
+    if diff:
+        recompute_module.apply_ratings(conn, diff)
+    with conn:
+        rebuild_player_stats(conn.cursor())
+    return len(diff)
+
+
+def _format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.endswith(".csv") else "jsonl"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт и экспорт истории матчей")
+    parser.add_argument("--db", default=db.DB_NAME, help="файл базы (клубы — clubs/<id>.sqlite3)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help in (("export", "выгрузить таблицы в файл"), ("import", "загрузить записи из файла")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("path", help="файл .jsonl или .csv; - — stdin/stdout")
+        command.add_argument("--table", choices=list(COLUMNS), help="таблица (для CSV обязательна)")
+        command.add_argument("--format", choices=["jsonl", "csv"], help="по умолчанию — по расширению файла")
+    commands.choices["import"].add_argument("--chunk", type=int, default=CHUNK_SIZE,
+                                            help="строк в одной транзакции")
+    commands.choices["import"].add_argument("--defer-indexes", action="store_true",
+                                            help="перестроить индексы матчей после импорта (быстрее на больших файлах)")
+    commands.choices["import"].add_argument("--recompute", action="store_true",
+                                            help="пересчитать рейтинги и статистику после импорта")
+    args = parser.parse_args(argv)
+    db.DB_NAME = args.db
+
+    fmt = _format(args.path, args.format)
+    if fmt == "csv" and not args.table:
+        parser.error("для CSV нужна --table")
+
+    # Файл открывается до базы: опечатка в пути не должна создать или мигрировать базу
+    standard = sys.stdout if args.command == "export" else sys.stdin
+    try:
+        stream = standard if args.path == "-" else open(
+            args.path, "w" if args.command == "export" else "r", newline="", encoding="utf-8")
+    except OSError as e:
+        parser.error(f"не удалось открыть {args.path}: {e.strerror}")
+
+    try:
+        db.init_db()
+        if args.command == "import" and args.recompute and db.get_rating_engine().name != "elo":
+            parser.error("--recompute поддерживает только Эло")
+        if args.command == "import" and args.recompute and db.has_finished_seasons():
+            parser.error("--recompute отменил бы мягкий сброс закрытых сезонов")
+        conn = db.connect()
+        started = time.perf_counter()
+        if args.command == "export":
+            counts = export(conn, stream, fmt, args.table)
+        else:
+            skipped = []
+            records = (read_csv if fmt == "csv" else read_jsonl)(stream, skipped)
+            with deferred_indexes(conn) if args.defer_indexes else contextlib.nullcontext():
+                counts, skipped = import_records(conn, records, args.table, skipped, args.chunk)
+    finally:
+        if stream is not standard:
+            stream.close()
+
+    if args.command == "import":
+        for number, error in skipped[:20]:
+            print(f"строка {number}: {error}", file=sys.stderr)
+        if skipped:
+            print(f"Пропущено записей: {len(skipped)}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    details = ", ".join(f"{name}: {count}" for name, count in counts.items()) or "нет записей"
+    print(f"{args.command}: {total} строк за {elapsed:.2f} с ({total / max(elapsed, 1e-9):.0f}/с) — {details}",
+          file=sys.stderr)
+
+    if args.command == "import" and args.recompute:
+        changed = recompute(conn)
+        print(f"Рейтинги пересчитаны, изменились у {changed} игроков.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
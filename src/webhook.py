@@ -0,0 +1,31 @@
+import logging
+import secrets
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+# 🌐 Приём апдейтов через вебхук вместо long polling
+def create_app(dp, bot, path, secret_token):
+    app = web.Application()
+    # Сначала хуки диспетчера, потом обработчик запросов: при остановке aiohttp вызывает
+    # on_shutdown по порядку, и сессия бота закроется только после dp.shutdown,
+    # который дожидается уже начатых обработчиков
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=path)
+    return app
+
+def run_webhook(dp, bot, url, path, secret_token=None, host="0.0.0.0", port=8080):
+    # Запросы без заголовка X-Telegram-Bot-Api-Secret-Token с этим значением отклоняются.
+    # Без WEBHOOK_SECRET ключ случайный: вебхук регистрируется заново при каждом запуске
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        logging.info("WEBHOOK_SECRET is not set, using a random secret token")
+    app = create_app(dp, bot, path, secret_token)
+
+    async def set_webhook(_):
+        await bot.set_webhook(url.rstrip("/") + path, secret_token=secret_token,
+                              allowed_updates=dp.resolve_used_update_types())
+
+    app.on_startup.append(set_webhook)
+    web.run_app(app, host=host, port=port)
@@ -0,0 +1,30 @@
+import pytest
+
+from src import db
+
+
+# 🗄 Отдельная база на каждый тест: файл во временной папке, схема последней версии
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "db.sqlite3"))
+    db.init_db()
+    yield db
+    db.release_database()
+
+
+@pytest.fixture
+def players(database):
+    # id игроков с telegram_id 1..4
+    for telegram_id in range(1, 5):
+        database.register_player(telegram_id, f"player{telegram_id}")
+    return [database.get_player_by_telegram_id(telegram_id)[0] for telegram_id in range(1, 5)]
+
+
+@pytest.fixture
+def statements(database):
+    # Список SQL, выполненных соединением текущего потока, начиная с этого момента
+    executed = []
+    conn = database.connect()
+    conn.set_trace_callback(executed.append)
+    yield executed
+    conn.set_trace_callback(None)
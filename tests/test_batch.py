@@ -0,0 +1,56 @@
+import pytest
+
+
+# ✍️ Пакетная запись (db.run_batch): кэши видят рейтинги только закоммиченных операций
+class Aborted(BaseException):
+    pass
+
+
+def finalize_team_match(database, players):
+    match_id = database.record_team_match(*players, 11, 5)
+    for telegram_id in (2, 3):
+        database.confirm_team_participant(match_id, telegram_id)
+    return match_id
+
+
+def cached_ratings(database, players):
+    for pid in players:
+        database.get_player_by_id(pid)
+    return [database.player_cache().get_by_id(pid)[3] for pid in players]
+
+
+def test_batch_updates_caches_after_commit(database, players):
+    match_id = finalize_team_match(database, players)
+    results = database.run_batch([
+        (database.confirm_team_participant, (match_id, 4)),
+        (database.record_match, (players[0], players[1], 11, 5, players[0])),
+    ])
+    assert results[0] == (True, (True, database.TEAM_FINALIZED))
+    assert cached_ratings(database, players) == [1516, 1516, 1484, 1484]
+
+
+def test_aborted_batch_leaves_caches_untouched(database, players):
+    match_id = finalize_team_match(database, players)
+    assert cached_ratings(database, players) == [1500] * 4
+
+    def abort():
+        raise Aborted
+
+    with pytest.raises(Aborted):
+        database.run_batch([(database.confirm_team_participant, (match_id, 4)), (abort, ())])
+    assert cached_ratings(database, players) == [1500] * 4
+    cur = database.connect().cursor()
+    cur.execute("SELECT status FROM team_matches WHERE id = ?", (match_id,))
+    assert cur.fetchone()[0] == database.TEAM_PARTIAL
+
+
+def test_failed_operation_changes_are_dropped(database, players):
+    cached_ratings(database, players)
+
+    def rate_then_fail():
+        database.ratings_changed([(players[0], 1500, 1600)])
+        raise ValueError("boom")
+
+    results = database.run_batch([(rate_then_fail, ()), (database.get_match, (1,))])
+    assert not results[0][0]
+    assert cached_ratings(database, players)[0] == 1500
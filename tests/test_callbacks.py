@@ -0,0 +1,99 @@
+import asyncio
+import base64
+from types import SimpleNamespace
+
+from src.callbacks import ACTIONS, PACKED_SIZE, CallbackCodec, Payload
+from src.middlewares import CallbackDataMiddleware
+
+
+# 🔘 Данные кнопок: подпись HMAC, лимит Telegram в 64 байта и отказ на любые
+# повреждённые, подделанные или обрезанные данные
+codec = CallbackCodec(b"secret")
+
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+
+def flip(data, index):
+    # Та же длина и алфавит base64url, но другой старший бит символа в позиции index:
+    # младшие биты последнего символа — заполнение, их смена не меняет байты
+    replacement = ALPHABET[(ALPHABET.index(data[index]) + 32) % 64]
+    return data[:index] + replacement + data[index + 1:]
+
+
+def test_roundtrip_for_every_action():
+    for action in ACTIONS:
+        data = codec.pack(action, -1001234567890, 2**32 - 1, 2**63)
+        assert len(data) == PACKED_SIZE <= 64
+        assert codec.unpack(data) == Payload(action, -1001234567890, 2**32 - 1, 2**63)
+
+
+def test_forged_payload_is_rejected():
+    data = codec.pack("confirm", 0, 7, 42)
+    # Любой изменённый символ — и в данных, и в подписи
+    for index in range(len(data)):
+        assert codec.unpack(flip(data, index)) is None
+    assert CallbackCodec(b"other").unpack(data) is None
+    assert CallbackCodec(b"other").pack("confirm", 0, 7, 42) != data
+
+
+def test_body_with_stolen_mac_is_rejected():
+    # Подпись одной кнопки, приклеенная к данным другого матча
+    raw = base64.urlsafe_b64decode(codec.pack("confirm", 0, 7, 42) + "=")
+    other = base64.urlsafe_b64decode(codec.pack("confirm", 0, 8, 42) + "=")
+    forged = base64.urlsafe_b64encode(other[:-8] + raw[-8:]).rstrip(b"=").decode()
+    assert codec.unpack(forged) is None
+
+
+def test_truncated_and_malformed_payloads_are_rejected():
+    data = codec.pack("reject", 0, 7, 42)
+    for length in range(len(data)):
+        assert codec.unpack(data[:length]) is None
+    assert codec.unpack(data + "A") is None
+    assert codec.unpack(None) is None
+    assert codec.unpack("confirm:7") is None
+    assert codec.unpack("!" * PACKED_SIZE) is None
+    assert codec.unpack(data[:-1] + "=") is None
+
+
+def test_signed_unknown_action_is_rejected():
+    body = bytes([len(ACTIONS) + 1]) + base64.urlsafe_b64decode(codec.pack("confirm", 0, 7) + "=")[1:-8]
+    data = base64.urlsafe_b64encode(body + codec._mac(body)).rstrip(b"=").decode()
+    assert codec.unpack(data) is None
+
+
+class Callback:
+    def __init__(self, data, user_id):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text=None):
+        self.answers.append(text)
+
+
+def press(callback):
+    middleware = CallbackDataMiddleware(codec)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(data["payload"])
+
+    asyncio.run(middleware(handler, callback, {}))
+    return handled, middleware.rejected
+
+
+def test_middleware_passes_payload_to_handler():
+    handled, rejected = press(Callback(codec.pack("confirm", 0, 7, 42), 42))
+    assert handled == [Payload("confirm", 0, 7, 42)]
+    assert rejected == 0
+
+
+def test_middleware_rejects_forged_data_and_other_players():
+    forged = Callback(flip(codec.pack("confirm", 0, 7, 42), 3), 42)
+    assert press(forged) == ([], 1)
+    assert forged.answers == ["⚠️ Кнопка устарела или повреждена."]
+
+    stranger = Callback(codec.pack("confirm", 0, 7, 42), 43)
+    assert press(stranger) == ([], 0)
+    assert stranger.answers == ["Эта кнопка не для тебя."]
@@ -0,0 +1,97 @@
+import random
+import threading
+
+from src import db
+
+
+THREADS = 16
+MATCHES = 200
+
+
+# 🏁 Сотни параллельных подтверждений одних и тех же матчей: каждый матч засчитывается
+# ровно один раз, и каждое изменение рейтинга считается от актуального значения
+def run_threads(worker, jobs):
+    errors = []
+
+    def run(chunk):
+        try:
+            for job in chunk:
+                worker(job)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close_connections()
+
+    threads = [threading.Thread(target=run, args=(chunk,)) for chunk in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def record_matches(database, players, count, seed=0):
+    rnd = random.Random(seed)
+    match_ids = []
+    for _ in range(count):
+        a, b = rnd.sample(players, 2)
+        match_ids.append(database.record_match(a, b, 11, 7, a))
+    return match_ids
+
+
+def assert_ledger_consistent(database):
+    # Журнал каждого игрока — непрерывная цепочка, и её конец совпадает с players.rating
+    cur = database.connect().cursor()
+    cur.execute("SELECT player_id, rating_before, rating_after FROM rating_events ORDER BY id")
+    last = {}
+    for pid, before, after in cur.fetchall():
+        assert before == last.get(pid, 1500), f"игрок {pid}: рейтинг прочитан устаревшим"
+        last[pid] = after
+    cur.execute("SELECT id, rating FROM players")
+    for pid, rating in cur.fetchall():
+        assert rating == last.get(pid, 1500)
+
+
+def test_parallel_double_confirms_apply_each_match_once(database, players):
+    match_ids = record_matches(database, players, MATCHES)
+    confirmed = []
+    lock = threading.Lock()
+
+    def confirm(match_id):
+        if db.confirm_match(match_id):
+            with lock:
+                confirmed.append(match_id)
+
+    # Каждый поток проходит все матчи, начиная со своего места: нажатия пересекаются
+    run_threads(confirm, [match_ids[i::THREADS] + match_ids for i in range(THREADS)])
+
+    assert sorted(confirmed) == match_ids
+    cur = database.connect().cursor()
+    cur.execute("SELECT match_id, COUNT(*) FROM rating_events WHERE match_type = 'single' GROUP BY match_id")
+    assert dict(cur.fetchall()) == {match_id: 2 for match_id in match_ids}
+    assert_ledger_consistent(database)
+
+
+def test_reject_racing_confirm_never_drops_a_rated_match(database, players):
+    match_ids = record_matches(database, players, MATCHES, seed=1)
+    outcomes = {match_id: [] for match_id in match_ids}
+
+    def press(job):
+        action, match_id = job
+        func = db.confirm_match if action == "confirm" else db.delete_match
+        if func(match_id):
+            outcomes[match_id].append(action)
+
+    jobs = [("confirm" if i % 2 else "reject", match_id) for i in range(THREADS) for match_id in match_ids]
+    random.Random(2).shuffle(jobs)
+    run_threads(press, [jobs[i::THREADS] for i in range(THREADS)])
+
+    cur = database.connect().cursor()
+    cur.execute("SELECT id FROM matches WHERE confirmed = 1")
+    rated = {row[0] for row in cur.fetchall()}
+    cur.execute("SELECT DISTINCT match_id FROM rating_events WHERE match_type = 'single'")
+    assert {row[0] for row in cur.fetchall()} == rated
+    for match_id, done in outcomes.items():
+        # Ровно одно нажатие срабатывает: либо подтверждение, либо отклонение
+        assert done == (["confirm"] if match_id in rated else ["reject"])
+    assert_ledger_consistent(database)
@@ -0,0 +1,78 @@
+import pytest
+
+
+# ⌛ Истечение неподтверждённых матчей: 1x1 удаляется, 2x2 получает статус expired,
+# а сообщения с кнопками из pending_messages возвращаются, чтобы бот их снял
+@pytest.fixture
+def ttl(database, monkeypatch):
+    monkeypatch.setattr(database, "MATCH_TTL_HOURS", 1)
+
+
+def backdate(database, table, match_id, hours=2):
+    conn = database.connect()
+    with conn:
+        conn.execute(f"UPDATE {table} SET timestamp = datetime('now', '-{hours} hours') WHERE id = ?", (match_id,))
+
+
+def pending_messages(database):
+    return database.connect().execute("SELECT * FROM pending_messages ORDER BY 1, 2, 3").fetchall()
+
+
+def test_nothing_expires_without_ttl(database, players):
+    match_id = database.record_match(players[0], players[1], 11, 5, players[0])
+    backdate(database, "matches", match_id, hours=24 * 365)
+    assert database.expire_matches() == (0, [])
+    assert database.confirm_match(match_id)
+
+
+def test_expired_matches_return_their_messages(database, players, ttl):
+    single = database.record_match(players[0], players[1], 11, 5, players[0])
+    team = database.record_team_match(*players, 11, 9)
+    fresh = database.record_match(players[2], players[3], 11, 5, players[2])
+    assert database.remember_message("single", single, 2, 100)
+    assert database.remember_message("team", team, 2, 101)
+    assert database.remember_message("team", team, 3, 102)
+    assert database.remember_message("single", fresh, 4, 103)
+    backdate(database, "matches", single)
+    backdate(database, "team_matches", team)
+
+    count, messages = database.expire_matches()
+    assert count == 2
+    assert sorted(messages) == [(2, 100), (2, 101), (3, 102)]
+    assert database.get_match(single) is None
+    assert database.get_team_match(team)[-1] == database.TEAM_EXPIRED
+    assert pending_messages(database) == [("single", fresh, 4, 103)]
+    # Повторная очистка ничего не находит, свежий матч подтверждается как обычно
+    assert database.expire_matches() == (0, [])
+    assert database.confirm_match(fresh)
+    assert pending_messages(database) == []
+
+
+def test_overdue_match_cannot_be_confirmed_before_the_sweep(database, players, ttl):
+    match_id = database.record_match(players[0], players[1], 11, 5, players[0])
+    database.remember_message("single", match_id, 2, 100)
+    backdate(database, "matches", match_id)
+    assert database.confirm_match(match_id) is None
+    assert database.get_player_by_id(players[0])[3] == 1500
+    assert database.expire_matches() == (1, [(2, 100)])
+
+
+def test_expire_limit(database, players, ttl):
+    for _ in range(3):
+        backdate(database, "matches", database.record_match(players[0], players[1], 11, 5, players[0]))
+    assert database.expire_matches(limit=2)[0] == 2
+    assert database.expire_matches(limit=2)[0] == 1
+
+
+def test_messages_are_remembered_only_for_pending_matches(database, players):
+    single = database.record_match(players[0], players[1], 11, 5, players[0])
+    team = database.record_team_match(*players, 11, 9)
+    database.remember_message("single", single, 2, 100)
+    database.remember_message("team", team, 2, 101)
+    database.confirm_match(single)
+    database.reject_team_match(team, 3)
+    # Подтверждение и отклонение сами убирают сообщения, запоздавшие не сохраняются
+    assert pending_messages(database) == []
+    assert not database.remember_message("single", single, 2, 100)
+    assert not database.remember_message("team", team, 3, 102)
+    assert pending_messages(database) == []
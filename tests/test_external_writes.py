@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from src.store import AsyncRatingStore
+
+
+# 🔄 Рейтинги, изменённые другим процессом (CLI src.recompute, src.seasons, импорт),
+# не должны отдаваться из кэшей бота
+@pytest.fixture
+def checks_every_call(database, monkeypatch):
+    monkeypatch.setattr(database, "EXTERNAL_CHECK_SECONDS", 0)
+
+
+def write_outside(database, sql, *params):
+    conn = sqlite3.connect(database.DB_NAME)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+def test_own_writes_keep_caches(database, players, checks_every_call):
+    database.sync_external_writes()
+    database.confirm_match(database.record_match(players[0], players[1], 11, 5, players[0]))
+    assert database.sync_external_writes() == 0
+    assert database.player_cache().get_by_id(players[0]) is not None
+
+
+def test_external_write_drops_player_cache_and_index(database, players, checks_every_call):
+    database.get_player_by_id(players[1])
+    database.suggest_opponents(players[0], 1500)
+    write_outside(database, "UPDATE players SET rating = 1700 WHERE id = ?", players[1])
+    assert database.get_player_by_id(players[1])[3] == 1700
+    assert database.external_generation() == 1
+    assert (players[1], "player2", 1700) in database.suggest_opponents(players[0], 1700)
+
+
+def test_external_write_reloads_leaderboard(database, players, checks_every_call):
+    async def scenario():
+        store = AsyncRatingStore(database.DB_NAME)
+        try:
+            assert (await store.get_leaderboard()).page(1)[1][0][2] == 1500
+            write_outside(database, "UPDATE players SET rating = 1600 WHERE id = ?", players[3])
+            leaderboard = await store.get_leaderboard()
+            assert leaderboard.page(1)[1][0] == (1, "player4", 1600)
+            assert leaderboard.position("player4") == 1
+        finally:
+            store.close()
+
+    asyncio.run(scenario())
+
+
+def test_check_is_rate_limited(database, players):
+    database.sync_external_writes()
+    write_outside(database, "UPDATE players SET rating = 1600 WHERE id = ?", players[3])
+    # В пределах EXTERNAL_CHECK_SECONDS кэш ещё отдаётся без проверки
+    assert database.sync_external_writes() == 0
+
+
+def test_rollover_from_another_process_is_seen_without_snapshot(database, players, checks_every_call):
+    async def scenario():
+        store = AsyncRatingStore(database.DB_NAME)
+        try:
+            assert await store.confirm_match(await store.record_match(players[0], players[1], 11, 5, players[0]))
+            assert (await store.get_leaderboard()).page(1)[1][0][2] > 1500
+            # python -m src.seasons rollover — другое соединение, снимков в это время нет
+            thread = threading.Thread(target=lambda: (database.rollover_season(0), database.close_connections()))
+            thread.start()
+            thread.join()
+            _, rows = (await store.get_leaderboard()).page(1)
+            assert {rating for _, _, rating in rows} == {1500}
+            assert (await store.get_player_by_id(players[0]))[3] == 1500
+        finally:
+            store.close()
+
+    asyncio.run(scenario())
+
+
+def test_external_engine_change_is_seen(database, players, checks_every_call):
+    assert database.get_rating_engine().name == "elo"
+    # python -m src.ratings engine glicko2 — другой процесс
+    write_outside(database, "INSERT INTO settings (key, value) VALUES ('rating_engine', 'glicko2')")
+    database.get_player_by_id(players[0])
+    assert database.get_rating_engine().name == "glicko2"
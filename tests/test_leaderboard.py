@@ -0,0 +1,80 @@
+import asyncio
+
+from src.leaderboard import Leaderboard
+from src.store import AsyncRatingStore
+
+
+# 🏆 Таблица рейтинга: страницы, места игроков и сброс кэша только по делу
+def board(count, page_size=3):
+    leaderboard = Leaderboard(page_size)
+    leaderboard.load([(f"player{i}", 2000 - i) for i in range(1, count + 1)], leaderboard.version)
+    return leaderboard
+
+
+def test_pages_are_clamped():
+    leaderboard = board(7)
+    assert leaderboard.pages == 3
+    assert leaderboard.page(1) == (1, [(1, "player1", 1999), (2, "player2", 1998), (3, "player3", 1997)])
+    assert leaderboard.page(3) == (3, [(7, "player7", 1993)])
+    assert leaderboard.page(0)[0] == 1
+    assert leaderboard.page(99)[0] == 3
+    assert board(0).page(5) == (1, [])
+    assert board(6).pages == 2
+
+
+def test_position_and_neighbours():
+    leaderboard = board(7)
+    assert leaderboard.position("player5") == 5
+    assert leaderboard.position("nobody") is None
+    assert leaderboard.around(1) == [(1, "player1", 1999), (2, "player2", 1998), (3, "player3", 1997)]
+    assert [row[0] for row in leaderboard.around(7)] == [5, 6, 7]
+
+
+def test_players_without_username_have_no_position():
+    leaderboard = Leaderboard()
+    leaderboard.load([(None, 1600), ("player2", 1500)], leaderboard.version)
+    assert leaderboard.position(None) is None
+    assert leaderboard.position("player2") == 2
+
+
+def test_load_started_before_invalidate_is_reloaded():
+    leaderboard = Leaderboard()
+    version = leaderboard.version
+    leaderboard.invalidate()
+    # Прочитанная до сброса таблица показывается, но не считается актуальной
+    leaderboard.load([("player1", 1500)], version)
+    assert len(leaderboard) == 1
+    assert not leaderboard.loaded
+
+
+def test_store_reloads_only_after_rating_changes(database, players, monkeypatch):
+    loads = []
+    get_rating_table = database.get_rating_table
+    monkeypatch.setattr(database, "get_rating_table", lambda: loads.append(1) or get_rating_table())
+
+    async def scenario():
+        store = AsyncRatingStore(database.DB_NAME)
+        try:
+            # Параллельные запросы ждут одну загрузку
+            await asyncio.gather(*[store.get_leaderboard() for _ in range(5)])
+            assert len(loads) == 1
+            await store.get_player_by_id(players[0])
+            await store.record_match(players[0], players[1], 11, 5, players[0])
+            await store.get_leaderboard()
+            assert len(loads) == 1
+
+            assert await store.confirm_match(await store.record_match(players[1], players[0], 11, 5, players[1]))
+            leaderboard = await store.get_leaderboard()
+            assert len(loads) == 2
+            assert leaderboard.position("player2") == 1
+            assert leaderboard.position("player1") == 4
+
+            await store.register_player(5, "player5")
+            assert len(await store.get_leaderboard()) == 5
+            await store.update_username(5, "renamed")
+            assert (await store.get_leaderboard()).position("renamed") is not None
+            assert len(loads) == 4
+        finally:
+            store.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from src.notify import Notifier
+
+
+# 📬 Повтор после RetryAfter откладывается через call_later и не лежит в очереди:
+# stop должен его дождаться или отменить, а не потерять молча
+class FloodedBot:
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.attempts = 0
+        self.delivered = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "flood", self.retry_after)
+        self.delivered.append((chat_id, text))
+
+
+def test_stop_waits_for_scheduled_retry():
+    async def scenario():
+        bot = FloodedBot(retry_after=0.05)
+        notifier = Notifier(bot, chat_interval=0)
+        notifier.start()
+        notifier.send(1, "hello")
+        await asyncio.sleep(0.01)
+        assert notifier.pending == 1
+        await notifier.stop(timeout=5)
+        return bot, notifier
+
+    bot, notifier = asyncio.run(scenario())
+    assert bot.delivered == [(1, "hello")]
+    assert notifier.retried == 1
+    assert notifier.pending == 0
+
+
+def test_stop_cancels_retry_after_timeout():
+    async def scenario():
+        bot = FloodedBot(retry_after=60)
+        notifier = Notifier(bot, chat_interval=0)
+        notifier.start()
+        notifier.send(1, "hello")
+        await notifier.stop(timeout=0.05)
+        await asyncio.sleep(0.01)
+        return bot, notifier
+
+    bot, notifier = asyncio.run(scenario())
+    assert bot.attempts == 1
+    assert bot.delivered == []
+    assert notifier.pending == 0
@@ -0,0 +1,64 @@
+import pytest
+
+
+# 🔍 Горячие запросы не должны читать таблицы целиком, а таблица рейтинга — сортироваться
+# во временном дереве. SQL берётся из трассировки настоящих функций базы, план — через
+# EXPLAIN QUERY PLAN
+def query_plans(database, executed):
+    cur = database.connect().cursor()
+    plans = []
+    for sql in executed:
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        cur.execute("EXPLAIN QUERY PLAN " + sql)
+        plans.append((sql, [row[3] for row in cur.fetchall()]))
+    assert plans, "функция не выполнила ни одного SELECT"
+    return plans
+
+
+def assert_no_full_scans(plans):
+    for sql, details in plans:
+        for detail in details:
+            # SCAN CONSTANT ROW — SELECT без FROM, например сумма двух подзапросов
+            full_scan = detail.startswith("SCAN") and "USING" not in detail and detail != "SCAN CONSTANT ROW"
+            assert not full_scan, f"{detail}\n{sql}"
+
+
+@pytest.mark.parametrize("lookup", [
+    lambda db, players: db.get_player_by_username("nobody"),
+    lambda db, players: db.get_player_by_telegram_id(999),
+    lambda db, players: db.get_games_played(players[0]),
+    lambda db, players: db.get_rating_table(),
+    lambda db, players: db.get_match_players(1),
+    lambda db, players: db.get_team_match(1),
+    lambda db, players: db.get_rating_history(players[0]),
+    lambda db, players: db.get_player_stats(players[0]),
+], ids=[
+    "player_by_username", "player_by_telegram_id", "games_played", "rating_table",
+    "match_players", "team_match", "rating_history", "player_stats",
+])
+def test_hot_lookups_use_indexes(database, players, statements, lookup):
+    lookup(database, players)
+    assert_no_full_scans(query_plans(database, statements))
+
+
+def test_rating_table_is_read_in_index_order(database, players, statements):
+    database.get_rating_table()
+    (_, details), = query_plans(database, statements)
+    assert details == ["SCAN players USING INDEX idx_players_rating"]
+
+
+def test_games_played_uses_participant_indexes(database, players, statements):
+    database.get_games_played(players[0])
+    (_, details), = query_plans(database, statements)
+    used = " ".join(details)
+    assert "idx_matches_player1" in used and "idx_matches_player2" in used
+
+
+def test_expiry_sweep_reads_only_pending_rows(database, players, statements, monkeypatch):
+    monkeypatch.setattr(database, "MATCH_TTL_HOURS", 48)
+    database.expire_matches()
+    plans = query_plans(database, statements)
+    assert_no_full_scans(plans)
+    used = " ".join(detail for _, details in plans for detail in details)
+    assert "idx_matches_pending" in used and "idx_team_matches_pending" in used
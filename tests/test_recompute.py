@@ -0,0 +1,16 @@
+from src import recompute
+
+
+# 🔄 Пересчёт по истории обновляет не только базу, но и кэши процесса, который его запустил
+def test_recompute_updates_rating_index(database, players):
+    match_id = database.record_match(players[0], players[1], 11, 5, players[0])
+    database.confirm_match(match_id)
+    database.suggest_opponents(players[2], 1500)
+    # Матч «переигран» с другим победителем: пересчёт меняет рейтинги обоих
+    conn = database.connect()
+    with conn:
+        conn.execute("UPDATE matches SET winner_id = ? WHERE id = ?", (players[1], match_id))
+    ratings = recompute.replay(recompute.iter_confirmed_matches(conn))
+    recompute.apply_ratings(conn, recompute.diff_ratings(conn, ratings))
+    assert (players[1], "player2", ratings[players[1]]) in database.suggest_opponents(players[2], 1500, count=3)
+    assert database.get_player_by_id(players[0])[3] == ratings[players[0]]
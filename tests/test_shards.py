@@ -0,0 +1,34 @@
+import asyncio
+
+from src.shards import ShardResolver
+
+
+# 🏓 Фоновые задачи обходят все клубы, но не вытесняют из LRU те, которыми пользуются
+def test_borrow_does_not_promote_or_evict(database, tmp_path):
+    async def scenario():
+        shards = ShardResolver(str(tmp_path / "clubs"), capacity=2)
+        try:
+            for club_id in (-3, -4):
+                await shards.get(club_id)
+            active = [await shards.get(club_id) for club_id in (-1, -2)]
+            assert list(shards._open) == [-1, -2]
+
+            for club_id in shards.club_ids():
+                async with shards.borrow(club_id) as store:
+                    assert await store.expire_matches() == (0, [])
+                    if club_id in (-1, -2):
+                        assert store is active[-1 - club_id]
+            assert list(shards._open) == [-1, -2]
+            assert all(store.opened for store in active)
+        finally:
+            shards.close()
+
+    asyncio.run(scenario())
+
+
+def test_club_ids_skip_stray_files(tmp_path):
+    clubs = tmp_path / "clubs"
+    clubs.mkdir()
+    for name in ("-100123.sqlite3", "-100123.backup.sqlite3", "notes.txt", "5.sqlite3-wal"):
+        (clubs / name).touch()
+    assert ShardResolver(str(clubs)).club_ids() == [-100123]
@@ -0,0 +1,77 @@
+import re
+
+PLAYERS = re.compile(r"\bplayers\b")
+
+
+# 🧾 Подтверждение матча читает всех участников одним запросом и пишет рейтинги
+# в одной транзакции — без запроса на каждого игрока и без повторного чтения настроек
+def reads(executed):
+    return [sql for sql in executed if sql.lstrip().upper().startswith("SELECT")]
+
+
+def player_reads(executed):
+    return [sql for sql in reads(executed) if PLAYERS.search(sql)]
+
+
+def rating_updates(executed):
+    return [sql for sql in executed if sql.lstrip().startswith("UPDATE players SET rating")]
+
+
+def transactions(executed):
+    return [sql for sql in executed if sql in ("BEGIN IMMEDIATE", "COMMIT")]
+
+
+def test_match_players_is_one_statement(database, players, statements):
+    match_id = database.record_match(players[0], players[1], 11, 5, players[0])
+    statements.clear()
+    assert [p[0] for p in database.get_match_players(match_id)] == players[:2]
+    assert len(statements) == 1
+
+
+def test_confirm_match_statement_budget(database, players, statements):
+    # Весь 1x1 целиком: BEGIN, UPDATE-защита, очистка pending_messages, одно чтение
+    # участников, по строке на игрока в журнал, рейтинги и статистику, COMMIT.
+    # Система рейтинга из settings читается один раз на базу, а не на каждое подтверждение
+    assert database.confirm_match(database.record_match(players[0], players[1], 11, 5, players[0]))
+    match_id = database.record_match(players[0], players[1], 11, 5, players[0])
+    statements.clear()
+    assert database.confirm_match(match_id) == [(players[0], 1), (players[1], 2)]
+    assert len(statements) == 11
+    assert len(reads(statements)) == 1
+    assert len(player_reads(statements)) == 1
+    assert len(rating_updates(statements)) == 2
+    assert transactions(statements) == ["BEGIN IMMEDIATE", "COMMIT"]
+
+
+def test_rating_engine_setting_is_cached(database, players, statements):
+    database.get_rating_engine()
+    statements.clear()
+    assert database.confirm_match(database.record_match(players[0], players[1], 11, 5, players[0]))
+    assert not [sql for sql in statements if "settings" in sql]
+    # Смена системы рейтинга сразу видна следующему подтверждению
+    database.set_rating_engine("glicko2")
+    statements.clear()
+    assert database.confirm_match(database.record_match(players[0], players[1], 11, 5, players[0]))
+    assert not [sql for sql in statements if "settings" in sql]
+    assert [sql for sql in statements if sql.startswith("UPDATE players SET rd")]
+
+
+def test_repeated_confirm_stops_after_guard(database, players, statements):
+    match_id = database.record_match(players[0], players[1], 11, 5, players[0])
+    assert database.confirm_match(match_id)
+    statements.clear()
+    assert not database.confirm_match(match_id)
+    assert not reads(statements)
+    assert not rating_updates(statements)
+
+
+def test_last_team_confirmation_reads_players_once(database, players, statements):
+    match_id = database.record_team_match(*players, 11, 5)
+    for telegram_id in (2, 3):
+        assert database.confirm_team_participant(match_id, telegram_id) == (True, database.TEAM_PARTIAL)
+    statements.clear()
+    assert database.confirm_team_participant(match_id, 4) == (True, database.TEAM_FINALIZED)
+    assert len(reads(statements)) <= 3
+    assert len(player_reads(statements)) == 1
+    assert len(rating_updates(statements)) == 4
+    assert transactions(statements) == ["BEGIN IMMEDIATE", "COMMIT"]
@@ -0,0 +1,70 @@
+from src.stats import STATS_COLUMNS, match_stats_rows, rebuild_player_stats
+
+
+# 📈 player_stats обновляется при подтверждении матчей и совпадает с пересборкой по истории
+def stats_of(database, player_id):
+    return dict(zip(STATS_COLUMNS, database.get_player_stats(player_id)))
+
+
+def test_match_stats_rows():
+    singles = match_stats_rows(0, [(1, 1516)], [(2, 1484)], 11, 5)
+    assert singles == [
+        (1, 1, 1, 0, 1, 1, 0, 0, 11, 5, 1, 1516),
+        (2, 1, 0, 1, 1, 0, 0, 0, 5, 11, -1, 1500),
+    ]
+    doubles = match_stats_rows(1, [(1, 1510), (2, 1490)], [(3, 1500), (4, 1500)], 11, 9)
+    assert [row[:8] for row in doubles] == [
+        (1, 1, 1, 0, 0, 0, 1, 1), (2, 1, 1, 0, 0, 0, 1, 1),
+        (3, 1, 0, 1, 0, 0, 1, 0), (4, 1, 0, 1, 0, 0, 1, 0),
+    ]
+
+
+def test_confirmed_matches_update_stats(database, players):
+    a, b = players[:2]
+    assert database.get_player_stats(a) is None
+    for winner, score in ((a, (11, 5)), (a, (11, 9)), (b, (7, 11))):
+        database.confirm_match(database.record_match(a, b, *score, winner))
+    stats = stats_of(database, a)
+    assert (stats["games"], stats["wins"], stats["losses"]) == (3, 2, 1)
+    assert (stats["singles_games"], stats["singles_wins"], stats["doubles_games"]) == (3, 2, 0)
+    assert (stats["points_for"], stats["points_against"]) == (29, 25)
+    assert stats["streak"] == -1
+    assert stats["peak_rating"] == max(event[3] for event in database.get_rating_history(a))
+    assert stats_of(database, b)["streak"] == 1
+    # Неподтверждённый матч статистику не трогает
+    database.record_match(a, b, 11, 0, a)
+    assert stats_of(database, a)["games"] == 3
+
+
+def test_finalized_team_match_updates_stats(database, players):
+    match_id = database.record_team_match(*players, 11, 9)
+    database.confirm_team_participant(match_id, 2)
+    database.confirm_team_participant(match_id, 3)
+    assert database.get_player_stats(players[0]) is None
+    database.confirm_team_participant(match_id, 4)
+    for pid, won in zip(players, (1, 1, 0, 0)):
+        stats = stats_of(database, pid)
+        assert (stats["games"], stats["wins"], stats["doubles_games"], stats["doubles_wins"]) == (1, won, 1, won)
+        assert stats["streak"] == (1 if won else -1)
+
+
+def test_incremental_stats_match_rebuild(database, players):
+    a, b, c, d = players
+    database.confirm_match(database.record_match(a, b, 11, 5, a))
+    match_id = database.record_team_match(a, c, b, d, 8, 11)
+    for telegram_id in (2, 3, 4):
+        database.confirm_team_participant(match_id, telegram_id)
+    database.confirm_match(database.record_match(c, a, 11, 3, c))
+    database.confirm_match(database.record_match(a, d, 11, 6, a))
+    incremental = {pid: database.get_player_stats(pid) for pid in players}
+
+    conn = database.connect()
+    with conn:
+        # Пересборка идёт по времени матчей с точностью до секунды: разводим их по порядку подтверждения
+        cur = conn.cursor()
+        confirmed = [("matches", 1), ("team_matches", 1), ("matches", 2), ("matches", 3)]
+        for minute, (table, match_id) in enumerate(confirmed):
+            cur.execute(f"UPDATE {table} SET timestamp = datetime('now', '-{10 - minute} minutes') WHERE id = ?",
+                        (match_id,))
+        assert rebuild_player_stats(cur) == 4
+    assert {pid: database.get_player_stats(pid) for pid in players} == incremental
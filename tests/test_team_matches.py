@@ -0,0 +1,74 @@
+import pytest
+
+
+# 👥 Матч 2x2 как конечный автомат: pending → partial → finalized, либо rejected или expired.
+# Из конечных состояний переходов нет, рейтинги меняются только при finalized
+@pytest.fixture
+def match_id(database, players):
+    return database.record_team_match(*players, 11, 9)
+
+
+def status_of(database, match_id):
+    return database.get_team_match(match_id)[-1]
+
+
+def ratings(database, players):
+    return [database.get_player_by_id(pid)[3] for pid in players]
+
+
+def test_confirmations_move_pending_to_finalized(database, players, match_id):
+    assert status_of(database, match_id) == database.TEAM_PENDING
+    assert database.confirm_team_participant(match_id, 2) == (True, database.TEAM_PARTIAL)
+    # Повторное нажатие того же игрока ничего не меняет
+    assert database.confirm_team_participant(match_id, 2) == (False, database.TEAM_PARTIAL)
+    assert database.confirm_team_participant(match_id, 3) == (True, database.TEAM_PARTIAL)
+    assert ratings(database, players) == [1500] * 4
+    assert database.confirm_team_participant(match_id, 4) == (True, database.TEAM_FINALIZED)
+    assert status_of(database, match_id) == database.TEAM_FINALIZED
+    team1, team2 = ratings(database, players)[:2], ratings(database, players)[2:]
+    assert min(team1) > 1500 > max(team2)
+
+
+def test_author_and_outsiders(database, players, match_id):
+    # Автор подтвердил матч созданием, посторонний игрок и несуществующий матч — статус None
+    assert database.confirm_team_participant(match_id, 1) == (False, database.TEAM_PENDING)
+    database.register_player(5, "player5")
+    assert database.confirm_team_participant(match_id, 5) == (False, None)
+    assert database.confirm_team_participant(match_id + 1, 2) == (False, None)
+    assert database.reject_team_match(match_id, 5) == (False, None, [])
+
+
+def test_finalized_match_is_final(database, players, match_id):
+    for telegram_id in (2, 3, 4):
+        database.confirm_team_participant(match_id, telegram_id)
+    after = ratings(database, players)
+    assert database.reject_team_match(match_id, 3) == (False, database.TEAM_FINALIZED, [])
+    assert database.confirm_team_participant(match_id, 4) == (False, database.TEAM_FINALIZED)
+    assert ratings(database, players) == after
+    assert len(database.get_rating_history(players[0])) == 1
+
+
+@pytest.mark.parametrize("confirmed", [(), (2,), (2, 3)])
+def test_reject_from_pending_or_partial(database, players, match_id, confirmed):
+    for telegram_id in confirmed:
+        database.confirm_team_participant(match_id, telegram_id)
+    assert database.reject_team_match(match_id, 4) == (True, database.TEAM_REJECTED, [1, 2, 3, 4])
+    assert database.confirm_team_participant(match_id, 4) == (False, database.TEAM_REJECTED)
+    assert database.reject_team_match(match_id, 2) == (False, database.TEAM_REJECTED, [])
+    assert ratings(database, players) == [1500] * 4
+    assert database.get_player_stats(players[0]) is None
+
+
+def test_overdue_match_is_expired_before_the_sweep(database, players, match_id, monkeypatch):
+    database.confirm_team_participant(match_id, 2)
+    monkeypatch.setattr(database, "MATCH_TTL_HOURS", 1)
+    conn = database.connect()
+    with conn:
+        conn.execute("UPDATE team_matches SET timestamp = datetime('now', '-2 hours') WHERE id = ?", (match_id,))
+    assert database.confirm_team_participant(match_id, 3) == (False, database.TEAM_EXPIRED)
+    assert database.reject_team_match(match_id, 3) == (False, database.TEAM_EXPIRED, [])
+    assert status_of(database, match_id) == database.TEAM_PARTIAL
+    assert database.expire_matches()[0] == 1
+    assert status_of(database, match_id) == database.TEAM_EXPIRED
+    assert database.confirm_team_participant(match_id, 4) == (False, database.TEAM_EXPIRED)
+    assert ratings(database, players) == [1500] * 4
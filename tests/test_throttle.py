@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.callbacks import Payload
+from src.middlewares import DeduplicationMiddleware, ThrottlingMiddleware, command_of
+from src.throttle import RateLimiter, TTLSet
+
+
+# 🪣 Лимиты команд и кнопок, отбрасывание повторов. Время — ручные часы, без sleep
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_allows_burst_then_refills():
+    clock = Clock()
+    limiter = RateLimiter(rate=2, burst=3, clock=clock)
+    assert [limiter.take("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("a") == 0.5
+    # Другой ключ — своя корзина
+    assert limiter.take("b") == 0
+    clock.now = 0.5
+    assert limiter.take("a") == 0
+    assert limiter.take("a") > 0
+
+
+def test_rate_limiter_evicts_oldest_bucket():
+    limiter = RateLimiter(rate=1, burst=1, capacity=2, clock=Clock())
+    for key in ("a", "b", "c"):
+        limiter.take(key)
+    assert len(limiter) == 2
+    # Вытесненная корзина начинается заново — полной
+    assert limiter.take("a") == 0
+
+
+def test_ttl_set_forgets_keys_after_ttl():
+    clock = Clock()
+    seen = TTLSet(ttl=10, capacity=2, clock=clock)
+    assert seen.add(1)
+    assert not seen.add(1)
+    clock.now = 10
+    assert seen.add(1)
+    assert seen.add(2) and seen.add(3)
+    assert len(seen) == 2
+    assert seen.add(1)
+
+
+class Event:
+    def __init__(self, user_id, text=None, update_id=0, callback_id=None):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = text
+        self.update_id = update_id
+        self.callback_query = SimpleNamespace(id=callback_id) if callback_id else None
+        self.answers = []
+
+    async def answer(self, text=None):
+        self.answers.append(text)
+
+
+def feed(middleware, events, payload=None):
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    async def scenario():
+        for event in events:
+            await middleware(handler, event, {"payload": payload} if payload else {})
+
+    asyncio.run(scenario())
+    return handled
+
+
+def test_command_of():
+    assert command_of(Event(1, "/Match@maria_bot @b 3:1")) == "match"
+    assert command_of(Event(1, "/rating")) == "rating"
+    assert command_of(Event(1, "привет")) is None
+    assert command_of(Event(1, "/")) is None
+
+
+def test_commands_are_throttled_per_user_and_command():
+    middleware = ThrottlingMiddleware(RateLimiter(rate=0.1, burst=2, clock=Clock()))
+    spam = [Event(1, "/rating") for _ in range(4)]
+    handled = feed(middleware, spam + [Event(1, "/whoami"), Event(2, "/rating"), Event(1, "текст")])
+    assert len(handled) == 5
+    assert spam[2].answers == ["⏳ Слишком много команд, подожди 10 с."]
+    # Предупреждение — не чаще раза в warn_interval
+    assert spam[3].answers == []
+
+
+def test_repeated_match_button_press_is_dropped():
+    middleware = ThrottlingMiddleware(RateLimiter(rate=100, burst=100, clock=Clock()))
+    presses = [Event(2), Event(2)]
+    assert feed(middleware, presses, Payload("confirm", 0, 7, 2)) == presses[:1]
+    assert presses[1].answers == [None]
+    # Листание рейтинга — законные повторы, их ограничивает только лимит
+    pages = [Event(2), Event(2)]
+    assert feed(middleware, pages, Payload("rating", 0, 2)) == pages
+
+
+def test_throttled_button_gets_callback_answer():
+    middleware = ThrottlingMiddleware(RateLimiter(rate=0.5, burst=1, clock=Clock()))
+    pages = [Event(2), Event(2)]
+    assert feed(middleware, pages, Payload("rating", 0, 2)) == pages[:1]
+    assert pages[1].answers == ["⏳ Слишком часто, подожди 2 с."]
+
+
+def test_duplicate_updates_and_callbacks_are_dropped():
+    middleware = DeduplicationMiddleware()
+    first, redelivered = Event(1, update_id=10), Event(1, update_id=10)
+    press, repress = Event(2, update_id=11, callback_id="q"), Event(2, update_id=12, callback_id="q")
+    assert feed(middleware, [first, redelivered, press, repress]) == [first, press]
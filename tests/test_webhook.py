@@ -0,0 +1,51 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import SetWebhook
+from aiohttp import ClientSession, web
+
+from bench.stub import StubSession
+from bench.updates import message_update
+from src import webhook
+
+
+# 🌐 Вебхук всегда проверяет X-Telegram-Bot-Api-Secret-Token, даже без WEBHOOK_SECRET
+class RecordingSession(StubSession):
+    def __init__(self):
+        super().__init__()
+        self.methods = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.methods.append(method)
+        return await super().make_request(bot, method, timeout)
+
+
+def test_webhook_without_secret_uses_generated_one(monkeypatch):
+    apps = []
+    monkeypatch.setattr(web, "run_app", lambda app, **kwargs: apps.append(app))
+    session = RecordingSession()
+    bot = Bot(token="42:TEST", session=session)
+    webhook.run_webhook(Dispatcher(), bot, "https://example.org", "/webhook")
+    (app,) = apps
+
+    async def scenario():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        try:
+            (registered,) = [m for m in session.methods if isinstance(m, SetWebhook)]
+            assert registered.secret_token
+            url = "http://{}:{}/webhook".format(*runner.addresses[0][:2])
+            async with ClientSession() as http:
+                for headers, status in (
+                    ({}, 401),
+                    ({"X-Telegram-Bot-Api-Secret-Token": "wrong"}, 401),
+                    ({"X-Telegram-Bot-Api-Secret-Token": registered.secret_token}, 200),
+                ):
+                    async with http.post(url, json=message_update(1, "/start"), headers=headers) as response:
+                        assert response.status == status
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())